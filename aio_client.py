@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+import grpc
+
+import file_transfer_pb2
+import file_transfer_pb2_grpc
+from config import (NODE_BANDWIDTH_BYTES_PER_SEC, CHANNEL_READY_TIMEOUT, CHUNK_VERIFY_RETRIES, COMPRESSION_ENABLED,
+                    PEER_HEALTH_TTL)
+from channel_pool import CHANNEL_OPTIONS
+from bandwidth_shaper import shaper
+from chunk_reader import ChunkReader, WireChunk, serialize_chunk
+from grpc_client import GRPCClient, shard_for
+import checksums
+import compression
+
+
+class AsyncGRPCClient:
+    """grpc.aio counterpart of GRPCClient, for driving many transfers from one event loop.
+
+    A single client can run any number of calls at once: it keeps one channel
+    per port open until close(). Files are streamed (or sent as TransferChunk
+    calls to servers without StreamFile) and compressed as negotiated.
+    Resumable sessions, chunk-store dedup and adaptive chunk sizing stay with
+    the threaded client. Reading, hashing, compressing and bandwidth shaping
+    of each chunk run in the loop's default executor, so the loop itself only
+    serializes and sends.
+    """
+
+    # Same fixed chunk sizing as the threaded client
+    _calculate_chunk_parameters = GRPCClient._calculate_chunk_parameters
+
+    def __init__(self, target_host='localhost'):
+        self.target_host = target_host
+        self.channels = {}
+        self.health = {}  # port -> (HealthResponse, when it came)
+
+        # Transfer parameters
+        self.bandwidth_bytes_per_sec = NODE_BANDWIDTH_BYTES_PER_SEC
+        self.target_chunk_time = 0.1
+        self.min_chunk_size = 1024 * 64
+        self.max_chunk_size = 5 * 1024 * 1024  # 5MB max chunk size
+        self.shaper = shaper
+        self.use_streaming = True
+
+    def _channel(self, port: int):
+        channel = self.channels.get(port)
+        if channel is None:
+            channel = grpc.aio.insecure_channel(f'{self.target_host}:{port}', options=CHANNEL_OPTIONS)
+            self.channels[port] = channel
+        return channel
+
+    def _file_transfer_stub(self, port: int):
+        return file_transfer_pb2_grpc.FileTransferServiceStub(self._channel(port))
+
+    def _node_mgmt_stub(self, port: int):
+        return file_transfer_pb2_grpc.NodeManagementServiceStub(self._channel(port))
+
+    async def connect(self, port: int) -> bool:
+        """Wait for the channel to port to come up"""
+        try:
+            await asyncio.wait_for(self._channel(port).channel_ready(), CHANNEL_READY_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        """Close every channel the client opened"""
+        channels, self.channels = self.channels, {}
+        for channel in channels.values():
+            await channel.close()
+
+    async def peer_health(self, port: int):
+        """The HealthResponse of the server on port, asked again after PEER_HEALTH_TTL, None if it didn't answer"""
+        cached = self.health.get(port)
+        if cached and time.monotonic() - cached[1] < PEER_HEALTH_TTL:
+            return cached[0]
+        try:
+            health = await self._node_mgmt_stub(port).HealthCheck(file_transfer_pb2.Empty(),
+                                                                  timeout=CHANNEL_READY_TIMEOUT)
+        except grpc.RpcError:
+            # Not remembered, a server that missed one call gets asked again by the next transfer
+            self.health.pop(port, None)
+            return None
+        self.health[port] = (health, time.monotonic())
+        return health
+
+    async def peer_codecs(self, port: int) -> list:
+        """Codecs the server on port can decompress"""
+        health = await self.peer_health(port) if COMPRESSION_ENABLED else None
+        return list(health.compression) if health else []
+
+    async def peer_checksum_types(self, port: int) -> list:
+        """Checksums the server on port verifies at full speed, empty if it doesn't say"""
+        health = await self.peer_health(port)
+        return list(health.checksum_types) if health else []
+
+    async def transfer_port(self, port: int, routing_key: str) -> int:
+        """Port to send a transfer to: the shard handling routing_key if port is a router front, else port"""
+        health = await self.peer_health(port)
+        shard_ports = list(health.shard_ports) if health else []
+        if not shard_ports:
+            return port
+        shard_port = shard_ports[shard_for(routing_key, len(shard_ports))]
+        if await self.connect(shard_port):
+            return shard_port
+        # The router may have come back on other shard ports, ask it again next time.
+        # Until then the front routes the transfer
+        self.health.pop(port, None)
+        return port
+
+    async def send_file(self, file_path: str, filename: str, target_node: str, sender_node: str, port: int,
+                        replication_factor: int = 0) -> str:
+        """Send a file to a target node via gRPC"""
+        if not os.path.exists(file_path):
+            return f"Error: File {file_path} not found"
+
+        if not await self.connect(port):
+            return f"Error: Could not connect to target on port {port}"
+
+        try:
+            port = await self.transfer_port(port, target_node or filename)
+            response, stats = await self._transfer(file_path, filename, target_node, sender_node, port,
+                                                   replication_factor)
+            if not response.success:
+                return f"Transfer failed"
+
+            summary = stats.summary()
+            return f"✓ {filename} sent to {target_node}" + (f" ({summary})" if summary else "")
+        except grpc.RpcError:
+            return f"✗ Transfer failed"
+        except Exception:
+            return f"✗ Transfer failed"
+
+    async def _transfer(self, file_path, filename, target_node, sender_node, port, replication_factor=0):
+        """Send a file, returning the final TransferResponse and the transfer's compression stats"""
+        channel = self._channel(port)
+        if self.use_streaming:
+            stream_file = channel.stream_unary(
+                '/file_transfer.FileTransferService/StreamFile',
+                request_serializer=serialize_chunk,
+                response_deserializer=file_transfer_pb2.TransferResponse.FromString)
+            try:
+                # A one-shot stream has nothing to resume, so a corrupt one is sent again whole
+                checksum_type = checksums.choose(await self.peer_checksum_types(port))
+                for _ in range(CHUNK_VERIFY_RETRIES + 1):
+                    stats = compression.TransferStats(compression.choose(await self.peer_codecs(port)))
+                    response = await stream_file(self._iter_chunks(file_path, filename, target_node, sender_node,
+                                                                   replication_factor=replication_factor,
+                                                                   stats=stats, checksum_type=checksum_type))
+                    if not response.verification_failed:
+                        break
+                return response, stats
+            except grpc.RpcError as e:
+                # Older servers don't implement StreamFile, use the chunked path
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+
+        return await self._send_file_chunked(file_path, filename, target_node, sender_node, port,
+                                             replication_factor)
+
+    async def _send_file_chunked(self, file_path, filename, target_node, sender_node, port, replication_factor=0):
+        """Send a file with StartTransfer / TransferChunk / CompleteTransfer"""
+        stub = self._file_transfer_stub(port)
+        transfer_chunk = self._channel(port).unary_unary(
+            '/file_transfer.FileTransferService/TransferChunk',
+            request_serializer=serialize_chunk,
+            response_deserializer=file_transfer_pb2.TransferResponse.FromString)
+
+        start_response = await stub.StartTransfer(file_transfer_pb2.TransferRequest(
+            filename=filename,
+            file_size=os.path.getsize(file_path),
+            target_node=target_node,
+            sender_node=sender_node,
+            replication_factor=replication_factor,
+            compression=compression.choose(compression.supported()),
+            checksum_type=checksums.preferred_type()
+        ))
+        stats = compression.TransferStats(start_response.compression)
+        checksum_type = start_response.checksum_type or checksums.CHECKSUM_CRC32
+        if not start_response.success:
+            return start_response, stats
+
+        transfer_id = start_response.transfer_id
+        response = start_response
+        try:
+            async for chunk in self._iter_chunks(file_path, filename, target_node, sender_node, transfer_id,
+                                                 replication_factor, stats, checksum_type):
+                # Resend a chunk while it fails verification
+                for _ in range(CHUNK_VERIFY_RETRIES + 1):
+                    response = await transfer_chunk(chunk)
+                    if chunk.chunk_number not in response.corrupt_chunks:
+                        break
+                if not response.success:
+                    return response, stats
+        finally:
+            # A failed transfer is completed too, so the receiver drops the session instead of holding it
+            try:
+                await stub.CompleteTransfer(file_transfer_pb2.CompleteTransferRequest(
+                    transfer_id=transfer_id,
+                    filename=filename,
+                    target_node=target_node
+                ))
+            except grpc.RpcError:
+                pass
+        return response, stats
+
+    async def _iter_chunks(self, file_path, filename, target_node, sender_node, transfer_id="",
+                           replication_factor=0, stats=None, checksum_type=checksums.CHECKSUM_CRC32):
+        """Yield FileChunk messages (as WireChunks) for a file, each prepared in the executor"""
+        loop = asyncio.get_running_loop()
+        buckets = self.shaper.buckets_for(sender_node, target_node)
+        digest = hashlib.sha256()
+
+        with ChunkReader(file_path) as reader:
+            chunk_size, num_chunks = self._calculate_chunk_parameters(reader.size)
+            for chunk_num in range(1, num_chunks + 1):
+                offset = (chunk_num - 1) * chunk_size
+                codec, chunk_data, checksum = await loop.run_in_executor(
+                    None, self._prepare_chunk, reader, offset, chunk_size, digest, stats, buckets, checksum_type)
+
+                yield WireChunk(
+                    chunk_data,
+                    transfer_id=transfer_id,
+                    chunk_number=chunk_num,
+                    total_chunks=num_chunks,
+                    filename=filename,
+                    target_node=target_node,
+                    sender_node=sender_node,
+                    replication_factor=replication_factor,
+                    offset=offset,
+                    checksum=checksum,
+                    checksum_type=checksum_type,
+                    file_digest=digest.hexdigest() if chunk_num == num_chunks else "",
+                    compression=codec
+                )
+
+    def _prepare_chunk(self, reader, offset, chunk_size, digest, stats, buckets, checksum_type):
+        """The blocking part of sending a chunk: read, hash, compress and wait for bandwidth"""
+        # Copied out of the mapping here, so page faults don't stall the loop
+        chunk_data = bytes(reader.read(offset, chunk_size))
+        digest.update(chunk_data)
+
+        # Simulate bandwidth limitation
+        self.shaper.throttle(buckets, len(chunk_data))
+
+        codec, chunk_data = stats.encode(chunk_data) if stats else (compression.COMPRESSION_NONE, chunk_data)
+        return codec, chunk_data, checksums.checksum(chunk_data, checksum_type)
+
+    async def get_file_info(self, filename: str, port: int) -> Optional[dict]:
+        """Get information about a file on the target node"""
+        try:
+            response = await self._file_transfer_stub(port).GetFileInfo(
+                file_transfer_pb2.FileInfoRequest(filename=filename))
+            return {
+                'exists': response.exists,
+                'size': response.size,
+                'message': response.message
+            }
+        except grpc.RpcError:
+            return None
+
+    async def list_files(self, port: int) -> Optional[list]:
+        """List files on the target node"""
+        try:
+            response = await self._file_transfer_stub(port).ListFiles(file_transfer_pb2.ListFilesRequest(path=""))
+            return [{
+                'name': file_entry.name,
+                'size': file_entry.size,
+                'is_directory': file_entry.is_directory
+            } for file_entry in response.files]
+        except grpc.RpcError:
+            return None
+
+    async def register_node(self, node_name: str, ip_address: str, port: int, router_port: int) -> bool:
+        """Register a node with the router"""
+        try:
+            response = await self._node_mgmt_stub(router_port).RegisterNode(file_transfer_pb2.NodeRegistration(
+                node_name=node_name,
+                ip_address=ip_address,
+                port=port
+            ))
+            return response.success
+        except grpc.RpcError:
+            return False
+
+    async def unregister_node(self, node_name: str, ip_address: str, port: int, router_port: int) -> bool:
+        """Unregister a node from the router"""
+        try:
+            response = await self._node_mgmt_stub(router_port).UnregisterNode(file_transfer_pb2.NodeRegistration(
+                node_name=node_name,
+                ip_address=ip_address,
+                port=port
+            ))
+            return response.success
+        except grpc.RpcError:
+            return False
+
+    async def get_active_nodes(self, router_port: int) -> Optional[list]:
+        """Get list of active nodes from the router"""
+        try:
+            response = await self._node_mgmt_stub(router_port).GetActiveNodes(file_transfer_pb2.Empty())
+            return list(response.node_names)
+        except grpc.RpcError:
+            return None
+
+    async def health_check(self, port: int) -> bool:
+        """Whether the gRPC server on port is up and reports itself healthy"""
+        if not await self.connect(port):
+            return False
+        try:
+            return (await self._node_mgmt_stub(port).HealthCheck(file_transfer_pb2.Empty())).healthy
+        except grpc.RpcError:
+            return False
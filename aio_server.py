@@ -0,0 +1,228 @@
+"""grpc.aio flavour of the gRPC server, selected with GRPC_SERVER_MODE = "aio" (router.py --aio).
+
+Every RPC is a coroutine on one event loop, so a call waiting on the network
+(a slow sender's next chunk, a peer's response) holds no thread. Anything that
+blocks (chunk writes, commits, replication waits, forward queue hand-offs)
+runs on a pool of AIO_EXECUTOR_WORKERS threads. The servicers reuse the
+threaded ones' logic unchanged and only decide what runs where.
+"""
+import asyncio
+import gc
+import os
+import threading
+from concurrent import futures
+
+import grpc
+
+import file_transfer_pb2
+import file_transfer_pb2_grpc
+from config import AIO_EXECUTOR_WORKERS, STARTUP_TIMEOUT
+from grpc_server import (FileTransferServicer, NodeManagementServicer, NodeControlServicer,
+                         SERVER_OPTIONS, bind_port)
+
+
+class AsyncFileTransferServicer(FileTransferServicer):
+    def __init__(self, node_name, disk_path, router_manager=None, executor=None):
+        super().__init__(node_name, disk_path, router_manager)
+        self.executor = executor
+
+    async def _offload(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def StartTransfer(self, request, context):
+        return await self._offload(super().StartTransfer, request, context)
+
+    async def TransferChunk(self, request, context):
+        return await self._offload(super().TransferChunk, request, context)
+
+    async def CompleteTransfer(self, request, context):
+        return await self._offload(super().CompleteTransfer, request, context)
+
+    async def QueryTransfer(self, request, context):
+        return await self._offload(super().QueryTransfer, request, context)
+
+    async def GetFileInfo(self, request, context):
+        return await self._offload(super().GetFileInfo, request, context)
+
+    async def ListFiles(self, request, context):
+        return await self._offload(super().ListFiles, request, context)
+
+    async def StreamFile(self, request_iterator, context):
+        """Receive a whole file over a single client-streaming call, a thread only per chunk write"""
+        stream = self._new_stream()
+        try:
+            async for chunk in request_iterator:
+                # Chunks of a resumable session go into that session
+                if stream['file'] is None and chunk.transfer_id:
+                    return await self._receive_session_stream_async(chunk, request_iterator)
+                error = await self._offload(self._stream_chunk, stream, chunk)
+                if error:
+                    return error
+            return await self._offload(self._finish_stream, stream)
+        except Exception as e:
+            return self._stream_failed(stream, e)
+        finally:
+            await self._offload(self._close_stream, stream)
+
+    async def _receive_session_stream_async(self, first_chunk, request_iterator):
+        """Feed a streamed batch of chunks into the resumable session the first one names"""
+        transfer_id = first_chunk.transfer_id
+        transfer_info = await self._offload(self._get_session, transfer_id)
+        if transfer_info is None:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Transfer session {transfer_id} not found",
+                transfer_id=transfer_id
+            )
+
+        async def chunks():
+            yield first_chunk
+            async for chunk in request_iterator:
+                yield chunk
+
+        response = None
+        corrupt_chunks = []
+        try:
+            async for chunk in chunks():
+                response = await self._offload(self._receive_chunk, transfer_id, transfer_info, chunk)
+                if response.corrupt_chunks:
+                    # Keep going, the sender resends corrupt chunks with the other gaps
+                    corrupt_chunks.extend(response.corrupt_chunks)
+                elif not response.success:
+                    return response
+            return self._session_stream_result(transfer_id, transfer_info, response, corrupt_chunks)
+        finally:
+            await self._offload(self._end_session_stream, transfer_info)
+
+
+class AsyncNodeManagementServicer(NodeManagementServicer):
+    """Node bookkeeping only takes short locks, so it runs on the loop itself"""
+
+    async def RegisterNode(self, request, context):
+        # except registering, which queues the files held for the node and may wait for queue space
+        return await asyncio.get_running_loop().run_in_executor(None, super().RegisterNode, request, context)
+
+    async def UnregisterNode(self, request, context):
+        return super().UnregisterNode(request, context)
+
+    async def GetActiveNodes(self, request, context):
+        return super().GetActiveNodes(request, context)
+
+    async def HealthCheck(self, request, context):
+        return super().HealthCheck(request, context)
+
+
+class AsyncNodeControlServicer(NodeControlServicer):
+    def __init__(self, node, executor=None):
+        super().__init__(node)
+        self.executor = executor
+
+    async def RunCommand(self, request, context):
+        # Commands send files and wait for downloads, well off the loop
+        return await asyncio.get_running_loop().run_in_executor(self.executor, super().RunCommand,
+                                                                request, context)
+
+
+class AsyncGRPCServer:
+    """GRPCServer's interface over a grpc.aio server.
+
+    The event loop runs in its own thread, so start(), stop() and
+    wait_for_termination() block their caller just like GRPCServer's.
+    """
+
+    def __init__(self, node_name, disk_path, port, is_router=False, router_manager=None, node=None):
+        self.node_name = node_name
+        self.disk_path = disk_path
+        self.port = port
+        self.is_router = is_router
+        self.router_manager = router_manager
+        self.node = node
+        self.server = None
+        self.loop = None
+        self.loop_thread = None
+        self.executor = None
+
+        # Ensure disk path exists
+        os.makedirs(disk_path, exist_ok=True)
+
+    def start(self):
+        """Start the event loop and the server on it, returns None if the server didn't come up"""
+        self.executor = futures.ThreadPoolExecutor(max_workers=AIO_EXECUTOR_WORKERS,
+                                                   thread_name_prefix=f"{self.node_name}-io")
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name=f"{self.node_name}-aio",
+                                            daemon=True)
+        self.loop_thread.start()
+
+        try:
+            self.server = self._run(self._start(), STARTUP_TIMEOUT)
+        except Exception as e:
+            print(f"Failed to start gRPC server for {self.node_name} on port {self.port}: {e}")
+            self.server = None
+        if self.server is None:
+            self._close_loop()
+            return None
+
+        if self.is_router:
+            print(f"gRPC server (asyncio) started for {self.node_name} on port {self.port}")
+        return self.server
+
+    async def _start(self):
+        server = grpc.aio.server(options=SERVER_OPTIONS)
+        file_transfer_servicer = AsyncFileTransferServicer(self.node_name, self.disk_path, self.router_manager,
+                                                           self.executor)
+        file_transfer_pb2_grpc.add_FileTransferServiceServicer_to_server(file_transfer_servicer, server)
+        file_transfer_pb2_grpc.add_NodeManagementServiceServicer_to_server(
+            AsyncNodeManagementServicer(self.router_manager if self.is_router else None,
+                                        file_transfer_servicer.chunk_store), server
+        )
+        if self.node:
+            file_transfer_pb2_grpc.add_NodeControlServiceServicer_to_server(
+                AsyncNodeControlServicer(self.node, self.executor), server
+            )
+
+        if not bind_port(server, self.port):
+            return None
+        await server.start()
+        return server
+
+    def _run(self, coroutine, timeout=None):
+        """Run a coroutine on the server's loop from another thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def stop(self, grace=5):
+        """Stop the server, giving in-flight RPCs up to grace seconds to finish"""
+        if self.server:
+            self._run(self._stop(grace))
+            print(f"gRPC server stopped for {self.node_name}")
+        self._close_loop()
+
+    async def _stop(self, grace):
+        await self.server.stop(grace)
+        # grpc shuts its completion queue poller down once the last aio server or channel is
+        # freed. That has to happen here, on the running loop: from another thread it races
+        # the poller's loop callback, after loop.close() it can't unregister from the loop
+        self.server = None
+        await self._close_channels()
+        gc.collect()
+        # Let the callbacks the shutdown left behind run before the loop stops
+        await asyncio.sleep(0)
+
+    async def _close_channels(self):
+        """Close the aio channels the server opened, none here"""
+
+    def _close_loop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = None
+        if self.executor:
+            # Work still queued belongs to RPCs that were cut off, nothing waits for it
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def wait_for_termination(self):
+        """Wait for server termination"""
+        if self.server:
+            self._run(self.server.wait_for_termination())
@@ -0,0 +1,145 @@
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows, buckets stay per process
+    fcntl = None
+
+from config import (NODE_BANDWIDTH_BYTES_PER_SEC, LINK_BANDWIDTH_BYTES_PER_SEC, ROUTER_BANDWIDTH_BYTES_PER_SEC,
+                    SHAPER_BURST_BYTES, SHAPER_STATE_PATH)
+
+ROUTER_NODE = "router"  # the router's own hops draw from this node's bucket
+
+_ARRIVAL = struct.Struct("d")
+
+
+class TokenBucket:
+    """Token bucket tracked as a theoretical arrival time (GCRA).
+
+    Reservations are handed out in arrival order, so concurrent transfers
+    draining the same bucket interleave chunk by chunk and share its rate.
+    Time spent in the actual RPC counts towards the budget, so a slow call
+    is never followed by an extra sleep.
+    """
+
+    def __init__(self, rate: float, burst: int = SHAPER_BURST_BYTES):
+        self.rate = rate
+        self.burst = burst
+        self.arrival = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> float:
+        """Reserve nbytes of capacity, returning the monotonic time they may be sent at"""
+        with self.lock:
+            now = time.monotonic()
+            self.arrival = max(self.arrival, now) + nbytes / self.rate
+            return self.arrival - self.burst / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose arrival time lives in a small memory-mapped file.
+
+    Every process opening the same file draws from the same bucket, so the
+    nodes on a link really share its capacity. The file holds wall-clock time,
+    the one clock every process agrees on, and an exclusive flock makes each
+    reservation atomic across processes.
+    """
+
+    def __init__(self, path, rate: float, burst: int = SHAPER_BURST_BYTES):
+        super().__init__(rate, burst)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < _ARRIVAL.size:
+            os.ftruncate(self.fd, _ARRIVAL.size)
+        self.map = mmap.mmap(self.fd, _ARRIVAL.size)
+
+    def reserve(self, nbytes: int) -> float:
+        # flock doesn't exclude threads sharing the descriptor, the thread lock does
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                arrival = max(_ARRIVAL.unpack_from(self.map)[0], now) + nbytes / self.rate
+                _ARRIVAL.pack_into(self.map, 0, arrival)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return time.monotonic() + (arrival - now) - self.burst / self.rate
+
+
+class BandwidthShaper:
+    """Per-node and per-link token buckets built from the LinksManager topology.
+
+    With a state_path the buckets are SharedTokenBucket files there, shared by
+    every process of the simulation. Each hop is charged where its bytes go
+    out: a node's sends on its own uplink and the first link they cross, and
+    the router's forwards and relays on the router's uplink.
+    """
+
+    def __init__(self, node_rate=NODE_BANDWIDTH_BYTES_PER_SEC, link_rate=LINK_BANDWIDTH_BYTES_PER_SEC,
+                 router_rate=ROUTER_BANDWIDTH_BYTES_PER_SEC, state_path=SHAPER_STATE_PATH):
+        self.node_rate = node_rate
+        self.link_rate = link_rate
+        self.router_rate = router_rate
+        self.state_path = state_path if fcntl else None
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def buckets_for(self, sender_node, target_node=None) -> list:
+        """Buckets a transfer from sender_node to target_node draws from"""
+        if sender_node == ROUTER_NODE:
+            # The router isn't on any link, its hops only share its uplink
+            return [self._bucket(('node', ROUTER_NODE), self.router_rate)]
+
+        buckets = [self._bucket(('node', sender_node), self.node_rate)]
+
+        link_name = self._shared_link(sender_node, target_node) if target_node else None
+        if link_name:
+            buckets.append(self._bucket(('link', link_name), self._link_rate(link_name)))
+        return buckets
+
+    def throttle(self, buckets, nbytes: int):
+        """Block until nbytes may go out on every bucket"""
+        if not buckets:
+            return
+        send_at = max(bucket.reserve(nbytes) for bucket in buckets)
+        delay = send_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _bucket(self, key, rate):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = self._new_bucket(key, rate)
+            bucket.rate = rate
+            return bucket
+
+    def _new_bucket(self, key, rate):
+        if self.state_path:
+            kind, name = key
+            path = os.path.join(self.state_path, f"{kind}-{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}")
+            try:
+                os.makedirs(self.state_path, exist_ok=True)
+                return SharedTokenBucket(path, rate)
+            except OSError:
+                pass  # an unwritable state directory leaves the bucket to this process
+        return TokenBucket(rate)
+
+    def _link_rate(self, link_name):
+        from links_manager import topology  # local import
+        attrs = topology().link_attributes(link_name)
+        return attrs['bandwidth'] if attrs else self.link_rate
+
+    @staticmethod
+    def _shared_link(node_a, node_b):
+        """Link the transfer's first hop crosses, None if the nodes aren't linked at all"""
+        from links_manager import topology  # local import
+        links = topology()
+        return links.shared_link(node_a, node_b) or links.first_link(node_a, node_b)
+
+
+shaper = BandwidthShaper()
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import grpc
+
+from config import CHANNEL_IDLE_TIMEOUT, CHANNEL_KEEPALIVE_MS, CHANNEL_READY_TIMEOUT
+
+# Options shared by every pooled channel
+CHANNEL_OPTIONS = [
+    ('grpc.max_send_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.max_receive_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.max_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.keepalive_time_ms', CHANNEL_KEEPALIVE_MS),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+
+class ChannelPool:
+    """Process-wide pool of long-lived gRPC channels keyed by host:port"""
+
+    def __init__(self, idle_timeout=CHANNEL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, target: str) -> grpc.Channel:
+        """Borrow the pooled channel for target, creating it on first use"""
+        now = time.monotonic()
+        with self.lock:
+            self._evict_idle(now)
+
+            entry = self.channels.get(target)
+            if entry is None:
+                entry = {
+                    'channel': grpc.insecure_channel(target, options=CHANNEL_OPTIONS),
+                    'state': None,
+                    'users': 0,
+                    'last_used': now
+                }
+                # Track connectivity so ready channels skip the readiness wait
+                entry['callback'] = lambda state, entry=entry: entry.__setitem__('state', state)
+                entry['channel'].subscribe(entry['callback'], try_to_connect=False)
+                self.channels[target] = entry
+
+            entry['users'] += 1
+            entry['last_used'] = now
+            return entry['channel']
+
+    def release(self, target: str):
+        """Return a channel borrowed with acquire, it stays open for reuse"""
+        with self.lock:
+            entry = self.channels.get(target)
+            if entry:
+                entry['users'] = max(0, entry['users'] - 1)
+                entry['last_used'] = time.monotonic()
+
+    def ensure_ready(self, target: str, timeout: float = CHANNEL_READY_TIMEOUT) -> bool:
+        """Wait for target's borrowed channel to connect, returns at once if it already is"""
+        with self.lock:
+            entry = self.channels.get(target)
+            if entry is None:
+                return False
+            if entry['state'] == grpc.ChannelConnectivity.READY:
+                return True
+            channel = entry['channel']
+
+        try:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            return False
+
+    def close(self, target: str):
+        """Drop and close the channel for target"""
+        with self.lock:
+            entry = self.channels.pop(target, None)
+        if entry:
+            self._close_entry(entry)
+
+    def close_all(self):
+        """Close every pooled channel"""
+        with self.lock:
+            entries = list(self.channels.values())
+            self.channels = {}
+        for entry in entries:
+            self._close_entry(entry)
+
+    def _evict_idle(self, now):
+        """Close unborrowed channels nobody has used for idle_timeout seconds (caller holds lock)"""
+        for target, entry in list(self.channels.items()):
+            if entry['users'] == 0 and now - entry['last_used'] > self.idle_timeout:
+                del self.channels[target]
+                self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry):
+        entry['channel'].unsubscribe(entry['callback'])
+        entry['channel'].close()
+
+
+channel_pool = ChannelPool()
@@ -0,0 +1,78 @@
+import zlib
+
+import file_transfer_pb2
+
+try:
+    import google_crc32c  # optional, hardware-accelerated CRC32C
+except ImportError:
+    google_crc32c = None
+
+CHECKSUM_NONE = file_transfer_pb2.CHECKSUM_NONE
+CHECKSUM_CRC32C = file_transfer_pb2.CHECKSUM_CRC32C
+CHECKSUM_CRC32 = file_transfer_pb2.CHECKSUM_CRC32
+
+
+def _crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data) -> int:
+    """CRC32C (Castagnoli) of data"""
+    if google_crc32c is not None:
+        return google_crc32c.value(bytes(data))
+
+    # Slow path, only reached for chunks from senders that didn't negotiate (see choose)
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def supported():
+    """Checksums computed at full speed here, CRC32C only with google-crc32c installed"""
+    return [CHECKSUM_CRC32C, CHECKSUM_CRC32] if google_crc32c is not None else [CHECKSUM_CRC32]
+
+
+def preferred_type():
+    """Checksum senders attach to chunks: CRC32C when it is fast here, zlib CRC32 otherwise"""
+    return supported()[0]
+
+
+def choose(peer_types):
+    """Checksum for chunks to a peer verifying peer_types fast: CRC32C if both sides are, else CRC32.
+
+    zlib CRC32 is fast everywhere, so it is also the answer for peers that
+    don't advertise anything.
+    """
+    if CHECKSUM_CRC32C in peer_types and CHECKSUM_CRC32C in supported():
+        return CHECKSUM_CRC32C
+    return CHECKSUM_CRC32
+
+
+def accept(proposed):
+    """Checksum a receiver takes for a session: the sender's proposal if it is fast here, else CRC32"""
+    return proposed if proposed in supported() else CHECKSUM_CRC32
+
+
+def checksum(data, checksum_type) -> int:
+    if checksum_type == CHECKSUM_CRC32C:
+        return crc32c(data)
+    if checksum_type == CHECKSUM_CRC32:
+        return zlib.crc32(data)
+    return 0
+
+
+def verify(chunk) -> bool:
+    """Whether a FileChunk's data matches its checksum, chunks without one always pass"""
+    if chunk.checksum_type == CHECKSUM_NONE:
+        return True
+    return checksum(chunk.data, chunk.checksum_type) == chunk.checksum
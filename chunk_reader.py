@@ -0,0 +1,112 @@
+import mmap
+import os
+
+import file_transfer_pb2
+
+_DATA_TAG = bytes([(4 << 3) | 2])  # FileChunk.data, length-delimited
+
+
+class ChunkReader:
+    """Read-only view of a file for the send paths, without a read() copy per chunk.
+
+    The file is memory-mapped and chunks are memoryview slices of the
+    mapping, valid for as long as anything references them. Files that
+    can't be mapped (empty ones, or where mmap fails) are read with
+    os.pread instead, which returns a fresh bytes object per chunk.
+    Writers on this code base replace files rather than rewriting them in
+    place, so a mapping never sees its file shrink under it.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.size = os.fstat(self.fd).st_size
+        self.map = None
+        self.view = None
+        if self.size:
+            try:
+                self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+                self.view = memoryview(self.map)
+            except (OSError, ValueError):
+                self.map = None
+
+    def read(self, offset, length):
+        """length bytes from offset (fewer at the end of the file), as a memoryview or bytes"""
+        if self.view is not None:
+            return self.view[offset:offset + length]
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, length, offset)
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        return os.read(self.fd, length)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # chunks still queued for sending hold it, it goes away with them
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_source(source):
+    """Reader for a file path, or for a chunk-store file (chunk_store.StoredFile)"""
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return ChunkReader(source)
+    return source.open()
+
+
+def source_stat(source):
+    """os.stat of a file path, or st_size and st_mtime_ns of a chunk-store file"""
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return os.stat(source)
+    return source.stat()
+
+
+class WireChunk:
+    """A FileChunk whose data is any buffer, serialized without copying it into a message first.
+
+    Protobuf only takes bytes for data, which costs one copy into the
+    message and another when it's serialized. Here every other field is
+    serialized by protobuf and data is appended as field 4, which parsers
+    merge into the same message, so the bytes are copied once, straight
+    into the outgoing buffer. Field reads go to the underlying FileChunk.
+    """
+
+    __slots__ = ("header", "data")
+
+    def __init__(self, data, **fields):
+        self.header = file_transfer_pb2.FileChunk(**fields)
+        self.data = data
+
+    def __getattr__(self, name):
+        return getattr(self.header, name)
+
+    def SerializeToString(self):
+        if not len(self.data):
+            return self.header.SerializeToString()
+        return b"".join((self.header.SerializeToString(), _DATA_TAG, _varint(len(self.data)), self.data))
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def serialize_chunk(chunk):
+    """Request serializer that takes FileChunk messages and WireChunks alike"""
+    return chunk.SerializeToString()
@@ -0,0 +1,75 @@
+import threading
+
+from config import ADAPTIVE_CHUNK_STEP, ADAPTIVE_BACKOFF_FACTOR
+
+
+class ChunkSizeController:
+    """AIMD chunk size for one transfer, driven by the receiver's acks.
+
+    On the chunked path every TransferChunk response acks one chunk: chunks
+    acked faster than target_chunk_time grow the next one by a fixed step,
+    chunks slower than target_chunk_time * backoff halve it. A StreamFile
+    call is acked once, at the end, so its chunks keep the size the transfer
+    started at and only the call's throughput is fed back.
+    """
+
+    def __init__(self, sizer, key, chunk_size, min_chunk_size, max_chunk_size, target_chunk_time):
+        self.sizer = sizer
+        self.key = key
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_chunk_time = target_chunk_time
+
+    def record(self, nbytes: int, elapsed: float):
+        """Feed back how long a chunk of nbytes took from being sent to being acked"""
+        if elapsed > self.target_chunk_time * ADAPTIVE_BACKOFF_FACTOR:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        elif elapsed < self.target_chunk_time:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size + ADAPTIVE_CHUNK_STEP)
+
+        self.sizer.update(self.key, nbytes, elapsed)
+
+    def record_transfer(self, nbytes: int, elapsed: float):
+        """Feed back a whole transfer of nbytes acked after elapsed, without resizing this one"""
+        self.sizer.update(self.key, nbytes, elapsed)
+
+
+class AdaptiveChunkSizer:
+    """Per-destination throughput estimates shared across transfers.
+
+    A transfer starts at the chunk size that takes target_chunk_time at its
+    destination's estimated throughput.
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        self.smoothing = smoothing
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+    def controller(self, key, default_size, min_chunk_size, max_chunk_size, target_chunk_time) -> ChunkSizeController:
+        """Start a transfer to key sized from its throughput estimate, or at default_size before there is one"""
+        estimate = self.estimate(key)
+        if estimate:
+            chunk_size = min(max_chunk_size, max(min_chunk_size, int(estimate['throughput'] * target_chunk_time)))
+        else:
+            chunk_size = default_size
+        return ChunkSizeController(self, key, chunk_size, min_chunk_size, max_chunk_size, target_chunk_time)
+
+    def update(self, key, nbytes: int, elapsed: float):
+        """Fold one acked measurement into key's moving average throughput"""
+        if elapsed <= 0 or nbytes <= 0:
+            return
+        throughput = nbytes / elapsed
+        with self.lock:
+            estimate = self.estimates.setdefault(key, {'throughput': throughput})
+            estimate['throughput'] += self.smoothing * (throughput - estimate['throughput'])
+
+    def estimate(self, key):
+        """Current estimate for key, None before the first transfer"""
+        with self.lock:
+            estimate = self.estimates.get(key)
+            return dict(estimate) if estimate else None
+
+
+chunk_sizer = AdaptiveChunkSizer()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from types import SimpleNamespace
+
+from config import CHUNK_STORE_BLOCK_SIZE
+from disk_metadata import metadata_store
+
+# Serialises manifest writes against garbage collection across every store in the process
+_store_lock = threading.Lock()
+
+
+class MissingBlocksError(ValueError):
+    """Blocks a transfer skipped as already stored were collected before it was committed"""
+
+    def __init__(self, filename, indexes):
+        super().__init__(f"Blocks {sorted(indexes)} of {filename} are no longer stored")
+        self.indexes = indexes
+
+
+class ChunkStore:
+    """Content-addressed block store used by cloud nodes.
+
+    Files are split into fixed-size SHA-256 addressed blocks kept once under
+    .chunks/, and each file is a manifest under .manifests/ listing its
+    blocks, so identical content across files and versions is stored once.
+    How many manifest entries point at each block is counted in the disk's
+    metadata database, a block goes when its count drops to zero.
+    """
+
+    def __init__(self, root, block_size=CHUNK_STORE_BLOCK_SIZE):
+        self.root = root
+        self.block_size = block_size
+        self.blocks_path = os.path.join(root, ".chunks")
+        self.manifests_path = os.path.join(root, ".manifests")
+        self.metadata = metadata_store(root)
+
+    @staticmethod
+    def digest(data) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def has(self, digest) -> bool:
+        return os.path.exists(self._block_path(digest))
+
+    def read_block(self, digest) -> bytes:
+        with open(self._block_path(digest), 'rb') as f:
+            return f.read()
+
+    def put_block(self, data, digest=None) -> str:
+        """Store a block unless it is already held, returning its digest"""
+        digest = digest or self.digest(data)
+        block_path = self._block_path(digest)
+        if os.path.exists(block_path):
+            return digest
+
+        os.makedirs(os.path.dirname(block_path), exist_ok=True)
+        temp_path = f"{block_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, block_path)
+        return digest
+
+    def ingest(self, source_path, filename, held=None):
+        """Move a fully assembled file into the store, replacing any earlier version.
+
+        held maps block indexes to digests of blocks the store already had when
+        the transfer started; those regions of source_path are not read. Raises
+        MissingBlocksError if any of them has been collected since.
+        """
+        held = held or {}
+        file_size = os.path.getsize(source_path)
+        blocks = []
+
+        with open(source_path, 'rb') as f:
+            for index in range(max(1, -(-file_size // self.block_size))):
+                if index in held:
+                    blocks.append(held[index])
+                    continue
+                f.seek(index * self.block_size)
+                blocks.append(self.put_block(f.read(self.block_size)))
+
+            with _store_lock:
+                self._count_refs()
+                # A concurrent delete may have collected a block we skipped as present
+                missing = []
+                for index, digest in enumerate(blocks):
+                    if not self.has(digest):
+                        if index in held:
+                            missing.append(index)
+                            continue
+                        f.seek(index * self.block_size)
+                        self.put_block(f.read(self.block_size), digest)
+                if missing:
+                    raise MissingBlocksError(filename, missing)
+
+                previous = self.manifest(filename)
+                self._write_manifest(filename, {'size': file_size, 'block_size': self.block_size,
+                                                'blocks': blocks})
+                self._collect(blocks, previous['blocks'] if previous else ())
+
+        os.remove(source_path)
+        # A plain copy left over from before the store would shadow the new version
+        try:
+            os.remove(os.path.join(self.root, filename))
+        except FileNotFoundError:
+            pass
+
+    def manifest(self, filename):
+        """The manifest of filename, None if the store doesn't hold it"""
+        try:
+            with open(self._manifest_path(filename), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def exists(self, filename) -> bool:
+        return os.path.exists(self._manifest_path(filename))
+
+    def size(self, filename):
+        manifest = self.manifest(filename)
+        return manifest['size'] if manifest else None
+
+    def list_files(self) -> dict:
+        """Map every file held by the store to its size"""
+        files = {}
+        if not os.path.isdir(self.manifests_path):
+            return files
+        for entry in os.scandir(self.manifests_path):
+            if entry.name.endswith(".json"):
+                filename = entry.name[:-len(".json")]
+                size = self.size(filename)
+                if size is not None:
+                    files[filename] = size
+        return files
+
+    def read_file(self, filename):
+        """Yield the contents of filename block by block"""
+        manifest = self.manifest(filename)
+        if manifest is None:
+            raise FileNotFoundError(filename)
+        for digest in manifest['blocks']:
+            yield self.read_block(digest)
+
+    def open(self, filename):
+        """filename as a StoredFile the send paths read straight from the blocks, None if the store doesn't hold it"""
+        try:
+            mtime_ns = os.stat(self._manifest_path(filename)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        manifest = self.manifest(filename)
+        return StoredFile(self, filename, manifest, mtime_ns) if manifest else None
+
+    def remove(self, filename) -> bool:
+        """Drop a file's manifest and any blocks no other file references"""
+        with _store_lock:
+            self._count_refs()
+            manifest = self.manifest(filename)
+            if manifest is None:
+                return False
+            os.remove(self._manifest_path(filename))
+            self._collect((), manifest['blocks'])
+        return True
+
+    def _collect(self, added, removed):
+        """Count the blocks of a written manifest in and those of a replaced or
+        removed one out, deleting the blocks nothing references any more
+        (caller holds _store_lock)"""
+        for digest in self.metadata.update_block_refs(added, removed):
+            try:
+                os.remove(self._block_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _count_refs(self):
+        """Count the references of a store written before they were kept, from its manifests (caller holds _store_lock)"""
+        if self.metadata.has_block_refs():
+            return
+        blocks = []
+        for filename in self.list_files():
+            manifest = self.manifest(filename)
+            if manifest:
+                blocks.extend(manifest['blocks'])
+        if blocks:
+            self.metadata.update_block_refs(blocks)
+
+    def _write_manifest(self, filename, manifest):
+        os.makedirs(self.manifests_path, exist_ok=True)
+        manifest_path = self._manifest_path(filename)
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _block_path(self, digest):
+        return os.path.join(self.blocks_path, digest[:2], digest)
+
+    def _manifest_path(self, filename):
+        return os.path.join(self.manifests_path, f"{filename}.json")
+
+
+class StoredFile:
+    """A chunk-store file handed to the send paths in place of a plain file's path.
+
+    GRPCClient opens it through chunk_reader.open_source and stats it
+    through chunk_reader.source_stat, so it is sent from its blocks
+    without being reassembled on disk first.
+    """
+
+    def __init__(self, store, filename, manifest, mtime_ns):
+        self.store = store
+        self.filename = filename
+        self.manifest = manifest
+        self.mtime_ns = mtime_ns
+
+    def stat(self):
+        return SimpleNamespace(st_size=self.manifest['size'], st_mtime_ns=self.mtime_ns)
+
+    def open(self):
+        return BlockReader(self.store, self.manifest)
+
+    def __str__(self):
+        return os.path.join(self.store.root, self.filename)
+
+
+class BlockReader:
+    """ChunkReader over a StoredFile, reading each block from the store once.
+
+    A read within one block is a memoryview slice of it, one that spans
+    blocks is joined into a new bytes object.
+    """
+
+    def __init__(self, store, manifest):
+        self.store = store
+        self.blocks = manifest['blocks']
+        self.block_size = manifest['block_size']
+        self.size = manifest['size']
+        self.index = None
+        self.block = None
+
+    def read(self, offset, length):
+        """length bytes from offset (fewer at the end of the file), as a memoryview or bytes"""
+        length = max(0, min(length, self.size - offset))
+        parts = []
+        while length > 0:
+            index, start = divmod(offset, self.block_size)
+            part = self._block(index)[start:start + length]
+            parts.append(part)
+            offset += len(part)
+            length -= len(part)
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+    def _block(self, index):
+        if index != self.index:
+            self.block = memoryview(self.store.read_block(self.blocks[index]))
+            self.index = index
+        return self.block
+
+    def close(self):
+        self.block = None
+        self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def local_file(disk_path, filename):
+    """What to send filename from on a node's disk: its path, or its StoredFile if it lives in the chunk store"""
+    file_path = os.path.join(disk_path, filename)
+    if os.path.exists(file_path):
+        return file_path
+    return ChunkStore(disk_path).open(filename) or file_path
@@ -0,0 +1,152 @@
+import time
+import zlib
+
+import file_transfer_pb2
+from config import (COMPRESSION_ENABLED, COMPRESSION_PREFERENCE, COMPRESSION_MIN_SAVING, COMPRESSION_SAMPLE_SIZE,
+                    GZIP_LEVEL)
+
+try:
+    import zstandard  # optional
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame  # optional
+except ImportError:
+    lz4 = None
+
+COMPRESSION_NONE = file_transfer_pb2.COMPRESSION_NONE
+COMPRESSION_GZIP = file_transfer_pb2.COMPRESSION_GZIP
+COMPRESSION_ZSTD = file_transfer_pb2.COMPRESSION_ZSTD
+COMPRESSION_LZ4 = file_transfer_pb2.COMPRESSION_LZ4
+
+_NAMES = {
+    COMPRESSION_NONE: "none",
+    COMPRESSION_GZIP: "gzip",
+    COMPRESSION_ZSTD: "zstd",
+    COMPRESSION_LZ4: "lz4",
+}
+_CODECS = {name: codec for codec, name in _NAMES.items()}
+
+
+def name(codec) -> str:
+    return _NAMES.get(codec, str(codec))
+
+
+def supported():
+    """Codecs this process can compress and decompress"""
+    codecs = [COMPRESSION_GZIP]
+    if zstandard is not None:
+        codecs.append(COMPRESSION_ZSTD)
+    if lz4 is not None:
+        codecs.append(COMPRESSION_LZ4)
+    return codecs
+
+
+def choose(peer_codecs):
+    """Codec to send with: the first of COMPRESSION_PREFERENCE both sides support, NONE otherwise"""
+    if not COMPRESSION_ENABLED:
+        return COMPRESSION_NONE
+    codecs = set(supported()) & set(peer_codecs)
+    for preferred in COMPRESSION_PREFERENCE:
+        codec = _CODECS.get(preferred)
+        if codec in codecs:
+            return codec
+    return COMPRESSION_NONE
+
+
+def accept(codec):
+    """Codec a receiver answers a proposal with, NONE when it can't decode the proposed one"""
+    return codec if codec in supported() else COMPRESSION_NONE
+
+
+def compress(data, codec) -> bytes:
+    if codec == COMPRESSION_GZIP:
+        # wbits 31 writes a gzip header and trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    if codec == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    if codec == COMPRESSION_LZ4:
+        return lz4.frame.compress(data)
+    return data
+
+
+def decompress(data, codec) -> bytes:
+    """Original bytes of a chunk's data, raises ValueError if the codec is unknown here or the data is corrupt"""
+    if codec == COMPRESSION_NONE:
+        return data
+    if codec not in supported():
+        raise ValueError(f"unsupported compression {name(codec)}")
+    try:
+        if codec == COMPRESSION_GZIP:
+            return zlib.decompress(data, 31)
+        if codec == COMPRESSION_ZSTD:
+            return zstandard.ZstdDecompressor().decompress(data)
+        return lz4.frame.decompress(data)
+    except Exception as e:
+        raise ValueError(f"corrupt {name(codec)} data: {e}") from e
+
+
+class TransferStats:
+    """Compresses the chunks of one transfer and counts what it saved and what it cost.
+
+    The first COMPRESSION_SAMPLE_SIZE bytes of the first non-empty chunk are
+    the sample: if they don't shrink by COMPRESSION_MIN_SAVING the file is
+    taken as incompressible and every chunk goes raw. After that, any single
+    chunk that doesn't shrink enough is sent raw too, so compressed data
+    never costs more than the original.
+    """
+
+    def __init__(self, codec=COMPRESSION_NONE):
+        self.proposed = codec
+        self.codec = codec
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.cpu_seconds = 0.0
+        self.sampled = False
+
+    def encode(self, data):
+        """Returns (codec, data) for sending one chunk"""
+        self.raw_bytes += len(data)
+        if self.codec == COMPRESSION_NONE or not len(data):
+            self.wire_bytes += len(data)
+            return COMPRESSION_NONE, data
+
+        # Thread CPU time, the transport's other threads don't count against the codec
+        started = time.thread_time()
+        if not self.sampled:
+            self.sampled = True
+            sample = data[:COMPRESSION_SAMPLE_SIZE]
+            packed = compress(sample, self.codec)
+            if len(packed) > len(sample) * (1 - COMPRESSION_MIN_SAVING):
+                self.cpu_seconds += time.thread_time() - started
+                self.codec = COMPRESSION_NONE
+                self.wire_bytes += len(data)
+                return COMPRESSION_NONE, data
+            if len(sample) < len(data):
+                packed = compress(data, self.codec)
+        else:
+            packed = compress(data, self.codec)
+        self.cpu_seconds += time.thread_time() - started
+
+        codec = self.codec
+        if len(packed) > len(data) * (1 - COMPRESSION_MIN_SAVING):
+            codec, packed = COMPRESSION_NONE, data
+        self.wire_bytes += len(packed)
+        return codec, packed
+
+    @property
+    def saved_bytes(self):
+        return self.raw_bytes - self.wire_bytes
+
+    def summary(self):
+        """One-line report for the transfer, None if compression was never on the table"""
+        if self.proposed == COMPRESSION_NONE:
+            return None
+        if self.codec == COMPRESSION_NONE:
+            return f"{name(self.proposed)}: skipped as incompressible, {self.cpu_seconds:.3f}s CPU on the sample"
+        mb = 1024 * 1024
+        ratio = self.saved_bytes / self.raw_bytes if self.raw_bytes else 0
+        return (f"{name(self.codec)}: {self.raw_bytes / mb:.1f} MB → {self.wire_bytes / mb:.1f} MB, "
+                f"{ratio:.0%} saved, {self.cpu_seconds:.3f}s CPU")
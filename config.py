@@ -20,4 +20,82 @@ SERVER_GRPC_PORT = 8000
 SERVER_SOCKET_PORT = 9999
 SERVER_DISK_PATH = os.path.join(BASE_DIR, "assets/server/")
 
-CLOUD_NODES = {"cloud1", "cloud2", "cloud3"}
\ No newline at end of file
+CLOUD_NODES = {"cloud1", "cloud2", "cloud3"}
+UPLOAD_WRITE_QUORUM = 2         # cloud acks an upload waits for, the rest finish in the background
+FAN_OUT_READ_AHEAD = 16         # chunks a fan-out upload reads ahead of its fastest target
+ROUTER_SIDE_REPLICATION = True  # upload once and let the router fan out to the clouds
+REPLICATION_ACK_TIMEOUT = 10    # seconds an upload's response waits for the replica quorum, later replicas show as pending
+REPLICATION_WAITERS = 4         # uploads holding a server thread to wait for their quorum at once, others answer pending
+
+# Router forwarding pipeline
+FORWARD_WORKERS = 4             # forwarder threads draining the queue
+FORWARD_QUEUE_SIZE = 256        # completed files waiting to be forwarded
+FORWARD_PER_TARGET_LIMIT = 2    # concurrent forwards to the same node
+FORWARD_ENQUEUE_TIMEOUT = 5     # seconds a receiver waits for queue space
+CUT_THROUGH_ENABLED = True      # relay chunks to online targets while they arrive
+
+# Pooled gRPC client channels
+CHANNEL_IDLE_TIMEOUT = 300      # seconds before an unused channel is closed
+CHANNEL_KEEPALIVE_MS = 30000    # keepalive ping interval on pooled channels
+CHANNEL_READY_TIMEOUT = 5       # seconds to wait for a channel to connect
+PEER_HEALTH_TTL = 60            # seconds a server's HealthCheck answer (codecs, shard ports, ...) is reused
+
+# Simulated bandwidth (token-bucket shaper)
+NODE_BANDWIDTH_BYTES_PER_SEC = 125_000_000   # each node's uplink
+LINK_BANDWIDTH_BYTES_PER_SEC = 125_000_000   # shared by every transfer on a link
+ROUTER_BANDWIDTH_BYTES_PER_SEC = 1_250_000_000  # the router's uplink, shared by its forwards and cut-through relays
+SHAPER_BURST_BYTES = 1024 * 1024             # bytes a bucket lets through without waiting
+SHAPER_STATE_PATH = os.path.join(BASE_DIR, "assets/.shaper/")  # bucket state shared by every process
+
+# Adaptive chunk sizing
+ADAPTIVE_CHUNK_SIZING = True    # grow/shrink chunks per destination from acked chunks and transfers
+ADAPTIVE_CHUNK_STEP = 256 * 1024  # additive increase per chunk acked within target_chunk_time
+ADAPTIVE_BACKOFF_FACTOR = 1.5   # halve the chunk once it takes this many times target_chunk_time
+
+# Resumable transfers
+RESUMABLE_MIN_SIZE = 8 * 1024 * 1024   # files at least this big are sent as resumable sessions
+RESUME_RETRIES = 3                      # times a sender re-queries the gaps after a dropped call
+RESUMABLE_SESSION_TTL = 24 * 3600       # seconds an abandoned session is kept on the receiver
+
+# Content-addressed chunk store on cloud nodes
+CHUNK_STORE_ENABLED = True                 # clouds keep files as manifests of deduplicated blocks
+CHUNK_STORE_BLOCK_SIZE = 1024 * 1024       # block size, also the chunk size of transfers to a cloud
+
+# Transfer integrity
+CHUNK_VERIFY_RETRIES = 3        # resends of a chunk (or a whole one-shot stream) that failed verification
+
+# In-memory disk index
+DISK_INDEX_RESCAN_INTERVAL = 30   # seconds before ls rescans even if no directory mtime moved
+
+# Multi-hop routing over links
+MULTI_HOP_ROUTING = True          # relay node-to-node transfers through intermediate nodes without a shared link
+ROUTING_METRIC = "cost"           # "cost" or "latency" for shortest paths, "bandwidth" for widest paths
+DEFAULT_LINK_COST = 1             # cost of a link created without one
+DEFAULT_LINK_LATENCY_MS = 0       # latency of a link created without one
+
+# Process lifecycle
+STARTUP_TIMEOUT = 10              # seconds a process waits for its gRPC server before giving up
+SHUTDOWN_GRACE = 30               # seconds in-flight transfers get to finish on SIGTERM
+DOWNLOAD_TIMEOUT = 60             # seconds download waits for the file to land before reporting it in progress
+
+# Synthetic payloads (touch / trunc)
+PAYLOAD_DEFAULT_KIND = "sparse"   # sparse, alloc (preallocated), zero, pattern or random
+PAYLOAD_BUFFER_SIZE = 1024 * 1024 # bytes generated per write, memory use stays at one buffer
+
+# Transfer compression
+COMPRESSION_ENABLED = True        # negotiate a codec per transfer, chunks of incompressible files go raw
+COMPRESSION_PREFERENCE = ("zstd", "lz4", "gzip")  # first codec both sides support wins
+COMPRESSION_MIN_SAVING = 0.1      # a chunk is sent compressed only if it shrinks by at least this fraction
+COMPRESSION_SAMPLE_SIZE = 64 * 1024  # bytes of the first chunk compressed to tell if a file is worth compressing
+GZIP_LEVEL = 1                    # zlib level for gzip, fast enough to keep up with the link
+
+# gRPC server implementation
+GRPC_SERVER_MODE = "threaded"     # "threaded" (one thread per RPC) or "aio" (one asyncio event loop), router.py --aio/--threaded
+GRPC_SERVER_THREADS = 10          # RPCs the threaded server runs at once
+AIO_EXECUTOR_WORKERS = 32         # threads the aio server hands disk I/O and other blocking work to
+
+# Sharded router (router.py --shards N)
+ROUTER_SHARDS = 1                 # router processes behind the front on SERVER_GRPC_PORT, 1 runs a single router
+ROUTER_SHARD_BASE_PORT = 8100     # shard i listens on this port + i
+ROUTER_FRONT_SESSION_TTL = 600    # seconds the front remembers the shard of a chunked session with no calls
+ROUTER_FRONT_MAX_SESSIONS = 10000 # chunked sessions the front remembers, the oldest are forgotten first
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+
+from config import DISK_INDEX_RESCAN_INTERVAL
+from disk_metadata import metadata_store, LEGACY_METADATA_FILE
+
+
+class DiskIndex(MutableMapping):
+    """In-memory file -> size index of a node disk.
+
+    Local commands and the receive path update it as they change the disk, so
+    ls and ListFiles don't walk the directory. Changes made behind its back
+    move the mtime of the disk directory (or a cloud's manifest directory),
+    which costs one os.scandir rescan; DISK_INDEX_RESCAN_INTERVAL bounds how
+    long an in-place rewrite of an existing file can go unnoticed. Every
+    change is written through to the disk's DiskMetadataStore.
+
+    Each file also has a version, bumped whenever it's written, that callers
+    can block on to learn when a file lands (see wait_for_update).
+    """
+
+    def __init__(self, disk_path, chunk_store=None, rescan_interval=DISK_INDEX_RESCAN_INTERVAL):
+        self.disk_path = disk_path
+        self.chunk_store = chunk_store
+        self.rescan_interval = rescan_interval
+        self.metadata = metadata_store(disk_path)
+        self.files = {}
+        self.versions = {}
+        self.dir_mtimes = {}
+        self.last_scan = 0
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.refresh(force=True)
+
+    def refresh(self, force=False) -> bool:
+        """Rescan the disk if it drifted from the index, returns whether it did"""
+        with self.lock:
+            dir_mtimes = self._dir_mtimes()
+            if (not force and dir_mtimes == self.dir_mtimes and
+                    time.monotonic() - self.last_scan < self.rescan_interval):
+                return False
+
+            files = self._scan()
+            self._bump([name for name, size in files.items() if self.files.get(name) != size])
+            self.files = files
+            self.dir_mtimes = dir_mtimes
+            self.last_scan = time.monotonic()
+            if files != self.metadata.snapshot():
+                self.metadata.replace_all(files)
+            return True
+
+    def __getitem__(self, filename):
+        with self.lock:
+            return self.files[filename]
+
+    def __setitem__(self, filename, size):
+        with self.lock:
+            self.files[filename] = int(size)
+            self.metadata[filename] = size
+            self._absorb_own_change()
+            self._bump([filename])
+
+    def __delitem__(self, filename):
+        with self.lock:
+            del self.files[filename]
+            self.metadata.pop(filename, None)
+            self._absorb_own_change()
+
+    def __contains__(self, filename):
+        with self.lock:
+            if filename in self.files:
+                return True
+            # Could have been dropped in from outside since the last look
+            return self.refresh() and filename in self.files
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.files))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.files)
+
+    def version(self, filename) -> int:
+        """How many times filename has been written since the index was built"""
+        with self.lock:
+            return self.versions.get(filename, 0)
+
+    def wait_for_update(self, filename, version, timeout=None) -> bool:
+        """Block until filename is written past version, returns False on timeout"""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.versions.get(filename, 0) > version, timeout)
+
+    def _bump(self, filenames):
+        if not filenames:
+            return
+        for filename in filenames:
+            self.versions[filename] = self.versions.get(filename, 0) + 1
+        self.changed.notify_all()
+
+    def snapshot(self) -> dict:
+        """Every entry, after checking the disk for drift"""
+        with self.lock:
+            self.refresh()
+            return dict(self.files)
+
+    def items(self):
+        return self.snapshot().items()
+
+    def values(self):
+        return self.snapshot().values()
+
+    def total_size(self) -> int:
+        return sum(self.values())
+
+    def _watched_dirs(self):
+        dirs = [self.disk_path]
+        if self.chunk_store:
+            dirs.append(self.chunk_store.manifests_path)
+        return dirs
+
+    def _dir_mtimes(self):
+        mtimes = {}
+        for path in self._watched_dirs():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def _absorb_own_change(self):
+        """Our own write moved the directory mtimes, don't mistake that for drift"""
+        self.dir_mtimes = self._dir_mtimes()
+
+    def _scan(self):
+        files = self.chunk_store.list_files() if self.chunk_store else {}
+        with os.scandir(self.disk_path) as entries:
+            for entry in entries:
+                # Dot files are work in progress (payloads being written), not disk content
+                if entry.name != LEGACY_METADATA_FILE and not entry.name.startswith(".") and entry.is_file():
+                    files[entry.name] = entry.stat().st_size
+        return files
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def disk_index(disk_path, chunk_store=None) -> DiskIndex:
+    """The shared index of a disk directory, built on first use"""
+    key = os.path.abspath(disk_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            os.makedirs(key, exist_ok=True)
+            index = _indexes[key] = DiskIndex(key, chunk_store)
+        return index
@@ -0,0 +1,154 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+LEGACY_METADATA_FILE = "disk_metadata.json"
+
+
+class DiskMetadataStore(MutableMapping):
+    """File name -> size table of one node disk, kept in SQLite.
+
+    Behaves like the old virtual_disk dict, but every assignment or delete is
+    its own transaction, so concurrent receivers and the node's own commands
+    never lose each other's updates, and lookups go straight to the key.
+    The database lives in .meta/ so directory scans don't list it.
+
+    Disks with a chunk store also keep its block reference counts here (see
+    update_block_refs), so collecting blocks doesn't read every manifest.
+    """
+
+    def __init__(self, disk_path):
+        meta_path = os.path.join(disk_path, ".meta")
+        os.makedirs(meta_path, exist_ok=True)
+        self.db_path = os.path.join(meta_path, "disk_metadata.db")
+        self.lock = threading.Lock()
+
+        # Autocommit, the few multi-row updates open their own transaction
+        self.conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS block_refs (digest TEXT PRIMARY KEY, refs INTEGER NOT NULL)")
+
+        self._import_legacy(os.path.join(disk_path, LEGACY_METADATA_FILE))
+
+    def __getitem__(self, filename):
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM files WHERE name = ?", (filename,)).fetchone()
+        if row is None:
+            raise KeyError(filename)
+        return row[0]
+
+    def __setitem__(self, filename, size):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files (name, size) VALUES (?, ?)", (filename, int(size)))
+
+    def __delitem__(self, filename):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM files WHERE name = ?", (filename,)).rowcount
+        if not deleted:
+            raise KeyError(filename)
+
+    def __contains__(self, filename):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM files WHERE name = ?", (filename,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter(list(self.snapshot()))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def snapshot(self) -> dict:
+        """Every entry at once, in a single query"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT name, size FROM files ORDER BY name"))
+
+    def items(self):
+        return self.snapshot().items()
+
+    def values(self):
+        return self.snapshot().values()
+
+    def total_size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def update(self, files=(), **kwargs):
+        """Set many entries in one transaction"""
+        rows = [(name, int(size)) for name, size in dict(files, **kwargs).items()]
+        with self.lock:
+            with self._transaction():
+                self.conn.executemany("INSERT OR REPLACE INTO files (name, size) VALUES (?, ?)", rows)
+
+    def replace_all(self, files: dict):
+        """Make the table exactly `files` in one transaction"""
+        with self.lock:
+            with self._transaction():
+                self.conn.execute("DELETE FROM files")
+                self.conn.executemany("INSERT INTO files (name, size) VALUES (?, ?)",
+                                      [(name, int(size)) for name, size in files.items()])
+
+    def has_block_refs(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM block_refs LIMIT 1").fetchone() is not None
+
+    def update_block_refs(self, added=(), removed=()) -> list:
+        """Count one more reference per digest in added and one less per digest in removed, in one transaction.
+
+        A digest listed twice counts twice. Returns the digests nothing
+        references any more, whose rows are dropped.
+        """
+        added_rows = [(digest, count) for digest, count in Counter(added).items()]
+        removed_rows = [(count, digest) for digest, count in Counter(removed).items()]
+        with self.lock:
+            with self._transaction():
+                self.conn.executemany("INSERT INTO block_refs (digest, refs) VALUES (?, ?) "
+                                      "ON CONFLICT(digest) DO UPDATE SET refs = refs + excluded.refs", added_rows)
+                self.conn.executemany("UPDATE block_refs SET refs = refs - ? WHERE digest = ?", removed_rows)
+                unreferenced = [row[0] for row in self.conn.execute("SELECT digest FROM block_refs WHERE refs <= 0")]
+                self.conn.execute("DELETE FROM block_refs WHERE refs <= 0")
+        return unreferenced
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _import_legacy(self, legacy_path):
+        """Fold a disk_metadata.json left by an older version into the table, once"""
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, 'r') as f:
+                self.update({name: int(size) for name, size in json.load(f).items()})
+        except (json.JSONDecodeError, IOError, ValueError, AttributeError):
+            pass
+        try:
+            os.remove(legacy_path)
+        except OSError:
+            pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def metadata_store(disk_path) -> DiskMetadataStore:
+    """The shared metadata store of a disk directory, opened on first use"""
+    key = os.path.abspath(disk_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = DiskMetadataStore(key)
+        return store
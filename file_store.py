@@ -29,9 +29,5 @@ def fetch(file_name: str):
     return idx.get(file_name)  # returns None if not found
 
 def in_same_link(a: str, b: str) -> bool:
-    from links_manager import LinksManager
-    lm = LinksManager()
-    for nodes in lm.links.values():
-        if a in nodes and b in nodes:
-            return True
-    return False
\ No newline at end of file
+    from links_manager import topology
+    return topology().in_same_link(a, b)
\ No newline at end of file
@@ -24,43 +24,61 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x13\x66ile_transfer.proto\x12\rfile_transfer\"\x96\x01\n\tFileChunk\x12\x13\n\x0btransfer_id\x18\x01 \x01(\t\x12\x14\n\x0c\x63hunk_number\x18\x02 \x01(\x05\x12\x14\n\x0ctotal_chunks\x18\x03 \x01(\x05\x12\x0c\n\x04\x64\x61ta\x18\x04 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x05 \x01(\t\x12\x13\n\x0btarget_node\x18\x06 \x01(\t\x12\x13\n\x0bsender_node\x18\x07 \x01(\t\"`\n\x0fTransferRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x11\n\tfile_size\x18\x02 \x01(\x03\x12\x13\n\x0btarget_node\x18\x03 \x01(\t\x12\x13\n\x0bsender_node\x18\x04 \x01(\t\"U\n\x17\x43ompleteTransferRequest\x12\x13\n\x0btransfer_id\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x13\n\x0btarget_node\x18\x03 \x01(\t\"I\n\x10TransferResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x13\n\x0btransfer_id\x18\x03 \x01(\t\"#\n\x0f\x46ileInfoRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\"A\n\x10\x46ileInfoResponse\x12\x0e\n\x06\x65xists\x18\x01 \x01(\x08\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x0f\n\x07message\x18\x03 \x01(\t\" \n\x10ListFilesRequest\x12\x0c\n\x04path\x18\x01 \x01(\t\"M\n\x11ListFilesResponse\x12\'\n\x05\x66iles\x18\x01 \x03(\x0b\x32\x18.file_transfer.FileEntry\x12\x0f\n\x07message\x18\x02 \x01(\t\"=\n\tFileEntry\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x14\n\x0cis_directory\x18\x03 \x01(\x08\"G\n\x10NodeRegistration\x12\x11\n\tnode_name\x18\x01 \x01(\t\x12\x12\n\nip_address\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\x05\"0\n\x0cNodeResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\")\n\x13\x41\x63tiveNodesResponse\x12\x12\n\nnode_names\x18\x01 \x03(\t\"2\n\x0eHealthResponse\x12\x0f\n\x07healthy\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"\x07\n\x05\x45mpty2\xb0\x03\n\x13\x46ileTransferService\x12J\n\rTransferChunk\x12\x18.file_transfer.FileChunk\x1a\x1f.file_transfer.TransferResponse\x12P\n\rStartTransfer\x12\x1e.file_transfer.TransferRequest\x1a\x1f.file_transfer.TransferResponse\x12[\n\x10\x43ompleteTransfer\x12&.file_transfer.CompleteTransferRequest\x1a\x1f.file_transfer.TransferResponse\x12N\n\x0bGetFileInfo\x12\x1e.file_transfer.FileInfoRequest\x1a\x1f.file_transfer.FileInfoResponse\x12N\n\tListFiles\x12\x1f.file_transfer.ListFilesRequest\x1a .file_transfer.ListFilesResponse2\xc5\x02\n\x15NodeManagementService\x12L\n\x0cRegisterNode\x12\x1f.file_transfer.NodeRegistration\x1a\x1b.file_transfer.NodeResponse\x12N\n\x0eUnregisterNode\x12\x1f.file_transfer.NodeRegistration\x1a\x1b.file_transfer.NodeResponse\x12J\n\x0eGetActiveNodes\x12\x14.file_transfer.Empty\x1a\".file_transfer.ActiveNodesResponse\x12\x42\n\x0bHealthCheck\x12\x14.file_transfer.Empty\x1a\x1d.file_transfer.HealthResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x13\x66ile_transfer.proto\x12\rfile_transfer\"\xde\x02\n\tFileChunk\x12\x13\n\x0btransfer_id\x18\x01 \x01(\t\x12\x14\n\x0c\x63hunk_number\x18\x02 \x01(\x05\x12\x14\n\x0ctotal_chunks\x18\x03 \x01(\x05\x12\x0c\n\x04\x64\x61ta\x18\x04 \x01(\x0c\x12\x10\n\x08\x66ilename\x18\x05 \x01(\t\x12\x13\n\x0btarget_node\x18\x06 \x01(\t\x12\x13\n\x0bsender_node\x18\x07 \x01(\t\x12\x1a\n\x12replication_factor\x18\x08 \x01(\x05\x12\x13\n\x06offset\x18\t \x01(\x03H\x00\x88\x01\x01\x12\x10\n\x08\x63hecksum\x18\n \x01(\x07\x12\x32\n\rchecksum_type\x18\x0b \x01(\x0e\x32\x1b.file_transfer.ChecksumType\x12\x13\n\x0b\x66ile_digest\x18\x0c \x01(\t\x12/\n\x0b\x63ompression\x18\r \x01(\x0e\x32\x1a.file_transfer.CompressionB\t\n\x07_offset\"\xb5\x02\n\x0fTransferRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x11\n\tfile_size\x18\x02 \x01(\x03\x12\x13\n\x0btarget_node\x18\x03 \x01(\t\x12\x13\n\x0bsender_node\x18\x04 \x01(\t\x12\x1a\n\x12replication_factor\x18\x05 \x01(\x05\x12\x13\n\x0btransfer_id\x18\x06 \x01(\t\x12\x12\n\nchunk_size\x18\x07 \x01(\x03\x12\x14\n\x0c\x63hunk_hashes\x18\x08 \x03(\t\x12\x13\n\x0b\x66ile_digest\x18\t \x01(\t\x12/\n\x0b\x63ompression\x18\n \x01(\x0e\x32\x1a.file_transfer.Compression\x12\x32\n\rchecksum_type\x18\x0b \x01(\x0e\x32\x1b.file_transfer.ChecksumType\"U\n\x17\x43ompleteTransferRequest\x12\x13\n\x0btransfer_id\x18\x01 \x01(\t\x12\x10\n\x08\x66ilename\x18\x02 \x01(\t\x12\x13\n\x0btarget_node\x18\x03 \x01(\t\"\x93\x02\n\x10TransferResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x13\n\x0btransfer_id\x18\x03 \x01(\t\x12.\n\x08replicas\x18\x04 \x03(\x0b\x32\x1c.file_transfer.ReplicaStatus\x12\x1b\n\x13verification_failed\x18\x05 \x01(\x08\x12\x16\n\x0e\x63orrupt_chunks\x18\x06 \x03(\x05\x12/\n\x0b\x63ompression\x18\x07 \x01(\x0e\x32\x1a.file_transfer.Compression\x12\x32\n\rchecksum_type\x18\x08 \x01(\x0e\x32\x1b.file_transfer.ChecksumType\"U\n\rReplicaStatus\x12\x11\n\tnode_name\x18\x01 \x01(\t\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x0f\n\x07pending\x18\x04 \x01(\x08\"+\n\x14QueryTransferRequest\x12\x13\n\x0btransfer_id\x18\x01 \x01(\t\"(\n\nChunkRange\x12\r\n\x05start\x18\x01 \x01(\x05\x12\x0b\n\x03\x65nd\x18\x02 \x01(\x05\"\xa1\x01\n\x15QueryTransferResponse\x12\x0e\n\x06\x65xists\x18\x01 \x01(\x08\x12\x11\n\tfile_size\x18\x02 \x01(\x03\x12\x12\n\nchunk_size\x18\x03 \x01(\x03\x12\x14\n\x0ctotal_chunks\x18\x04 \x01(\x05\x12*\n\x07missing\x18\x05 \x03(\x0b\x32\x19.file_transfer.ChunkRange\x12\x0f\n\x07message\x18\x06 \x01(\t\"#\n\x0f\x46ileInfoRequest\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\"A\n\x10\x46ileInfoResponse\x12\x0e\n\x06\x65xists\x18\x01 \x01(\x08\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x0f\n\x07message\x18\x03 \x01(\t\" \n\x10ListFilesRequest\x12\x0c\n\x04path\x18\x01 \x01(\t\"M\n\x11ListFilesResponse\x12\'\n\x05\x66iles\x18\x01 \x03(\x0b\x32\x18.file_transfer.FileEntry\x12\x0f\n\x07message\x18\x02 \x01(\t\"=\n\tFileEntry\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\x14\n\x0cis_directory\x18\x03 \x01(\x08\"G\n\x10NodeRegistration\x12\x11\n\tnode_name\x18\x01 \x01(\t\x12\x12\n\nip_address\x18\x02 \x01(\t\x12\x0c\n\x04port\x18\x03 \x01(\x05\"0\n\x0cNodeResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\")\n\x13\x41\x63tiveNodesResponse\x12\x12\n\nnode_names\x18\x01 \x03(\t\"\xcd\x01\n\x0eHealthResponse\x12\x0f\n\x07healthy\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\x12/\n\x0b\x63ompression\x18\x03 \x03(\x0e\x32\x1a.file_transfer.Compression\x12\x13\n\x0bshard_ports\x18\x04 \x03(\x05\x12\x1e\n\x16\x63hunk_store_block_size\x18\x05 \x01(\x03\x12\x33\n\x0e\x63hecksum_types\x18\x06 \x03(\x0e\x32\x1b.file_transfer.ChecksumType\"\x07\n\x05\x45mpty\",\n\x0bNodeCommand\x12\x0f\n\x07\x63ommand\x18\x01 \x01(\t\x12\x0c\n\x04\x61rgs\x18\x02 \x03(\t\"6\n\x13NodeCommandResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0e\n\x06output\x18\x02 \x01(\t*J\n\x0c\x43hecksumType\x12\x11\n\rCHECKSUM_NONE\x10\x00\x12\x13\n\x0f\x43HECKSUM_CRC32C\x10\x01\x12\x12\n\x0e\x43HECKSUM_CRC32\x10\x02*d\n\x0b\x43ompression\x12\x14\n\x10\x43OMPRESSION_NONE\x10\x00\x12\x14\n\x10\x43OMPRESSION_GZIP\x10\x01\x12\x14\n\x10\x43OMPRESSION_ZSTD\x10\x02\x12\x13\n\x0f\x43OMPRESSION_LZ4\x10\x03\x32\xd7\x04\n\x13\x46ileTransferService\x12J\n\rTransferChunk\x12\x18.file_transfer.FileChunk\x1a\x1f.file_transfer.TransferResponse\x12P\n\rStartTransfer\x12\x1e.file_transfer.TransferRequest\x1a\x1f.file_transfer.TransferResponse\x12[\n\x10\x43ompleteTransfer\x12&.file_transfer.CompleteTransferRequest\x1a\x1f.file_transfer.TransferResponse\x12I\n\nStreamFile\x12\x18.file_transfer.FileChunk\x1a\x1f.file_transfer.TransferResponse(\x01\x12Z\n\rQueryTransfer\x12#.file_transfer.QueryTransferRequest\x1a$.file_transfer.QueryTransferResponse\x12N\n\x0bGetFileInfo\x12\x1e.file_transfer.FileInfoRequest\x1a\x1f.file_transfer.FileInfoResponse\x12N\n\tListFiles\x12\x1f.file_transfer.ListFilesRequest\x1a .file_transfer.ListFilesResponse2\xc5\x02\n\x15NodeManagementService\x12L\n\x0cRegisterNode\x12\x1f.file_transfer.NodeRegistration\x1a\x1b.file_transfer.NodeResponse\x12N\n\x0eUnregisterNode\x12\x1f.file_transfer.NodeRegistration\x1a\x1b.file_transfer.NodeResponse\x12J\n\x0eGetActiveNodes\x12\x14.file_transfer.Empty\x1a\".file_transfer.ActiveNodesResponse\x12\x42\n\x0bHealthCheck\x12\x14.file_transfer.Empty\x1a\x1d.file_transfer.HealthResponse2b\n\x12NodeControlService\x12L\n\nRunCommand\x12\x1a.file_transfer.NodeCommand\x1a\".file_transfer.NodeCommandResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'file_transfer_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_CHECKSUMTYPE']._serialized_start=2171
+  _globals['_CHECKSUMTYPE']._serialized_end=2245
+  _globals['_COMPRESSION']._serialized_start=2247
+  _globals['_COMPRESSION']._serialized_end=2347
   _globals['_FILECHUNK']._serialized_start=39
-  _globals['_FILECHUNK']._serialized_end=189
-  _globals['_TRANSFERREQUEST']._serialized_start=191
-  _globals['_TRANSFERREQUEST']._serialized_end=287
-  _globals['_COMPLETETRANSFERREQUEST']._serialized_start=289
-  _globals['_COMPLETETRANSFERREQUEST']._serialized_end=374
-  _globals['_TRANSFERRESPONSE']._serialized_start=376
-  _globals['_TRANSFERRESPONSE']._serialized_end=449
-  _globals['_FILEINFOREQUEST']._serialized_start=451
-  _globals['_FILEINFOREQUEST']._serialized_end=486
-  _globals['_FILEINFORESPONSE']._serialized_start=488
-  _globals['_FILEINFORESPONSE']._serialized_end=553
-  _globals['_LISTFILESREQUEST']._serialized_start=555
-  _globals['_LISTFILESREQUEST']._serialized_end=587
-  _globals['_LISTFILESRESPONSE']._serialized_start=589
-  _globals['_LISTFILESRESPONSE']._serialized_end=666
-  _globals['_FILEENTRY']._serialized_start=668
-  _globals['_FILEENTRY']._serialized_end=729
-  _globals['_NODEREGISTRATION']._serialized_start=731
-  _globals['_NODEREGISTRATION']._serialized_end=802
-  _globals['_NODERESPONSE']._serialized_start=804
-  _globals['_NODERESPONSE']._serialized_end=852
-  _globals['_ACTIVENODESRESPONSE']._serialized_start=854
-  _globals['_ACTIVENODESRESPONSE']._serialized_end=895
-  _globals['_HEALTHRESPONSE']._serialized_start=897
-  _globals['_HEALTHRESPONSE']._serialized_end=947
-  _globals['_EMPTY']._serialized_start=949
-  _globals['_EMPTY']._serialized_end=956
-  _globals['_FILETRANSFERSERVICE']._serialized_start=959
-  _globals['_FILETRANSFERSERVICE']._serialized_end=1391
-  _globals['_NODEMANAGEMENTSERVICE']._serialized_start=1394
-  _globals['_NODEMANAGEMENTSERVICE']._serialized_end=1719
+  _globals['_FILECHUNK']._serialized_end=389
+  _globals['_TRANSFERREQUEST']._serialized_start=392
+  _globals['_TRANSFERREQUEST']._serialized_end=701
+  _globals['_COMPLETETRANSFERREQUEST']._serialized_start=703
+  _globals['_COMPLETETRANSFERREQUEST']._serialized_end=788
+  _globals['_TRANSFERRESPONSE']._serialized_start=791
+  _globals['_TRANSFERRESPONSE']._serialized_end=1066
+  _globals['_REPLICASTATUS']._serialized_start=1068
+  _globals['_REPLICASTATUS']._serialized_end=1153
+  _globals['_QUERYTRANSFERREQUEST']._serialized_start=1155
+  _globals['_QUERYTRANSFERREQUEST']._serialized_end=1198
+  _globals['_CHUNKRANGE']._serialized_start=1200
+  _globals['_CHUNKRANGE']._serialized_end=1240
+  _globals['_QUERYTRANSFERRESPONSE']._serialized_start=1243
+  _globals['_QUERYTRANSFERRESPONSE']._serialized_end=1404
+  _globals['_FILEINFOREQUEST']._serialized_start=1406
+  _globals['_FILEINFOREQUEST']._serialized_end=1441
+  _globals['_FILEINFORESPONSE']._serialized_start=1443
+  _globals['_FILEINFORESPONSE']._serialized_end=1508
+  _globals['_LISTFILESREQUEST']._serialized_start=1510
+  _globals['_LISTFILESREQUEST']._serialized_end=1542
+  _globals['_LISTFILESRESPONSE']._serialized_start=1544
+  _globals['_LISTFILESRESPONSE']._serialized_end=1621
+  _globals['_FILEENTRY']._serialized_start=1623
+  _globals['_FILEENTRY']._serialized_end=1684
+  _globals['_NODEREGISTRATION']._serialized_start=1686
+  _globals['_NODEREGISTRATION']._serialized_end=1757
+  _globals['_NODERESPONSE']._serialized_start=1759
+  _globals['_NODERESPONSE']._serialized_end=1807
+  _globals['_ACTIVENODESRESPONSE']._serialized_start=1809
+  _globals['_ACTIVENODESRESPONSE']._serialized_end=1850
+  _globals['_HEALTHRESPONSE']._serialized_start=1853
+  _globals['_HEALTHRESPONSE']._serialized_end=2058
+  _globals['_EMPTY']._serialized_start=2060
+  _globals['_EMPTY']._serialized_end=2067
+  _globals['_NODECOMMAND']._serialized_start=2069
+  _globals['_NODECOMMAND']._serialized_end=2113
+  _globals['_NODECOMMANDRESPONSE']._serialized_start=2115
+  _globals['_NODECOMMANDRESPONSE']._serialized_end=2169
+  _globals['_FILETRANSFERSERVICE']._serialized_start=2350
+  _globals['_FILETRANSFERSERVICE']._serialized_end=2949
+  _globals['_NODEMANAGEMENTSERVICE']._serialized_start=2952
+  _globals['_NODEMANAGEMENTSERVICE']._serialized_end=3277
+  _globals['_NODECONTROLSERVICE']._serialized_start=3279
+  _globals['_NODECONTROLSERVICE']._serialized_end=3377
 # @@protoc_insertion_point(module_scope)
@@ -50,6 +50,16 @@ class FileTransferServiceStub(object):
                 request_serializer=file__transfer__pb2.CompleteTransferRequest.SerializeToString,
                 response_deserializer=file__transfer__pb2.TransferResponse.FromString,
                 _registered_method=True)
+        self.StreamFile = channel.stream_unary(
+                '/file_transfer.FileTransferService/StreamFile',
+                request_serializer=file__transfer__pb2.FileChunk.SerializeToString,
+                response_deserializer=file__transfer__pb2.TransferResponse.FromString,
+                _registered_method=True)
+        self.QueryTransfer = channel.unary_unary(
+                '/file_transfer.FileTransferService/QueryTransfer',
+                request_serializer=file__transfer__pb2.QueryTransferRequest.SerializeToString,
+                response_deserializer=file__transfer__pb2.QueryTransferResponse.FromString,
+                _registered_method=True)
         self.GetFileInfo = channel.unary_unary(
                 '/file_transfer.FileTransferService/GetFileInfo',
                 request_serializer=file__transfer__pb2.FileInfoRequest.SerializeToString,
@@ -87,6 +97,20 @@ class FileTransferServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamFile(self, request_iterator, context):
+        """Stream a whole file in a single call (first chunk carries the metadata)
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def QueryTransfer(self, request, context):
+        """Report which chunks of a resumable transfer session are still missing
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def GetFileInfo(self, request, context):
         """Get file information
         """
@@ -119,6 +143,16 @@ def add_FileTransferServiceServicer_to_server(servicer, server):
                     request_deserializer=file__transfer__pb2.CompleteTransferRequest.FromString,
                     response_serializer=file__transfer__pb2.TransferResponse.SerializeToString,
             ),
+            'StreamFile': grpc.stream_unary_rpc_method_handler(
+                    servicer.StreamFile,
+                    request_deserializer=file__transfer__pb2.FileChunk.FromString,
+                    response_serializer=file__transfer__pb2.TransferResponse.SerializeToString,
+            ),
+            'QueryTransfer': grpc.unary_unary_rpc_method_handler(
+                    servicer.QueryTransfer,
+                    request_deserializer=file__transfer__pb2.QueryTransferRequest.FromString,
+                    response_serializer=file__transfer__pb2.QueryTransferResponse.SerializeToString,
+            ),
             'GetFileInfo': grpc.unary_unary_rpc_method_handler(
                     servicer.GetFileInfo,
                     request_deserializer=file__transfer__pb2.FileInfoRequest.FromString,
@@ -222,6 +256,60 @@ class FileTransferService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def StreamFile(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/file_transfer.FileTransferService/StreamFile',
+            file__transfer__pb2.FileChunk.SerializeToString,
+            file__transfer__pb2.TransferResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def QueryTransfer(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/file_transfer.FileTransferService/QueryTransfer',
+            file__transfer__pb2.QueryTransferRequest.SerializeToString,
+            file__transfer__pb2.QueryTransferResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def GetFileInfo(request,
             target,
@@ -483,3 +571,79 @@ class NodeManagementService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+
+class NodeControlServiceStub(object):
+    """Node control service (served by headless nodes)
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.RunCommand = channel.unary_unary(
+                '/file_transfer.NodeControlService/RunCommand',
+                request_serializer=file__transfer__pb2.NodeCommand.SerializeToString,
+                response_deserializer=file__transfer__pb2.NodeCommandResponse.FromString,
+                _registered_method=True)
+
+
+class NodeControlServiceServicer(object):
+    """Node control service (served by headless nodes)
+    """
+
+    def RunCommand(self, request, context):
+        """Run one node command (ls, touch, send, upload, ...) and return its output
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_NodeControlServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'RunCommand': grpc.unary_unary_rpc_method_handler(
+                    servicer.RunCommand,
+                    request_deserializer=file__transfer__pb2.NodeCommand.FromString,
+                    response_serializer=file__transfer__pb2.NodeCommandResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'file_transfer.NodeControlService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('file_transfer.NodeControlService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class NodeControlService(object):
+    """Node control service (served by headless nodes)
+    """
+
+    @staticmethod
+    def RunCommand(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/file_transfer.NodeControlService/RunCommand',
+            file__transfer__pb2.NodeCommand.SerializeToString,
+            file__transfer__pb2.NodeCommandResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
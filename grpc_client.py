@@ -1,75 +1,150 @@
 import grpc
 import os
 import math
+import hashlib
+import queue
+import threading
 import time
+import zlib
 from typing import Optional
 
 import file_transfer_pb2
 import file_transfer_pb2_grpc
+from config import (NODE_BANDWIDTH_BYTES_PER_SEC, ADAPTIVE_CHUNK_SIZING, RESUMABLE_MIN_SIZE, RESUME_RETRIES,
+                    CHUNK_STORE_ENABLED, CHUNK_VERIFY_RETRIES, CHANNEL_READY_TIMEOUT, PEER_HEALTH_TTL,
+                    COMPRESSION_ENABLED, FAN_OUT_READ_AHEAD)
+from channel_pool import channel_pool
+from bandwidth_shaper import shaper
+from chunk_sizer import chunk_sizer
+from chunk_reader import WireChunk, open_source, serialize_chunk, source_stat
+import checksums
+import compression
+
+# Each server's last HealthResponse and when it came, by channel target
+_peer_health = {}
 
 # Enable gRPC verbose logging for debugging
 os.environ['GRPC_VERBOSITY'] = 'info'
 
 
+def shard_for(key, shards):
+    """Shard of a sharded router handling a routing key, the same in every process and across restarts"""
+    return zlib.crc32(key.encode()) % shards
+
+
 class GRPCClient:
     def __init__(self, target_host='localhost', target_port=None):
         self.target_host = target_host
         self.target_port = target_port
         self.channel = None
+        self.channel_target = None
         self.file_transfer_stub = None
         self.node_mgmt_stub = None
+        self.node_control_stub = None
+        self.stream_file = None
+        self.transfer_chunk = None
         
         # Transfer parameters
-        self.bandwidth_bytes_per_sec = 125_000_000
+        self.bandwidth_bytes_per_sec = NODE_BANDWIDTH_BYTES_PER_SEC
         self.target_chunk_time = 0.1
         self.min_chunk_size = 1024 * 64
         self.max_chunk_size = 5 * 1024 * 1024  # 5MB max chunk size
+        self.shaper = shaper
+        # Node whose uplink sends are charged to, the sender by default (the router for its forwards)
+        self.uplink_node = None
+        self.adaptive_chunk_sizing = ADAPTIVE_CHUNK_SIZING
+
+        # Prefer the single-call StreamFile RPC, fall back to unary chunks
+        self.use_streaming = True
+        # Big files go as resumable sessions so a dropped call only resends the gaps
+        self.resumable_min_size = RESUMABLE_MIN_SIZE
+        # Servers with a chunk store (clouds) keep deduplicated blocks, only send them the blocks they don't hold
+        self.dedup_to_clouds = CHUNK_STORE_ENABLED
+        # Every chunk carries a checksum, the last one the whole-file digest. Each transfer
+        # settles on one both sides compute fast, see checksums.choose
+        self.checksum_type = checksums.preferred_type()
+        # Compression counters of the last transfer (see compression.TransferStats)
+        self.transfer_stats = None
     
     def connect(self, port: int):
-        """Connect to a gRPC server"""
-        if self.channel:
-            self.channel.close()
-
-        # Configure gRPC options for larger message sizes
-        options = [
-            ('grpc.max_send_message_length', 100 * 1024 * 1024),  # 100MB
-            ('grpc.max_receive_message_length', 100 * 1024 * 1024),  # 100MB
-            ('grpc.max_message_length', 100 * 1024 * 1024),  # 100MB
-        ]
+        """Connect to a gRPC server through the shared channel pool"""
+        self.disconnect()
 
         target = f'{self.target_host}:{port}'
-        self.channel = grpc.insecure_channel(target, options=options)
+        self.channel = channel_pool.acquire(target)
+        self.channel_target = target
         self.file_transfer_stub = file_transfer_pb2_grpc.FileTransferServiceStub(self.channel)
         self.node_mgmt_stub = file_transfer_pb2_grpc.NodeManagementServiceStub(self.channel)
+        self.node_control_stub = file_transfer_pb2_grpc.NodeControlServiceStub(self.channel)
+        # Chunk uploads also take WireChunks, which the generated stub can't serialize
+        self.stream_file = self.channel.stream_unary(
+            '/file_transfer.FileTransferService/StreamFile',
+            request_serializer=serialize_chunk,
+            response_deserializer=file_transfer_pb2.TransferResponse.FromString)
+        self.transfer_chunk = self.channel.unary_unary(
+            '/file_transfer.FileTransferService/TransferChunk',
+            request_serializer=serialize_chunk,
+            response_deserializer=file_transfer_pb2.TransferResponse.FromString)
 
-        # Test connection silently - try HealthCheck first (for routers), then ListFiles (for nodes)
-        try:
-            # Try HealthCheck first (works for routers)
-            request = file_transfer_pb2.Empty()
-            response = self.node_mgmt_stub.HealthCheck(request, timeout=5)
-            return True
-        except grpc.RpcError as e:
-            if e.code() == grpc.StatusCode.UNIMPLEMENTED:
-                # HealthCheck not implemented, try ListFiles (for regular nodes)
-                try:
-                    request = file_transfer_pb2.ListFilesRequest(path="")
-                    response = self.file_transfer_stub.ListFiles(request, timeout=5)
-                    return True
-                except grpc.RpcError:
-                    return False
-            else:
-                return False
-        except Exception:
+        # Warm channels return at once, new ones wait for the connection to come up
+        if not channel_pool.ensure_ready(target):
+            self.disconnect()
             return False
+        return True
     
     def disconnect(self):
-        """Disconnect from the gRPC server"""
+        """Give the channel back to the pool, it stays open for the next call"""
         if self.channel:
-            self.channel.close()
+            channel_pool.release(self.channel_target)
             self.channel = None
+            self.channel_target = None
             self.file_transfer_stub = None
             self.node_mgmt_stub = None
+            self.node_control_stub = None
+            self.stream_file = None
+            self.transfer_chunk = None
     
+    def connect_for_transfer(self, port: int, routing_key: str):
+        """Connect to port for a transfer, straight to the shard handling routing_key if port is a router front"""
+        if not self.connect(port):
+            return False
+
+        front = self.channel_target
+        health = self.peer_health()
+        shard_ports = list(health.shard_ports) if health else []
+        if not shard_ports:
+            return True
+        if self.connect(shard_ports[shard_for(routing_key, len(shard_ports))]):
+            return True
+        # The router may have come back on other shard ports, ask it again next time.
+        # Until then the front routes the transfer
+        _peer_health.pop(front, None)
+        return self.connect(port)
+
+    def peer_health(self):
+        """The connected server's HealthResponse, asked again after PEER_HEALTH_TTL, None if it didn't answer"""
+        cached = _peer_health.get(self.channel_target)
+        if cached and time.monotonic() - cached[1] < PEER_HEALTH_TTL:
+            return cached[0]
+        try:
+            health = self.node_mgmt_stub.HealthCheck(file_transfer_pb2.Empty(), timeout=CHANNEL_READY_TIMEOUT)
+        except grpc.RpcError:
+            # Not remembered, a server that missed one call gets asked again by the next transfer
+            _peer_health.pop(self.channel_target, None)
+            return None
+        _peer_health[self.channel_target] = (health, time.monotonic())
+        return health
+
+    def peer_codecs(self):
+        """Codecs the connected server can decompress"""
+        health = self.peer_health() if COMPRESSION_ENABLED else None
+        return list(health.compression) if health else []
+
+    def peer_checksum_types(self):
+        """Checksums the connected server verifies at full speed, empty if it doesn't say"""
+        health = self.peer_health()
+        return list(health.checksum_types) if health else []
+
     def _calculate_chunk_parameters(self, file_size):
         """Calculate optimized chunk size and number of chunks"""
         ideal_chunk_size = int(self.bandwidth_bytes_per_sec * self.target_chunk_time)
@@ -85,76 +160,511 @@ class GRPCClient:
         return chunk_size, num_chunks
     
     def send_file(self, file_path: str, filename: str, target_node: str, sender_node: str, port: int) -> str:
-        """Send a file to a target node via gRPC"""
-        if not os.path.exists(file_path):
+        """Send a file to a target node via gRPC, file_path may also be a chunk-store file (see local_file)"""
+        try:
+            file_size = source_stat(file_path).st_size
+        except FileNotFoundError:
             return f"Error: File {file_path} not found"
         
-        file_size = os.path.getsize(file_path)
-        
         # Connect to target
-        if not self.connect(port):
+        if not self.connect_for_transfer(port, target_node or filename):
             return f"Error: Could not connect to target on port {port}"
         
         try:
-            # Start transfer session
-            start_request = file_transfer_pb2.TransferRequest(
+            response = self._transfer(file_path, file_size, filename, target_node, sender_node)
+            if not response.success:
+                return f"Transfer failed"
+
+            summary = self.transfer_stats.summary() if self.transfer_stats else None
+            return f"✓ {filename} sent to {target_node}" + (f" ({summary})" if summary else "")
+
+        except grpc.RpcError:
+            return f"✗ Transfer failed"
+        except Exception:
+            return f"✗ Transfer failed"
+        finally:
+            self.disconnect()
+
+    def replicate_file(self, file_path: str, filename: str, sender_node: str, port: int,
+                       replication_factor: int) -> dict:
+        """Upload a file once and let the router replicate it to `replication_factor` cloud nodes.
+
+        The result maps each replica node to True (stored), False (failed or
+        queued for store-and-forward) or None (still in progress).
+        """
+        if not os.path.exists(file_path):
+            return {}
+
+        file_size = os.path.getsize(file_path)
+
+        if not self.connect_for_transfer(port, filename):
+            return {}
+
+        try:
+            response = self._transfer(file_path, file_size, filename, "", sender_node, replication_factor)
+            if not response.success:
+                return {}
+
+            return {replica.node_name: None if replica.pending else replica.success
+                    for replica in response.replicas}
+        except grpc.RpcError:
+            return {}
+        finally:
+            self.disconnect()
+
+    def _transfer(self, file_path, file_size, filename, target_node, sender_node, replication_factor=0):
+        """Send a file over the connected channel, returning the final TransferResponse"""
+        self.transfer_stats = None
+        if file_size >= self.resumable_min_size or self._dedup_block_size(file_size):
+            try:
+                return self._send_file_resumable(file_path, file_size, filename, target_node, sender_node,
+                                                 replication_factor)
+            except grpc.RpcError as e:
+                # Older servers don't implement QueryTransfer, send the file in one go
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+
+        if self.use_streaming:
+            try:
+                # A one-shot stream has nothing to resume, so a corrupt one is sent again whole
+                for _ in range(CHUNK_VERIFY_RETRIES + 1):
+                    response = self._stream_file(file_path, file_size, filename, target_node, sender_node,
+                                                 replication_factor)
+                    if not response.verification_failed:
+                        break
+                return response
+            except grpc.RpcError as e:
+                # Older servers don't implement StreamFile, use the chunked path
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+
+        return self._send_file_chunked(file_path, file_size, filename, target_node, sender_node,
+                                       replication_factor)
+
+    def _chunk_controller(self, target_node, file_size):
+        """Ack-driven chunk sizer for a transfer to target_node, None when sizing is fixed"""
+        if not self.adaptive_chunk_sizing or file_size <= self.min_chunk_size:
+            return None
+
+        default_size, _ = self._calculate_chunk_parameters(file_size)
+        key = (self.channel_target, target_node)
+        return chunk_sizer.controller(key, default_size, self.min_chunk_size, self.max_chunk_size,
+                                      self.target_chunk_time)
+
+    def _read_chunks(self, file_path, file_size, buckets=None, controller=None):
+        """Yield (chunk_number, total_chunks, offset, data) for a file, throttled by the bandwidth shaper.
+
+        data is a zero-copy slice of the file (see ChunkReader).
+        With a controller, each chunk takes the controller's current size (see
+        ChunkSizeController), and total_chunks is an estimate that becomes
+        exact on the last chunk.
+        """
+        chunk_size, num_chunks = self._calculate_chunk_parameters(file_size)
+        chunk_num = 0
+        offset = 0
+
+        with open_source(file_path) as reader:
+            while True:
+                if controller:
+                    chunk_size = controller.chunk_size
+                chunk_data = reader.read(offset, chunk_size)
+                if not chunk_data and chunk_num > 0:
+                    break
+
+                chunk_num += 1
+                remaining = file_size - offset - len(chunk_data)
+                if controller:
+                    num_chunks = chunk_num + (math.ceil(remaining / controller.chunk_size) if remaining > 0 else 0)
+
+                # Simulate bandwidth limitation
+                self.shaper.throttle(buckets, len(chunk_data))
+
+                yield chunk_num, num_chunks, offset, chunk_data
+
+                offset += len(chunk_data)
+                if remaining <= 0:
+                    break
+
+    def _read_chunk_ranges(self, file_path, file_size, chunk_size, ranges, buckets=None):
+        """Yield (chunk_number, total_chunks, offset, data) for the fixed-size chunks in ranges.
+
+        ranges are inclusive (start, end) chunk numbers, as reported by QueryTransfer.
+        """
+        num_chunks = max(1, math.ceil(file_size / chunk_size))
+
+        with open_source(file_path) as reader:
+            for start, end in ranges:
+                for chunk_num in range(start, end + 1):
+                    offset = (chunk_num - 1) * chunk_size
+                    chunk_data = reader.read(offset, chunk_size)
+
+                    # Simulate bandwidth limitation
+                    self.shaper.throttle(buckets, len(chunk_data))
+                    yield chunk_num, num_chunks, offset, chunk_data
+
+    def _iter_chunks(self, file_path, file_size, filename, target_node, sender_node, transfer_id="",
+                     replication_factor=0, chunk_size=None, ranges=None, stats=None, controller=None):
+        """Yield FileChunk messages (as WireChunks) for a file, or only for the fixed-size chunks in ranges.
+
+        With stats, chunk data is compressed with its codec where that pays off.
+        With a controller, a whole file is read in chunks of its current size.
+        """
+        buckets = self.shaper.buckets_for(self.uplink_node or sender_node, target_node)
+        if ranges is None:
+            chunks = self._read_chunks(file_path, file_size, buckets, controller)
+            # The whole-file digest is built from the chunks as they are read
+            digest = hashlib.sha256()
+        else:
+            # Sessions carry a digest taken before sending in StartTransfer
+            chunks = self._read_chunk_ranges(file_path, file_size, chunk_size, ranges, buckets)
+            digest = None
+
+        for chunk_num, num_chunks, offset, chunk_data in chunks:
+            file_digest = ""
+            if digest is not None:
+                digest.update(chunk_data)
+                if chunk_num == num_chunks:
+                    file_digest = digest.hexdigest()
+
+            # The digest is of the original file, offsets and the checksum are of what is sent
+            codec, chunk_data = stats.encode(chunk_data) if stats else (compression.COMPRESSION_NONE, chunk_data)
+            yield WireChunk(
+                chunk_data,
+                transfer_id=transfer_id,
+                chunk_number=chunk_num,
+                total_chunks=num_chunks,
                 filename=filename,
-                file_size=file_size,
                 target_node=target_node,
-                sender_node=sender_node
+                sender_node=sender_node,
+                replication_factor=replication_factor,
+                offset=offset,
+                checksum=checksums.checksum(chunk_data, self.checksum_type),
+                checksum_type=self.checksum_type,
+                file_digest=file_digest,
+                compression=codec
             )
-            
-            start_response = self.file_transfer_stub.StartTransfer(start_request)
-            if not start_response.success:
-                return f"Error starting transfer: {start_response.message}"
-            
-            transfer_id = start_response.transfer_id
-            
-            # Calculate chunk parameters
-            chunk_size, num_chunks = self._calculate_chunk_parameters(file_size)
-
-            # Send file in chunks (silently)
-            with open(file_path, 'rb') as f:
-                for chunk_num in range(1, num_chunks + 1):
-                    chunk_data = f.read(chunk_size)
-                    if not chunk_data:
-                        break
 
-                    chunk_request = file_transfer_pb2.FileChunk(
-                        transfer_id=transfer_id,
-                        chunk_number=chunk_num,
-                        total_chunks=num_chunks,
-                        data=chunk_data,
+    def _stream_file(self, file_path, file_size, filename, target_node, sender_node, replication_factor=0):
+        """Send a file with a single client-streaming StreamFile call"""
+        # A stream has no handshake, the codec and checksum come from what the server said it handles
+        self.transfer_stats = compression.TransferStats(compression.choose(self.peer_codecs()))
+        self.checksum_type = checksums.choose(self.peer_checksum_types())
+        # The call is only acked as a whole, its throughput sizes the next transfer's chunks
+        controller = self._chunk_controller(target_node, file_size)
+        started = time.monotonic()
+        response = self.stream_file(
+            self._iter_chunks(file_path, file_size, filename, target_node, sender_node,
+                              replication_factor=replication_factor, stats=self.transfer_stats,
+                              controller=controller)
+        )
+        if controller and response.success:
+            controller.record_transfer(file_size, time.monotonic() - started)
+        return response
+
+    def _send_file_chunked(self, file_path, file_size, filename, target_node, sender_node, replication_factor=0):
+        """Send a file with StartTransfer / TransferChunk / CompleteTransfer"""
+        start_request = file_transfer_pb2.TransferRequest(
+            filename=filename,
+            file_size=file_size,
+            target_node=target_node,
+            sender_node=sender_node,
+            replication_factor=replication_factor,
+            compression=compression.choose(compression.supported()),
+            checksum_type=checksums.preferred_type()
+        )
+
+        start_response = self.file_transfer_stub.StartTransfer(start_request)
+        if not start_response.success:
+            return start_response
+
+        transfer_id = start_response.transfer_id
+        # The server answers with the proposed codec, or NONE if it can't decode it
+        self.transfer_stats = compression.TransferStats(start_response.compression)
+        # and the proposed checksum, or CRC32 if it would be slow there (servers from before that say nothing)
+        self.checksum_type = start_response.checksum_type or checksums.CHECKSUM_CRC32
+
+        # Send file in chunks (silently)
+        chunk_response = start_response
+        # Every TransferChunk response acks its chunk, which sizes the next one
+        controller = self._chunk_controller(target_node, file_size)
+        try:
+            for chunk_request in self._iter_chunks(file_path, file_size, filename, target_node, sender_node,
+                                                   transfer_id, replication_factor, stats=self.transfer_stats,
+                                                   controller=controller):
+                started = time.monotonic()
+                chunk_response = self._send_chunk(chunk_request)
+                if not chunk_response.success:
+                    return chunk_response
+                if controller:
+                    controller.record(len(chunk_request.data), time.monotonic() - started)
+        finally:
+            # Complete transfer, a failed one too, so the receiver drops the session instead of holding it
+            complete_request = file_transfer_pb2.CompleteTransferRequest(
+                transfer_id=transfer_id,
+                filename=filename,
+                target_node=target_node
+            )
+            try:
+                self.file_transfer_stub.CompleteTransfer(complete_request)
+            except grpc.RpcError:
+                pass
+
+        return chunk_response
+
+    def _send_chunk(self, chunk_request):
+        """Send one chunk with TransferChunk, resending it while it fails verification"""
+        for _ in range(CHUNK_VERIFY_RETRIES + 1):
+            response = self.transfer_chunk(chunk_request)
+            if chunk_request.chunk_number not in response.corrupt_chunks:
+                break
+        return response
+
+    def _dedup_block_size(self, file_size):
+        """Block size of the connected server's chunk store if a transfer should offer it block hashes, else 0.
+
+        Only the server at the other end of the channel can match hashes. A
+        router has no store, so transfers through it (to a cloud too) are sent
+        as usual, and the router's own forward to the cloud offers the hashes.
+        """
+        if not self.dedup_to_clouds or file_size <= 0:
+            return 0
+        health = self.peer_health()
+        return health.chunk_store_block_size if health else 0
+
+    @staticmethod
+    def _file_digests(file_path, chunk_size, with_chunk_hashes=False):
+        """SHA-256 of a whole file and, optionally, of each fixed-size chunk, in one read"""
+        file_digest = hashlib.sha256()
+        hashes = []
+        offset = 0
+        with open_source(file_path) as reader:
+            while True:
+                data = reader.read(offset, chunk_size)
+                offset += len(data)
+                file_digest.update(data)
+                if with_chunk_hashes and (data or not hashes):
+                    hashes.append(hashlib.sha256(data).hexdigest())
+                if len(data) < chunk_size:
+                    break
+        return file_digest.hexdigest(), hashes
+
+    def _resumable_transfer_id(self, file_path, filename, target_node, sender_node, replication_factor=0):
+        """Stable session id for sending this version of a file to this destination"""
+        stat = source_stat(file_path)
+        identity = (f"{self.channel_target}|{sender_node}|{target_node}|{filename}|"
+                    f"{stat.st_size}|{stat.st_mtime_ns}|{replication_factor}")
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def _send_file_resumable(self, file_path, file_size, filename, target_node, sender_node, replication_factor=0):
+        """Send a file as a resumable session, only sending the chunks the receiver is missing.
+
+        A session left over from an interrupted send of the same file is picked
+        up where it stopped. A call that drops is retried up to RESUME_RETRIES
+        times, each time asking the receiver which chunks are still missing.
+        Servers with a chunk store are offered the chunk hashes up front and
+        report the chunks their store already holds as received.
+        """
+        transfer_id = self._resumable_transfer_id(file_path, filename, target_node, sender_node,
+                                                  replication_factor)
+        block_size = self._dedup_block_size(file_size)
+        if block_size:
+            # Chunks line up with the store's blocks so their hashes can be matched
+            chunk_size = block_size
+        else:
+            chunk_size, _ = self._calculate_chunk_parameters(file_size)
+        file_digest, chunk_hashes = self._file_digests(file_path, chunk_size, bool(block_size))
+        # Picking up an existing session skips StartTransfer, so that codec and checksum come from HealthCheck
+        codec = None
+        self.checksum_type = checksums.choose(self.peer_checksum_types())
+
+        for attempt in range(RESUME_RETRIES + 1):
+            # Only the chunks' own response counts, a call that broke off leaves none and the gaps are asked again
+            response = None
+            try:
+                query = self.file_transfer_stub.QueryTransfer(
+                    file_transfer_pb2.QueryTransferRequest(transfer_id=transfer_id)
+                )
+                if not (query.exists and query.file_size == file_size and query.chunk_size == chunk_size):
+                    start_response = self.file_transfer_stub.StartTransfer(file_transfer_pb2.TransferRequest(
                         filename=filename,
+                        file_size=file_size,
                         target_node=target_node,
-                        sender_node=sender_node
+                        sender_node=sender_node,
+                        replication_factor=replication_factor,
+                        transfer_id=transfer_id,
+                        chunk_size=chunk_size,
+                        chunk_hashes=chunk_hashes,
+                        file_digest=file_digest,
+                        compression=compression.choose(compression.supported()),
+                        checksum_type=checksums.preferred_type()
+                    ))
+                    if not start_response.success:
+                        return start_response
+                    codec = start_response.compression
+                    self.checksum_type = start_response.checksum_type or checksums.CHECKSUM_CRC32
+                    query = self.file_transfer_stub.QueryTransfer(
+                        file_transfer_pb2.QueryTransferRequest(transfer_id=transfer_id)
                     )
+                missing = [(chunk_range.start, chunk_range.end) for chunk_range in query.missing]
 
-                    chunk_response = self.file_transfer_stub.TransferChunk(chunk_request)
-                    if not chunk_response.success:
-                        return f"Transfer failed"
+                if not query.exists:
+                    response = file_transfer_pb2.TransferResponse(
+                        success=False,
+                        message=f"Transfer session for {filename} was lost",
+                        transfer_id=transfer_id
+                    )
+                elif missing:
+                    if codec is None:
+                        codec = compression.choose(self.peer_codecs())
+                    if self.transfer_stats is None:
+                        self.transfer_stats = compression.TransferStats(codec)
+                    response = self._send_chunk_ranges(file_path, file_size, filename, target_node, sender_node,
+                                                       transfer_id, replication_factor, chunk_size, missing)
+                else:
+                    # Every chunk made it before the previous call dropped, or was already stored
+                    response = file_transfer_pb2.TransferResponse(
+                        success=True,
+                        message=f"File {filename} already received",
+                        transfer_id=transfer_id
+                    )
+            except grpc.RpcError as e:
+                if e.code() == grpc.StatusCode.UNIMPLEMENTED or attempt == RESUME_RETRIES:
+                    raise
 
-                    # Simulate bandwidth limitation
-                    time.sleep(len(chunk_data) / self.bandwidth_bytes_per_sec)
+            if response is not None and response.success:
+                break
 
-            # Complete transfer
-            complete_request = file_transfer_pb2.CompleteTransferRequest(
+            # Give a dropped channel the chance to reconnect before asking for the gaps
+            channel_pool.ensure_ready(self.channel_target)
+
+        # A session that still has gaps stays on the receiver for the next attempt
+        if response.success:
+            self.file_transfer_stub.CompleteTransfer(file_transfer_pb2.CompleteTransferRequest(
                 transfer_id=transfer_id,
                 filename=filename,
                 target_node=target_node
-            )
+            ))
+        return response
 
-            self.file_transfer_stub.CompleteTransfer(complete_request)
+    def _send_chunk_ranges(self, file_path, file_size, filename, target_node, sender_node, transfer_id,
+                           replication_factor, chunk_size, ranges):
+        """Send the chunks in ranges into an open resumable session"""
+        def chunks():
+            return self._iter_chunks(file_path, file_size, filename, target_node, sender_node, transfer_id,
+                                     replication_factor, chunk_size, ranges, self.transfer_stats)
 
-            return f"✓ {filename} sent to {target_node}"
+        if self.use_streaming:
+            try:
+                return self.stream_file(chunks())
+            except grpc.RpcError as e:
+                # Older servers don't implement StreamFile, use the chunked path
+                if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                    raise
+
+        response = None
+        for chunk_request in chunks():
+            response = self._send_chunk(chunk_request)
+            if not response.success:
+                return response
+        return response
+
+    def fan_out_file(self, file_path: str, filename: str, target_nodes: list, sender_node: str, port: int,
+                     quorum: Optional[int] = None) -> dict:
+        """Stream a file to several targets at once, each at its own pace.
+
+        One reader thread reads, compresses and checksums every chunk once and
+        hands the same chunk to each target's relay, which charges its copy to
+        the sender's uplink as it goes out. The reader stays at most
+        FAN_OUT_READ_AHEAD chunks ahead of the fastest target, slower targets
+        keep a backlog of the shared chunks instead of holding it back.
+        Returns as soon as `quorum` targets have acked (all of them by default);
+        the others keep going in the background. The result maps each target to
+        True (acked), False (failed) or None (still in progress).
+        """
+        results = {target: None for target in target_nodes}
+        if not os.path.exists(file_path):
+            return {target: False for target in target_nodes}
+
+        file_size = os.path.getsize(file_path)
+        quorum = len(target_nodes) if quorum is None else min(quorum, len(target_nodes))
+        done = threading.Condition()
+        progress = threading.Condition()
+
+        def sent():
+            with progress:
+                progress.notify_all()
+
+        # Each copy goes out over the sender's uplink
+        buckets = self.shaper.buckets_for(self.uplink_node or sender_node)
+        relays = {}
+        for target in target_nodes:
+            relay = ChunkRelay(port, self.target_host, queue_size=0, routing_key=target, buckets=buckets,
+                               on_sent=sent)
+            if relay.start():
+                relays[target] = relay
+            else:
+                results[target] = False
+
+        def record(target, success):
+            with done:
+                results[target] = success
+                done.notify_all()
+
+        # Every stream goes to the same router or its shards, any relay's codecs and checksums stand for all of them
+        first = next(iter(relays.values()), None)
+        self.transfer_stats = compression.TransferStats(compression.choose(first.codecs if first else []))
+        self.checksum_type = checksums.choose(first.checksum_types if first else [])
+
+        def has_room(live):
+            return any(relay.backlog() < FAN_OUT_READ_AHEAD or relay.future.done() for relay in live.values())
+
+        def feed():
+            live = dict(relays)
+            digest = hashlib.sha256()
+            try:
+                for chunk_num, num_chunks, offset, chunk_data in self._read_chunks(file_path, file_size):
+                    digest.update(chunk_data)
+                    codec, data = self.transfer_stats.encode(chunk_data)
+                    fields = dict(
+                        chunk_number=chunk_num,
+                        total_chunks=num_chunks,
+                        offset=offset,
+                        filename=filename,
+                        sender_node=sender_node,
+                        checksum=checksums.checksum(data, self.checksum_type),
+                        checksum_type=self.checksum_type,
+                        file_digest=digest.hexdigest() if chunk_num == num_chunks else "",
+                        compression=codec
+                    )
+                    # A stream's target comes from its first chunk, every later chunk is one shared WireChunk
+                    shared = WireChunk(data, **fields) if chunk_num > 1 else None
+                    for target, relay in list(live.items()):
+                        if not relay.push(shared or WireChunk(data, target_node=target, **fields)):
+                            del live[target]
+                    if not live:
+                        break
+
+                    with progress:
+                        stalled = not progress.wait_for(lambda: has_room(live), timeout=30)
+                    if stalled:
+                        # No target took a chunk for as long as a relay waits on a full queue
+                        for relay in live.values():
+                            relay.abort()
+                        break
+            except Exception:
+                for relay in live.values():
+                    relay.abort()
+            finally:
+                for target, relay in relays.items():
+                    relay.finish(lambda success, target=target: record(target, success))
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        with done:
+            done.wait_for(lambda: sum(1 for ok in results.values() if ok) >= quorum or
+                          all(ok is not None for ok in results.values()))
+            return dict(results)
 
-        except grpc.RpcError:
-            return f"✗ Transfer failed"
-        except Exception:
-            return f"✗ Transfer failed"
-        finally:
-            self.disconnect()
-    
     def get_file_info(self, filename: str, port: int) -> Optional[dict]:
         """Get information about a file on the target node"""
         if not self.connect(port):
@@ -248,3 +758,170 @@ class GRPCClient:
             return None
         finally:
             self.disconnect()
+
+    def health_check(self, port: int) -> bool:
+        """Whether the gRPC server on port is up and reports itself healthy"""
+        if not self.connect(port):
+            return False
+
+        try:
+            return self.node_mgmt_stub.HealthCheck(file_transfer_pb2.Empty()).healthy
+        except grpc.RpcError:
+            return False
+        finally:
+            self.disconnect()
+
+    def run_command(self, command: str, args: list, port: int) -> Optional[dict]:
+        """Run a prompt command on a headless node"""
+        if not self.connect(port):
+            return None
+
+        try:
+            request = file_transfer_pb2.NodeCommand(command=command, args=args)
+            response = self.node_control_stub.RunCommand(request)
+            return {
+                'success': response.success,
+                'output': response.output
+            }
+        except grpc.RpcError as e:
+            return {
+                'success': False,
+                'output': f"Error: {e.details() or e.code().name}"
+            }
+        finally:
+            self.disconnect()
+
+
+class ChunkRelay:
+    """Pipe chunks on to a downstream node over one StreamFile call while they are still arriving"""
+
+    def __init__(self, port: int, target_host='localhost', queue_size: int = 8, routing_key: str = None,
+                 buckets: list = None, on_close=None, on_sent=None):
+        self.port = port
+        self.routing_key = routing_key  # sent straight to the router shard handling it, see connect_for_transfer
+        self.buckets = buckets  # shaper buckets the relayed bytes are charged to as they go out
+        self.on_close = on_close  # called once the relay is done with, after finish()'s callback
+        self.on_sent = on_sent  # called whenever a queued chunk is taken for sending
+        self.closed = False
+        self.close_lock = threading.Lock()
+        self.client = GRPCClient(target_host)
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.future = None
+        self.failed = False
+        self.codecs = []
+        self.checksum_types = []
+
+    def start(self) -> bool:
+        """Open the downstream stream, returns False if the target can't be reached"""
+        connected = self.client.connect_for_transfer(self.port, self.routing_key) if self.routing_key \
+            else self.client.connect(self.port)
+        if not connected:
+            return False
+
+        self.codecs = self.client.peer_codecs()
+        self.checksum_types = self.client.peer_checksum_types()
+        self.future = self.client.stream_file.future(self._iter_chunks())
+        return True
+
+    def _iter_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+            if self.on_sent:
+                self.on_sent()
+            if chunk is None:
+                return
+            shaper.throttle(self.buckets, len(chunk.data))
+            yield chunk
+
+    def backlog(self) -> int:
+        """Chunks queued and not yet taken for sending"""
+        return self.chunks.qsize()
+
+    def push(self, chunk, timeout: float = 30, file_digest: str = "") -> bool:
+        """Queue a chunk for the downstream node, returns False once the relay has failed.
+
+        file_digest goes out with the chunk when it doesn't carry one itself,
+        for a last chunk whose sender gave the digest in StartTransfer.
+        """
+        if self.failed:
+            return False
+
+        # The call only finishes early if the downstream side gave up
+        if self.future.done():
+            self.abort()
+            return False
+
+        # Chunks go on as they are, unless they belong to a session here (downstream they are one
+        # plain stream), the downstream node lacks their codec or would verify their checksum on the slow path
+        decompress = bool(chunk.compression) and chunk.compression not in self.codecs
+        checksum_type = chunk.checksum_type
+        if checksum_type == checksums.CHECKSUM_CRC32C and checksum_type not in self.checksum_types:
+            checksum_type = checksums.CHECKSUM_CRC32
+        file_digest = "" if chunk.file_digest else file_digest
+        if chunk.transfer_id or decompress or checksum_type != chunk.checksum_type or file_digest:
+            chunk = self._adapted(chunk, decompress, checksum_type, file_digest)
+
+        try:
+            self.chunks.put(chunk, timeout=timeout)
+        except queue.Full:
+            self.abort()
+            return False
+        return True
+
+    @staticmethod
+    def _adapted(chunk, decompress, checksum_type, file_digest=""):
+        """Copy of a received FileChunk for a one-shot stream, decompressed if asked, checksummed with checksum_type"""
+        data = compression.decompress(chunk.data, chunk.compression) if decompress else chunk.data
+        adapted = WireChunk(data)
+        adapted.header.CopyFrom(chunk)
+        adapted.header.ClearField('data')
+        # The session id is the upstream receiver's, downstream it would name a session that doesn't exist
+        adapted.header.ClearField('transfer_id')
+        if file_digest:
+            adapted.header.file_digest = file_digest
+        if decompress:
+            adapted.header.compression = compression.COMPRESSION_NONE
+        if decompress or checksum_type != chunk.checksum_type:
+            adapted.header.checksum_type = checksum_type
+            adapted.header.checksum = checksums.checksum(data, checksum_type)
+        return adapted
+
+    def finish(self, callback, timeout: float = 30):
+        """Close the stream, callback(success) runs once the downstream node has answered"""
+        if self.failed:
+            callback(False)
+            return
+
+        try:
+            self.chunks.put(None, timeout=timeout)
+        except queue.Full:
+            self.abort()
+            callback(False)
+            return
+
+        def on_done(future):
+            try:
+                success = future.result().success
+            except Exception:
+                success = False
+            self.client.disconnect()
+            callback(success)
+            self._close()
+
+        self.future.add_done_callback(on_done)
+
+    def abort(self):
+        """Cancel the downstream stream, the target discards what it received"""
+        self.failed = True
+        if self.future:
+            self.future.cancel()
+        self.client.disconnect()
+        self._close()
+
+    def _close(self):
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+        if self.on_close:
+            self.on_close()
@@ -2,15 +2,24 @@ import grpc
 from concurrent import futures
 import os
 import json
+import math
+import hashlib
+import sqlite3
 import threading
 import time
 import uuid
+import itertools
 import tempfile
 import shutil
 from typing import Dict, Set
 
 import file_transfer_pb2
 import file_transfer_pb2_grpc
+from config import RESUMABLE_SESSION_TTL, CLOUD_NODES, CHUNK_STORE_ENABLED, SERVER_GRPC_PORT, GRPC_SERVER_THREADS
+from chunk_store import ChunkStore, MissingBlocksError
+from disk_index import disk_index
+import checksums
+import compression
 
 # Enable gRPC verbose logging for debugging
 os.environ['GRPC_VERBOSITY'] = 'info'
@@ -22,23 +31,40 @@ class FileTransferServicer(file_transfer_pb2_grpc.FileTransferServiceServicer):
         self.disk_path = disk_path
         self.router_manager = router_manager
         self.active_transfers: Dict[str, dict] = {}
+        # Guards the active_transfers map only, each session has its own lock
         self.transfer_lock = threading.Lock()
+
+        # Partially received files live here until they are complete
+        self.incoming_path = os.path.join(disk_path, ".incoming")
+        os.makedirs(self.incoming_path, exist_ok=True)
+        self._expire_sessions()
+
+        # Cloud nodes keep received files as deduplicated blocks
+        self.chunk_store = ChunkStore(disk_path) if CHUNK_STORE_ENABLED and node_name in CLOUD_NODES else None
+        # Shared with the VirtualNode on the same disk
+        self.disk_index = disk_index(disk_path, self.chunk_store)
         
     def StartTransfer(self, request, context):
         """Start a new file transfer session"""
+        if request.transfer_id:
+            return self._start_resumable_transfer(request)
+
         transfer_id = str(uuid.uuid4())
 
+        try:
+            temp_path, temp_file = self._open_temp_file(transfer_id, request.file_size)
+        except OSError as e:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Error preparing {request.filename}: {str(e)}"
+            )
+
+        # Opening relays waits for their channels, so it stays outside the session map lock
+        relays = self._open_relays(request.filename, request.target_node, request.sender_node,
+                                   request.replication_factor)
+        transfer_info = self._new_session(request, temp_path, temp_file, relays)
         with self.transfer_lock:
-            self.active_transfers[transfer_id] = {
-                'filename': request.filename,
-                'file_size': request.file_size,
-                'target_node': request.target_node,
-                'sender_node': request.sender_node,
-                'chunks_received': 0,
-                'total_chunks': 0,
-                'temp_file': None,
-                'chunks_data': {}
-            }
+            self.active_transfers[transfer_id] = transfer_info
 
         # Log transfer start for router
         if self.router_manager:
@@ -47,90 +73,80 @@ class FileTransferServicer(file_transfer_pb2_grpc.FileTransferServiceServicer):
         return file_transfer_pb2.TransferResponse(
             success=True,
             message=f"Transfer session started for {request.filename}",
-            transfer_id=transfer_id
+            transfer_id=transfer_id,
+            compression=compression.accept(request.compression),
+            checksum_type=checksums.accept(request.checksum_type)
         )
     
     def TransferChunk(self, request, context):
         """Receive a file chunk"""
         transfer_id = request.transfer_id
+        transfer_info = self._get_session(transfer_id)
 
-        with self.transfer_lock:
-            if transfer_id not in self.active_transfers:
-                return file_transfer_pb2.TransferResponse(
-                    success=False,
-                    message=f"Transfer session {transfer_id} not found"
-                )
-
-            transfer_info = self.active_transfers[transfer_id]
-            transfer_info['chunks_data'][request.chunk_number] = request.data
-            transfer_info['chunks_received'] += 1
-            transfer_info['total_chunks'] = request.total_chunks
-
-            # Log chunk progress for router
-            if self.router_manager:
-                # Show progress on console for router
-                print(f"{request.filename}: {request.chunk_number}/{request.total_chunks}")
-
-            # Check if all chunks received
-            if transfer_info['chunks_received'] == request.total_chunks:
-                # Reconstruct file
-                try:
-                    file_path = os.path.join(self.disk_path, request.filename)
-                    with open(file_path, 'wb') as f:
-                        for i in range(1, request.total_chunks + 1):
-                            if i in transfer_info['chunks_data']:
-                                f.write(transfer_info['chunks_data'][i])
-
-                    # Update virtual disk metadata
-                    self._update_virtual_disk(request.filename, os.path.getsize(file_path))
-
-                    # Log completion for router
-                    if self.router_manager:
-                        print(f"{request.filename}: complete")
-
-                    # If this is a router and the file is for another node, forward it
-                    if (self.router_manager and
-                        request.target_node and
-                        request.target_node != self.node_name):
-                        self._forward_file_to_target(request.filename, request.target_node, request.sender_node)
+        if transfer_info is None:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Transfer session {transfer_id} not found"
+            )
 
-                    return file_transfer_pb2.TransferResponse(
-                        success=True,
-                        message=f"File {request.filename} received successfully",
-                        transfer_id=transfer_id
-                    )
-                except Exception as e:
-                    if self.router_manager:
-                        self.router_manager.logger.error(f"Error reconstructing {request.filename}: {str(e)}")
-                    return file_transfer_pb2.TransferResponse(
-                        success=False,
-                        message=f"Error writing file: {str(e)}",
-                        transfer_id=transfer_id
-                    )
-            else:
-                return file_transfer_pb2.TransferResponse(
-                    success=True,
-                    message=f"Chunk {request.chunk_number}/{request.total_chunks} received",
-                    transfer_id=transfer_id
-                )
+        return self._receive_chunk(transfer_id, transfer_info, request)
     
     def CompleteTransfer(self, request, context):
         """Complete and cleanup a transfer session"""
-        with self.transfer_lock:
-            if request.transfer_id in self.active_transfers:
-                del self.active_transfers[request.transfer_id]
+        self._drop_session(request.transfer_id)
         
         return file_transfer_pb2.TransferResponse(
             success=True,
             message=f"Transfer {request.transfer_id} completed"
         )
     
+    def StreamFile(self, request_iterator, context):
+        """Receive a whole file over a single client-streaming call"""
+        stream = self._new_stream()
+        try:
+            for chunk in request_iterator:
+                # Chunks of a resumable session go into that session
+                if stream['file'] is None and chunk.transfer_id:
+                    return self._receive_session_stream(chunk.transfer_id,
+                                                        itertools.chain([chunk], request_iterator))
+                error = self._stream_chunk(stream, chunk)
+                if error:
+                    return error
+            return self._finish_stream(stream)
+        except Exception as e:
+            return self._stream_failed(stream, e)
+        finally:
+            self._close_stream(stream)
+
+    def QueryTransfer(self, request, context):
+        """Report the chunks a resumable session is still missing"""
+        transfer_id = request.transfer_id
+        transfer_info = self._get_session(transfer_id)
+
+        if transfer_info is None:
+            return file_transfer_pb2.QueryTransferResponse(
+                exists=False,
+                message=f"Transfer session {transfer_id} not found"
+            )
+
+        with transfer_info['lock']:
+            total_chunks = transfer_info['total_chunks']
+            missing = [] if transfer_info['completed'] else \
+                self._missing_ranges(transfer_info['bitmap'], total_chunks)
+            return file_transfer_pb2.QueryTransferResponse(
+                exists=True,
+                file_size=transfer_info['file_size'],
+                chunk_size=transfer_info['chunk_size'],
+                total_chunks=total_chunks,
+                missing=[file_transfer_pb2.ChunkRange(start=start, end=end) for start, end in missing],
+                message=f"{transfer_info['chunks_received']}/{total_chunks} chunks received"
+            )
+
     def GetFileInfo(self, request, context):
         """Get information about a file"""
-        file_path = os.path.join(self.disk_path, request.filename)
+        size = self._stored_size(request.filename)
         
-        if os.path.exists(file_path):
-            size = os.path.getsize(file_path)
+        if size is not None:
             return file_transfer_pb2.FileInfoResponse(
                 exists=True,
                 size=size,
@@ -147,16 +163,12 @@ class FileTransferServicer(file_transfer_pb2_grpc.FileTransferServiceServicer):
         """List files in the disk directory"""
         files = []
         try:
-            for filename in os.listdir(self.disk_path):
-                if filename != "disk_metadata.json":
-                    file_path = os.path.join(self.disk_path, filename)
-                    if os.path.isfile(file_path):
-                        size = os.path.getsize(file_path)
-                        files.append(file_transfer_pb2.FileEntry(
-                            name=filename,
-                            size=size,
-                            is_directory=False
-                        ))
+            for filename, size in self.disk_index.items():
+                files.append(file_transfer_pb2.FileEntry(
+                    name=filename,
+                    size=size,
+                    is_directory=False
+                ))
             
             return file_transfer_pb2.ListFilesResponse(
                 files=files,
@@ -168,72 +180,782 @@ class FileTransferServicer(file_transfer_pb2_grpc.FileTransferServiceServicer):
                 message=f"Error listing files: {str(e)}"
             )
     
-    def _update_virtual_disk(self, filename, size):
-        """Update the virtual disk metadata"""
-        metadata_path = os.path.join(self.disk_path, "disk_metadata.json")
-        virtual_disk = {}
-        
-        if os.path.exists(metadata_path):
+    def _new_session(self, request, temp_path, temp_file, relays, chunk_size=0, total_chunks=0):
+        """In-memory state of a transfer session started by request"""
+        return {
+            'filename': request.filename,
+            'file_size': request.file_size,
+            'target_node': request.target_node,
+            'sender_node': request.sender_node,
+            'chunks_received': 0,
+            'total_chunks': total_chunks,
+            'chunk_size': chunk_size,
+            'resumable': chunk_size > 0,
+            'temp_path': temp_path,
+            'temp_file': temp_file,
+            'bitmap': bytearray((total_chunks + 7) // 8),
+            'held_chunks': {},
+            'file_digest': request.file_digest,
+            'digest': hashlib.sha256(),
+            'next_digest_chunk': 1,
+            'completed': False,
+            'lock': threading.Lock(),
+            'replication_factor': request.replication_factor,
+            'relays': relays,
+            'next_relay_chunk': 1
+        }
+
+    def _new_stream(self):
+        """State of one StreamFile call, filled in from its first chunk"""
+        return {
+            'transfer_id': str(uuid.uuid4()),
+            'filename': None,
+            'target_node': None,
+            'sender_node': None,
+            'replication_factor': 0,
+            'chunks_received': 0,
+            'total_chunks': 0,
+            'temp_path': None,
+            'file': None,
+            'relays': {},
+            'digest': hashlib.sha256(),
+            'file_digest': ""
+        }
+
+    def _stream_chunk(self, stream, chunk):
+        """Write one chunk of a StreamFile call, returns an error response or None"""
+        if stream['file'] is None:
+            # The first chunk carries the transfer metadata
+            stream['filename'] = chunk.filename
+            stream['target_node'] = chunk.target_node
+            stream['sender_node'] = chunk.sender_node
+            stream['replication_factor'] = chunk.replication_factor
+            if self.router_manager:
+                print(f"{chunk.filename}: starting")
+            stream['temp_path'], stream['file'] = self._open_temp_file(stream['transfer_id'])
+            stream['relays'] = self._open_relays(chunk.filename, chunk.target_node, chunk.sender_node,
+                                                 chunk.replication_factor)
+
+        data = self._chunk_data(chunk)
+        if data is None:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Checksum mismatch on chunk {chunk.chunk_number} of {stream['filename']}",
+                transfer_id=stream['transfer_id'],
+                verification_failed=True,
+                corrupt_chunks=[chunk.chunk_number]
+            )
+
+        stream['file'].write(data)
+        stream['digest'].update(data)
+        if chunk.file_digest:
+            stream['file_digest'] = chunk.file_digest
+        # Relays get the chunk as it arrived, still compressed
+        self._push_to_relays(stream['relays'], chunk)
+        stream['chunks_received'] += 1
+        stream['total_chunks'] = chunk.total_chunks
+
+        if self.router_manager:
+            print(f"{stream['filename']}: {chunk.chunk_number}/{chunk.total_chunks}")
+        return None
+
+    def _finish_stream(self, stream):
+        """Verify and commit the file of a StreamFile call once its last chunk is in"""
+        filename = stream['filename']
+        transfer_id = stream['transfer_id']
+        if stream['file'] is None:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message="Empty transfer stream",
+                transfer_id=transfer_id
+            )
+        stream['file'].close()
+
+        if stream['chunks_received'] != stream['total_chunks']:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Incomplete stream for {filename}: {stream['chunks_received']}/{stream['total_chunks']} chunks",
+                transfer_id=transfer_id
+            )
+
+        if stream['file_digest'] and stream['digest'].hexdigest() != stream['file_digest']:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"File digest mismatch for {filename}",
+                transfer_id=transfer_id,
+                verification_failed=True
+            )
+
+        self._commit_temp_file(stream['temp_path'], filename, target_node=stream['target_node'])
+        stream['temp_path'] = None
+        finishing_relays, stream['relays'] = stream['relays'], {}
+        replicas = self._finish_file(filename, stream['target_node'], stream['sender_node'], finishing_relays,
+                                     stream['replication_factor'])
+
+        return file_transfer_pb2.TransferResponse(
+            success=True,
+            message=f"File {filename} received successfully",
+            transfer_id=transfer_id,
+            replicas=replicas
+        )
+
+    def _stream_failed(self, stream, error):
+        if self.router_manager:
+            self.router_manager.logger.error(f"Error receiving stream for {stream['filename']}: {str(error)}")
+        return file_transfer_pb2.TransferResponse(
+            success=False,
+            message=f"Error writing file: {str(error)}",
+            transfer_id=stream['transfer_id']
+        )
+
+    def _close_stream(self, stream):
+        """Throw away whatever a StreamFile call left behind without committing"""
+        if stream['temp_path']:
+            self._discard_temp_file(stream['temp_path'], stream['file'])
+        self._abort_relays(stream['relays'])
+
+    def _start_resumable_transfer(self, request):
+        """Open, or pick back up, the session a sender identifies by a stable transfer_id"""
+        transfer_id = request.transfer_id
+        if not self._valid_transfer_id(transfer_id) or request.chunk_size <= 0:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Invalid resumable session {transfer_id}"
+            )
+
+        transfer_info = self._get_session(transfer_id)
+        if transfer_info is not None:
+            with transfer_info['lock']:
+                resumable = (not transfer_info['completed'] and
+                             transfer_info['filename'] == request.filename and
+                             transfer_info['file_size'] == request.file_size and
+                             transfer_info['chunk_size'] == request.chunk_size)
+                received = transfer_info['chunks_received']
+                total_chunks = transfer_info['total_chunks']
+            if resumable:
+                return file_transfer_pb2.TransferResponse(
+                    success=True,
+                    message=f"Resuming {request.filename}: {received}/{total_chunks} chunks already received",
+                    transfer_id=transfer_id,
+                    compression=compression.accept(request.compression),
+                    checksum_type=checksums.accept(request.checksum_type)
+                )
+            # Same id but a different file, start over
+            self._drop_session(transfer_id)
+
+        try:
+            temp_path, temp_file = self._open_temp_file(transfer_id, request.file_size)
+        except OSError as e:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Error preparing {request.filename}: {str(e)}"
+            )
+
+        # Chunks are relayed while they arrive in order, see _receive_chunk and _end_session_stream
+        relays = self._open_relays(request.filename, request.target_node, request.sender_node,
+                                   request.replication_factor)
+        total_chunks = max(1, math.ceil(request.file_size / request.chunk_size))
+        transfer_info = self._new_session(request, temp_path, temp_file, relays,
+                                          request.chunk_size, total_chunks)
+        with transfer_info['lock']:
+            held = self._mark_held_chunks(transfer_info, request.chunk_hashes)
+            self._save_session(transfer_id, transfer_info)
+        with self.transfer_lock:
+            self.active_transfers[transfer_id] = transfer_info
+
+        if self.router_manager:
+            print(f"{request.filename}: starting")
+
+        # Nothing left to send when the store already holds every chunk
+        if held == total_chunks:
+            with transfer_info['lock']:
+                error = self._commit_session(transfer_id, transfer_info)
+                held = len(transfer_info['held_chunks'])
+            if error is None:
+                return self._finish_session(transfer_id, transfer_info)
+            if held == total_chunks:
+                return error
+            # Some of the blocks were collected meanwhile, the sender has to send those
+
+        message = f"Transfer session started for {request.filename}"
+        if held:
+            message += f", {held}/{total_chunks} chunks already stored"
+        return file_transfer_pb2.TransferResponse(
+            success=True,
+            message=message,
+            transfer_id=transfer_id,
+            compression=compression.accept(request.compression),
+            checksum_type=checksums.accept(request.checksum_type)
+        )
+
+    def _receive_chunk(self, transfer_id, transfer_info, request):
+        """Write one chunk into its session, finishing the file once every chunk is in"""
+        with transfer_info['lock']:
+            if transfer_info['completed']:
+                return file_transfer_pb2.TransferResponse(
+                    success=True,
+                    message=f"File {transfer_info['filename']} already received",
+                    transfer_id=transfer_id
+                )
+
+            if transfer_info['resumable']:
+                if not 1 <= request.chunk_number <= transfer_info['total_chunks']:
+                    return file_transfer_pb2.TransferResponse(
+                        success=False,
+                        message=f"Chunk {request.chunk_number} out of range",
+                        transfer_id=transfer_id
+                    )
+            else:
+                transfer_info['total_chunks'] = request.total_chunks
+            total_chunks = transfer_info['total_chunks']
+
+            # Corrupt chunks stay unmarked, so only they have to be resent
+            data = self._chunk_data(request)
+            if data is None:
+                return file_transfer_pb2.TransferResponse(
+                    success=False,
+                    message=f"Checksum mismatch on chunk {request.chunk_number} of {transfer_info['filename']}",
+                    transfer_id=transfer_id,
+                    verification_failed=True,
+                    corrupt_chunks=[request.chunk_number]
+                )
+
             try:
-                with open(metadata_path, 'r') as f:
-                    virtual_disk = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                virtual_disk = {}
-        
-        virtual_disk[filename] = size
-        
+                # Write the chunk straight to its slot in the temp file
+                if request.HasField('offset'):
+                    offset = request.offset
+                else:
+                    chunk_size = transfer_info['chunk_size'] or \
+                        math.ceil(transfer_info['file_size'] / request.total_chunks)
+                    offset = (request.chunk_number - 1) * chunk_size
+                temp_file = transfer_info['temp_file']
+                temp_file.seek(offset)
+                temp_file.write(data)
+            except Exception as e:
+                if self.router_manager:
+                    self.router_manager.logger.error(f"Error writing chunk of {request.filename}: {str(e)}")
+                return file_transfer_pb2.TransferResponse(
+                    success=False,
+                    message=f"Error writing chunk: {str(e)}",
+                    transfer_id=transfer_id
+                )
+
+            if self._mark_chunk(transfer_info['bitmap'], request.chunk_number):
+                transfer_info['chunks_received'] += 1
+
+            # Hash the file as it arrives while chunks come in order, otherwise once at commit
+            if request.file_digest:
+                transfer_info['file_digest'] = request.file_digest
+            if transfer_info['digest'] is not None:
+                if request.chunk_number == transfer_info['next_digest_chunk']:
+                    transfer_info['digest'].update(data)
+                    transfer_info['next_digest_chunk'] += 1
+                elif request.chunk_number > transfer_info['next_digest_chunk']:
+                    transfer_info['digest'] = None
+
+            # Cut-through only works while chunks arrive in order, otherwise store-and-forward.
+            # A chunk sent again after it was relayed changes nothing
+            if request.chunk_number == transfer_info['next_relay_chunk']:
+                # Sessions got the file digest in StartTransfer, downstream it goes with the last chunk
+                file_digest = transfer_info['file_digest'] if request.chunk_number == total_chunks else ""
+                self._push_to_relays(transfer_info['relays'], request, file_digest)
+                transfer_info['next_relay_chunk'] += 1
+            elif request.chunk_number > transfer_info['next_relay_chunk']:
+                self._abort_relays(transfer_info['relays'])
+
+            # Log chunk progress for router
+            if self.router_manager:
+                # Show progress on console for router
+                print(f"{transfer_info['filename']}: {request.chunk_number}/{total_chunks}")
+
+            # Check if all chunks received
+            if transfer_info['chunks_received'] != total_chunks:
+                if transfer_info['resumable']:
+                    self._save_session(transfer_id, transfer_info)
+                return file_transfer_pb2.TransferResponse(
+                    success=True,
+                    message=f"Chunk {request.chunk_number}/{total_chunks} received",
+                    transfer_id=transfer_id
+                )
+
+            error = self._commit_session(transfer_id, transfer_info)
+            if error:
+                return error
+
+        # The file is durable now, metadata and forwarding don't need the transfer lock
+        return self._finish_session(transfer_id, transfer_info)
+
+    @staticmethod
+    def _chunk_data(chunk):
+        """A chunk's original data, None if it fails its checksum or doesn't decompress"""
+        if not checksums.verify(chunk):
+            return None
         try:
-            with open(metadata_path, 'w') as f:
-                json.dump(virtual_disk, f)
-        except IOError as e:
-            print(f"Error saving metadata: {e}")
+            return compression.decompress(chunk.data, chunk.compression)
+        except ValueError:
+            return None
 
-    def _forward_file_to_target(self, filename, target_node, sender_node):
-        """Forward a file from router to target node using gRPC"""
-        if not self.router_manager:
-            return
+    def _commit_session(self, transfer_id, transfer_info):
+        """Move a session's assembled file into place (caller holds the session lock).
 
+        Returns an error response if that failed, None otherwise.
+        """
         try:
-            from config import IP_MAP
-            from grpc_client import GRPCClient
-
-            # Find target node's gRPC port
-            target_port = None
-            for ip, info in IP_MAP.items():
-                if info["node_name"] == target_node:
-                    target_port = info["grpc_port"]
+            if transfer_info['file_digest'] and self._session_digest(transfer_info) != transfer_info['file_digest']:
+                # Every chunk passed its checksum but the file doesn't add up, take it all again
+                self._reset_session(transfer_id, transfer_info)
+                return file_transfer_pb2.TransferResponse(
+                    success=False,
+                    message=f"File digest mismatch for {transfer_info['filename']}",
+                    transfer_id=transfer_id,
+                    verification_failed=True
+                )
+
+            transfer_info['temp_file'].close()
+            self._commit_temp_file(transfer_info['temp_path'], transfer_info['filename'],
+                                   transfer_info['held_chunks'], transfer_info['target_node'])
+            transfer_info['completed'] = True
+            self._remove_session_state(transfer_id)
+        except MissingBlocksError as e:
+            # Leave those chunks missing, so QueryTransfer asks the sender for them
+            self._unmark_held_chunks(transfer_id, transfer_info, e.indexes)
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Error writing file: {str(e)}",
+                transfer_id=transfer_id
+            )
+        except Exception as e:
+            if self.router_manager:
+                self.router_manager.logger.error(f"Error reconstructing {transfer_info['filename']}: {str(e)}")
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Error writing file: {str(e)}",
+                transfer_id=transfer_id
+            )
+        return None
+
+    def _session_digest(self, transfer_info):
+        """SHA-256 of a session's assembled file (caller holds the session lock)"""
+        if transfer_info['digest'] is not None and transfer_info['next_digest_chunk'] > transfer_info['total_chunks']:
+            return transfer_info['digest'].hexdigest()
+
+        # Chunks arrived out of order or across restarts, hash the assembled file once
+        transfer_info['temp_file'].flush()
+        held = transfer_info['held_chunks']
+        missing = [index for index, digest in held.items() if not self.chunk_store.has(digest)]
+        if missing:
+            raise MissingBlocksError(transfer_info['filename'], missing)
+
+        block_size = transfer_info['chunk_size'] or 1024 * 1024
+        digest = hashlib.sha256()
+        with open(transfer_info['temp_path'], 'rb') as f:
+            index = 0
+            while True:
+                if index in held:
+                    try:
+                        data = self.chunk_store.read_block(held[index])
+                    except FileNotFoundError:
+                        raise MissingBlocksError(transfer_info['filename'], [index])
+                    f.seek(len(data), os.SEEK_CUR)
+                else:
+                    data = f.read(block_size)
+                if not data:
                     break
+                digest.update(data)
+                index += 1
+        return digest.hexdigest()
 
-            if not target_port:
-                print(f"Target node {target_node} not found in IP_MAP")
-                return
+    def _unmark_held_chunks(self, transfer_id, transfer_info, indexes):
+        """Count chunks back as missing whose stored blocks went away before the commit (caller holds the session lock)"""
+        for index in indexes:
+            if transfer_info['held_chunks'].pop(index, None) and self._clear_chunk(transfer_info['bitmap'], index + 1):
+                transfer_info['chunks_received'] -= 1
+        if transfer_info['temp_file'].closed:
+            transfer_info['temp_file'] = open(transfer_info['temp_path'], 'r+b')
+        self._save_session(transfer_id, transfer_info)
 
-            # Check if target node is active
-            with self.router_manager.active_nodes_lock:
-                if target_node not in self.router_manager.active_nodes:
-                    self.router_manager.logger.warning(f"Target node {target_node} is not active, cannot forward {filename}")
-                    return
+    def _reset_session(self, transfer_id, transfer_info):
+        """Forget every chunk a session received (caller holds the session lock)"""
+        transfer_info['bitmap'] = bytearray(len(transfer_info['bitmap']))
+        transfer_info['held_chunks'] = {}
+        transfer_info['chunks_received'] = 0
+        transfer_info['digest'] = hashlib.sha256()
+        transfer_info['next_digest_chunk'] = 1
+        self._abort_relays(transfer_info['relays'])
+        if transfer_info['resumable']:
+            self._save_session(transfer_id, transfer_info)
+
+    def _finish_session(self, transfer_id, transfer_info):
+        """Record and hand on a committed session's file, returning the final response"""
+        replicas = []
+        try:
+            replicas = self._finish_file(transfer_info['filename'], transfer_info['target_node'],
+                                         transfer_info['sender_node'], transfer_info['relays'],
+                                         transfer_info['replication_factor'])
+        except Exception as e:
+            if self.router_manager:
+                self.router_manager.logger.error(f"Error finishing {transfer_info['filename']}: {str(e)}")
+
+        return file_transfer_pb2.TransferResponse(
+            success=True,
+            message=f"File {transfer_info['filename']} received successfully",
+            transfer_id=transfer_id,
+            replicas=replicas
+        )
+
+    def _mark_held_chunks(self, transfer_info, chunk_hashes):
+        """Mark the chunks the chunk store already holds as received, returning how many there are"""
+        if (not self.chunk_store or len(chunk_hashes) != transfer_info['total_chunks'] or
+                transfer_info['chunk_size'] != self.chunk_store.block_size):
+            return 0
+
+        for index, digest in enumerate(chunk_hashes):
+            if self.chunk_store.has(digest) and self._mark_chunk(transfer_info['bitmap'], index + 1):
+                transfer_info['held_chunks'][index] = digest
+                transfer_info['chunks_received'] += 1
+        return len(transfer_info['held_chunks'])
+
+    def _receive_session_stream(self, transfer_id, chunks):
+        """Feed a streamed batch of chunks into the resumable session transfer_id"""
+        transfer_info = self._get_session(transfer_id)
+        if transfer_info is None:
+            return file_transfer_pb2.TransferResponse(
+                success=False,
+                message=f"Transfer session {transfer_id} not found",
+                transfer_id=transfer_id
+            )
+
+        response = None
+        corrupt_chunks = []
+        try:
+            for chunk in chunks:
+                response = self._receive_chunk(transfer_id, transfer_info, chunk)
+                if response.corrupt_chunks:
+                    # Keep going, the sender resends corrupt chunks with the other gaps
+                    corrupt_chunks.extend(response.corrupt_chunks)
+                elif not response.success:
+                    return response
+            return self._session_stream_result(transfer_id, transfer_info, response, corrupt_chunks)
+        finally:
+            self._end_session_stream(transfer_info)
+
+    def _end_session_stream(self, transfer_info):
+        """Give up cut-through for a session whose streamed batch ended before the file was complete.
+
+        The sender may take until RESUMABLE_SESSION_TTL to send the gaps, too
+        long to hold relays open, so the file is stored and forwarded instead.
+        """
+        with transfer_info['lock']:
+            if not transfer_info['completed']:
+                self._abort_relays(transfer_info['relays'])
+
+    def _session_stream_result(self, transfer_id, transfer_info, response, corrupt_chunks):
+        """Response to a batch of streamed session chunks, given the response to the last one"""
+        with transfer_info['lock']:
+            if transfer_info['completed']:
+                return response
+            received = transfer_info['chunks_received']
+            total_chunks = transfer_info['total_chunks']
+
+        # The sender queries the gaps and sends them in its next call
+        return file_transfer_pb2.TransferResponse(
+            success=False,
+            message=f"Incomplete stream for {transfer_info['filename']}: {received}/{total_chunks} chunks",
+            transfer_id=transfer_id,
+            verification_failed=bool(corrupt_chunks),
+            corrupt_chunks=corrupt_chunks
+        )
+
+    def _get_session(self, transfer_id):
+        """Look a session up, reloading a resumable one persisted by an earlier run"""
+        # Only hold the session map lock long enough to look the transfer up
+        with self.transfer_lock:
+            transfer_info = self.active_transfers.get(transfer_id)
+            if transfer_info is None and self._valid_transfer_id(transfer_id):
+                transfer_info = self._load_session(transfer_id)
+                if transfer_info is not None:
+                    self.active_transfers[transfer_id] = transfer_info
+            return transfer_info
+
+    def _drop_session(self, transfer_id):
+        """Forget a session and everything it left in the incoming directory"""
+        with self.transfer_lock:
+            transfer_info = self.active_transfers.pop(transfer_id, None)
+
+        if transfer_info:
+            with transfer_info['lock']:
+                self._discard_temp_file(transfer_info['temp_path'], transfer_info['temp_file'])
+                if not transfer_info['completed']:
+                    self._abort_relays(transfer_info['relays'])
+        if self._valid_transfer_id(transfer_id):
+            self._remove_session_state(transfer_id)
+
+    @staticmethod
+    def _valid_transfer_id(transfer_id):
+        """Session ids name files in the incoming directory, keep them to plain tokens"""
+        return 0 < len(transfer_id) <= 64 and all(c.isalnum() or c == '-' for c in transfer_id)
+
+    def _session_state_path(self, transfer_id):
+        return os.path.join(self.incoming_path, f"{transfer_id}.session")
+
+    def _save_session(self, transfer_id, transfer_info):
+        """Persist a resumable session's received-chunk bitmap next to its temp file"""
+        state = {
+            'filename': transfer_info['filename'],
+            'file_size': transfer_info['file_size'],
+            'target_node': transfer_info['target_node'],
+            'sender_node': transfer_info['sender_node'],
+            'chunk_size': transfer_info['chunk_size'],
+            'total_chunks': transfer_info['total_chunks'],
+            'replication_factor': transfer_info['replication_factor'],
+            'bitmap': transfer_info['bitmap'].hex(),
+            'held_chunks': transfer_info['held_chunks'],
+            'file_digest': transfer_info['file_digest']
+        }
+
+        # Chunk data has to be on disk before the bitmap claims it is
+        transfer_info['temp_file'].flush()
+        state_path = self._session_state_path(transfer_id)
+        with open(state_path + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(state_path + ".tmp", state_path)
+
+    def _load_session(self, transfer_id):
+        """Rebuild a resumable session from its persisted state, None if there is none"""
+        state_path = self._session_state_path(transfer_id)
+        temp_path = os.path.join(self.incoming_path, f"{transfer_id}.part")
+        if not os.path.exists(state_path) or not os.path.exists(temp_path):
+            return None
+
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            bitmap = bytearray.fromhex(state['bitmap'])
+            temp_file = open(temp_path, 'r+b')
+        except (json.JSONDecodeError, KeyError, ValueError, OSError):
+            return None
+
+        request = file_transfer_pb2.TransferRequest(
+            filename=state['filename'],
+            file_size=state['file_size'],
+            target_node=state['target_node'],
+            sender_node=state['sender_node'],
+            replication_factor=state['replication_factor'],
+            file_digest=state.get('file_digest', '')
+        )
+        # The chunks received before the restart never reached a relay, so the file is stored and forwarded
+        relays = self._open_relays(request.filename, request.target_node, request.sender_node,
+                                   request.replication_factor, cut_through=False)
+        transfer_info = self._new_session(request, temp_path, temp_file, relays,
+                                          state['chunk_size'], state['total_chunks'])
+        transfer_info['bitmap'] = bitmap
+        transfer_info['digest'] = None
+        transfer_info['held_chunks'] = {int(index): digest for index, digest in state.get('held_chunks', {}).items()}
+        transfer_info['chunks_received'] = sum(bin(byte).count('1') for byte in bitmap)
+        return transfer_info
 
-            # Forward file to target node
-            file_path = os.path.join(self.disk_path, filename)
-            print(f"{filename}: forwarding to {target_node}")
+    def _remove_session_state(self, transfer_id):
+        try:
+            os.remove(self._session_state_path(transfer_id))
+        except FileNotFoundError:
+            pass
+
+    def _expire_sessions(self):
+        """Remove partial transfers nobody has touched for RESUMABLE_SESSION_TTL"""
+        cutoff = time.time() - RESUMABLE_SESSION_TTL
+        for entry in os.scandir(self.incoming_path):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _mark_chunk(bitmap, chunk_number):
+        """Set chunk_number's bit, returning False if it was already set"""
+        if chunk_number < 1:
+            return False
+        index, bit = divmod(chunk_number - 1, 8)
+        if index >= len(bitmap):
+            bitmap.extend(bytes(index + 1 - len(bitmap)))
+        if bitmap[index] & (1 << bit):
+            return False
+        bitmap[index] |= 1 << bit
+        return True
 
-            client = GRPCClient()
-            result = client.send_file(
-                file_path=file_path,
+    @staticmethod
+    def _clear_chunk(bitmap, chunk_number):
+        """Clear chunk_number's bit, returning False if it wasn't set"""
+        index, bit = divmod(chunk_number - 1, 8)
+        if chunk_number < 1 or index >= len(bitmap) or not bitmap[index] & (1 << bit):
+            return False
+        bitmap[index] &= ~(1 << bit)
+        return True
+
+    @staticmethod
+    def _missing_ranges(bitmap, total_chunks):
+        """Inclusive (start, end) runs of chunk numbers whose bit is not set"""
+        ranges = []
+        start = None
+        for chunk_number in range(1, total_chunks + 1):
+            index, bit = divmod(chunk_number - 1, 8)
+            have = index < len(bitmap) and bitmap[index] & (1 << bit)
+            if not have and start is None:
+                start = chunk_number
+            elif have and start is not None:
+                ranges.append((start, chunk_number - 1))
+                start = None
+        if start is not None:
+            ranges.append((start, total_chunks))
+        return ranges
+
+    def _open_temp_file(self, transfer_id, file_size=0):
+        """Create the temp file a transfer is assembled in, preallocated to file_size"""
+        temp_path = os.path.join(self.incoming_path, f"{transfer_id}.part")
+        temp_file = open(temp_path, 'wb')
+        if file_size:
+            temp_file.truncate(file_size)
+        return temp_path, temp_file
+
+    def _commit_temp_file(self, temp_path, filename, held_chunks=None, target_node=None):
+        """Atomically move a fully assembled temp file into the disk directory, or the chunk store"""
+        if self._is_relay_hop(target_node):
+            self._relay_onward(temp_path, filename, target_node)
+        elif self.chunk_store:
+            self.chunk_store.ingest(temp_path, filename, held_chunks)
+        else:
+            os.replace(temp_path, os.path.join(self.disk_path, filename))
+
+    def _is_relay_hop(self, target_node):
+        """Whether this node only carries a file on a multi-hop route to another node"""
+        return not self.router_manager and bool(target_node) and target_node != self.node_name
+
+    def _relay_onward(self, temp_path, filename, target_node):
+        """Hand a file addressed to another node back to the router, without it touching this disk"""
+        relay_path = os.path.join(self.incoming_path, f"relay-{uuid.uuid4().hex}.part")
+        os.replace(temp_path, relay_path)
+        threading.Thread(target=self._send_relayed_file, args=(relay_path, filename, target_node),
+                         daemon=True).start()
+
+    def _send_relayed_file(self, relay_path, filename, target_node):
+        from grpc_client import GRPCClient  # local import
+        try:
+            # As the sender the router routes it on from here
+            result = GRPCClient().send_file(
+                file_path=relay_path,
                 filename=filename,
                 target_node=target_node,
-                sender_node=sender_node,
-                port=target_port
+                sender_node=self.node_name,
+                port=SERVER_GRPC_PORT
             )
-
+            print(f"{filename}: relayed towards {target_node}: {result}")
         except Exception as e:
-            self.router_manager.logger.error(f"Error forwarding file {filename} to {target_node}: {e}")
+            print(f"{filename}: relaying towards {target_node} failed: {e}")
+        finally:
+            self._discard_temp_file(relay_path)
+
+    def _stored_size(self, filename):
+        """Size of a file on this node's disk or in its chunk store, None if it has neither"""
+        file_path = os.path.join(self.disk_path, filename)
+        if os.path.isfile(file_path):
+            return os.path.getsize(file_path)
+        if self.chunk_store:
+            return self.chunk_store.size(filename)
+        return None
+
+    def _discard_temp_file(self, temp_path, temp_file=None):
+        """Close and remove the temp file of an abandoned transfer"""
+        if temp_file is not None and not temp_file.closed:
+            temp_file.close()
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def _open_relays(self, filename, target_node, sender_node, replication_factor=0, cut_through=True):
+        """Map each node the router must deliver a transfer to onto its cut-through relay.
+
+        The relay is None for targets that will go through store-and-forward.
+        Regular nodes never forward, so they always get an empty map.
+        """
+        if not self.router_manager:
+            return {}
+
+        if replication_factor > 0:
+            targets = self.router_manager.replica_targets(replication_factor, filename)
+        elif target_node and target_node != self.node_name:
+            targets = [target_node]
+        else:
+            return {}
+
+        if not cut_through:
+            return {target: None for target in targets}
+        return {target: self.router_manager.open_relay(filename, target, sender_node) for target in targets}
+
+    @staticmethod
+    def _push_to_relays(relays, chunk, file_digest=""):
+        for relay in relays.values():
+            if relay and not relay.failed:
+                relay.push(chunk, file_digest=file_digest)
+
+    @staticmethod
+    def _abort_relays(relays):
+        for relay in relays.values():
+            if relay:
+                relay.abort()
+
+    def _finish_file(self, filename, target_node, sender_node, relays=None, replication_factor=0):
+        """Record a fully received file and hand it on to the nodes it belongs to.
+
+        Returns the ReplicaStatus list for router-side replication, empty otherwise.
+        """
+        # Relayed files were passed on, not stored
+        if self._is_relay_hop(target_node):
+            return []
+
+        # Update virtual disk metadata
+        self._update_virtual_disk(filename, self._stored_size(filename))
+
+        # Log completion for router
+        if self.router_manager:
+            print(f"{filename}: complete")
+
+        # Replicas report back to the uploader once the write quorum has acked
+        if replication_factor > 0 and self.router_manager:
+            statuses = self.router_manager.replicate(filename, sender_node, relays or {}, replication_factor)
+            return [file_transfer_pb2.ReplicaStatus(**status) for status in statuses]
+
+        if not relays:
+            return []
+
+        # Close cut-through relays, everything else is queued for forwarding so
+        # the sender's request isn't held up
+        for target, relay in relays.items():
+            if relay:
+                self.router_manager.finish_relay(relay, filename, target, sender_node)
+            else:
+                self._forward_file_to_target(filename, target, sender_node)
+        return []
+
+    def _update_virtual_disk(self, filename, size):
+        """Update the virtual disk metadata"""
+        try:
+            self.disk_index[filename] = size
+        except sqlite3.Error as e:
+            print(f"Error saving metadata: {e}")
+
+    def _forward_file_to_target(self, filename, target_node, sender_node):
+        """Hand a received file to the router's forwarding queue"""
+        if not self.router_manager:
+            return
+
+        self.router_manager.enqueue_forward(filename, target_node, sender_node)
 
 
 class NodeManagementServicer(file_transfer_pb2_grpc.NodeManagementServiceServicer):
-    def __init__(self, router_manager=None):
+    def __init__(self, router_manager=None, chunk_store=None):
         self.router_manager = router_manager
+        self.chunk_store = chunk_store  # advertised in HealthCheck, senders offer it their block hashes
         self.active_nodes: Set[str] = set()
         self.nodes_lock = threading.Lock()
 
@@ -248,6 +970,7 @@ class NodeManagementServicer(file_transfer_pb2_grpc.NodeManagementServiceService
                 self.router_manager.active_nodes.add(request.node_name)
             # Log to router (detailed)
             self.router_manager.logger.info(f"Node {request.node_name} registered via gRPC from {request.ip_address}:{request.port}")
+            self.router_manager.forward_pending(request.node_name)
 
         return file_transfer_pb2.NodeResponse(
             success=True,
@@ -286,17 +1009,71 @@ class NodeManagementServicer(file_transfer_pb2_grpc.NodeManagementServiceService
         """Health check endpoint"""
         return file_transfer_pb2.HealthResponse(
             healthy=True,
-            message="Service is healthy"
+            message="Service is healthy",
+            compression=compression.supported(),
+            checksum_types=checksums.supported(),
+            chunk_store_block_size=self.chunk_store.block_size if self.chunk_store else 0
+        )
+
+
+class NodeControlServicer(file_transfer_pb2_grpc.NodeControlServiceServicer):
+    """Runs a VirtualNode's prompt commands for headless nodes"""
+
+    def __init__(self, node):
+        self.node = node
+
+    def RunCommand(self, request, context):
+        if not self.node.is_running:
+            return file_transfer_pb2.NodeCommandResponse(success=False, output=f"Error: VM {self.node.name} is not running")
+
+        command = [request.command, *request.args]
+        if not request.command or request.command.lower() == "stop":
+            return file_transfer_pb2.NodeCommandResponse(success=False, output="Error: Invalid command")
+        try:
+            output = self.node.run_command(command)
+        except Exception as e:
+            return file_transfer_pb2.NodeCommandResponse(success=False, output=f"Error processing command: {e}")
+
+        if output is None:
+            return file_transfer_pb2.NodeCommandResponse(success=False, output="Error: Invalid command")
+        return file_transfer_pb2.NodeCommandResponse(
+            success=not output.startswith(("Error", "✗")),
+            output=output
         )
 
 
+# Configure gRPC options for larger message sizes and Windows compatibility
+SERVER_OPTIONS = [
+    ('grpc.max_send_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.max_receive_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.max_message_length', 100 * 1024 * 1024),  # 100MB
+    ('grpc.so_reuseport', 0),  # Disable SO_REUSEPORT for Windows
+    ('grpc.so_reuseaddr', 1),  # Enable SO_REUSEADDR
+    # Accept keepalive pings from pooled client channels
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_recv_ping_interval_without_data_ms', 10000),
+]
+
+
+def bind_port(server, port):
+    """Listen on port, trying different binding addresses for Windows compatibility"""
+    for listen_addr in [f'localhost:{port}', f'[::]:{port}', f'0.0.0.0:{port}']:
+        try:
+            if server.add_insecure_port(listen_addr) != 0:
+                return True
+        except Exception:
+            continue
+    return False
+
+
 class GRPCServer:
-    def __init__(self, node_name, disk_path, port, is_router=False, router_manager=None):
+    def __init__(self, node_name, disk_path, port, is_router=False, router_manager=None, node=None):
         self.node_name = node_name
         self.disk_path = disk_path
         self.port = port
         self.is_router = is_router
         self.router_manager = router_manager
+        self.node = node  # VirtualNode whose commands are served over NodeControlService
         self.server = None
 
         # Ensure disk path exists
@@ -305,16 +1082,7 @@ class GRPCServer:
     def start(self):
         """Start the gRPC server"""
         try:
-            # Configure gRPC options for larger message sizes and Windows compatibility
-            options = [
-                ('grpc.max_send_message_length', 100 * 1024 * 1024),  # 100MB
-                ('grpc.max_receive_message_length', 100 * 1024 * 1024),  # 100MB
-                ('grpc.max_message_length', 100 * 1024 * 1024),  # 100MB
-                ('grpc.so_reuseport', 0),  # Disable SO_REUSEPORT for Windows
-                ('grpc.so_reuseaddr', 1),  # Enable SO_REUSEADDR
-            ]
-
-            self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=options)
+            self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=GRPC_SERVER_THREADS), options=SERVER_OPTIONS)
 
             # Add file transfer service
             file_transfer_servicer = FileTransferServicer(self.node_name, self.disk_path, self.router_manager)
@@ -326,25 +1094,19 @@ class GRPCServer:
             if self.is_router:
                 node_mgmt_servicer = NodeManagementServicer(self.router_manager)
             else:
-                node_mgmt_servicer = NodeManagementServicer(None)  # No router manager for regular nodes
+                # No router manager for regular nodes
+                node_mgmt_servicer = NodeManagementServicer(None, file_transfer_servicer.chunk_store)
 
             file_transfer_pb2_grpc.add_NodeManagementServiceServicer_to_server(
                 node_mgmt_servicer, self.server
             )
 
-            # Try different binding addresses for Windows compatibility
-            bind_addresses = [f'localhost:{self.port}', f'[::]:{self.port}', f'0.0.0.0:{self.port}']
-            port_result = 0
-
-            for listen_addr in bind_addresses:
-                try:
-                    port_result = self.server.add_insecure_port(listen_addr)
-                    if port_result != 0:
-                        break
-                except Exception:
-                    continue
+            if self.node:
+                file_transfer_pb2_grpc.add_NodeControlServiceServicer_to_server(
+                    NodeControlServicer(self.node), self.server
+                )
 
-            if port_result == 0:
+            if not bind_port(self.server, self.port):
                 return None
 
             self.server.start()
@@ -370,10 +1132,10 @@ class GRPCServer:
 
             return None
     
-    def stop(self):
-        """Stop the gRPC server"""
+    def stop(self, grace=5):
+        """Stop the gRPC server, giving in-flight RPCs up to grace seconds to finish"""
         if self.server:
-            self.server.stop(grace=5)
+            self.server.stop(grace=grace).wait()
             print(f"gRPC server stopped for {self.node_name}")
     
     def wait_for_termination(self):
@@ -0,0 +1,17 @@
+import signal
+import threading
+
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+def shutdown_event(signals=SHUTDOWN_SIGNALS) -> threading.Event:
+    """Event set when the process receives one of signals.
+
+    The main thread blocks on it instead of spinning, and the handler only
+    flags the request so the process can drain its transfers before exiting.
+    Must be called from the main thread.
+    """
+    event = threading.Event()
+    for sig in signals:
+        signal.signal(sig, lambda signum, frame: event.set())
+    return event
@@ -1,10 +1,209 @@
+import heapq
 import json
+import math
 import os
-from config import SERVER_DISK_PATH, IP_MAP, CLOUD_NODES
+import threading
+from config import (SERVER_DISK_PATH, IP_MAP, CLOUD_NODES, MULTI_HOP_ROUTING, ROUTING_METRIC,
+                    DEFAULT_LINK_COST, DEFAULT_LINK_LATENCY_MS, LINK_BANDWIDTH_BYTES_PER_SEC)
+
+ROUTING_METRICS = ("cost", "latency", "bandwidth")
+
+LINKS_FILE = os.path.join(SERVER_DISK_PATH, "links.json")
+
+
+class LinkTopology:
+    """Cached view of links.json for permission checks and routing.
+
+    The file is only re-parsed when its mtime or size changes, or when a
+    LinksManager in this process saves it. Each reload precomputes an
+    adjacency map (node -> {peer: first link they share}), so direct checks
+    are dict lookups, and the best cost/latency/bandwidth between every pair
+    of linked nodes. Routing tables are built lazily with Dijkstra, one per
+    destination and metric, and thrown away on the next reload.
+
+    A link is either a plain node list or {"nodes": [...], "cost": ...,
+    "bandwidth": ..., "latency": ...}; missing attributes use the defaults
+    from config.
+    """
+
+    def __init__(self, links_file=LINKS_FILE):
+        self.links_file = links_file
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.links = {}
+        self.attributes = {}
+        self.adjacency = {}
+        self.edges = {}
+        self.routes = {}
+
+    def invalidate(self):
+        """Reload on next use, called after links.json is written"""
+        with self.lock:
+            self.stamp = None
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.links_file)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = "missing"
+
+        with self.lock:
+            if stamp == self.stamp:
+                return self.adjacency
+
+            raw = {}
+            if stamp != "missing":
+                try:
+                    with open(self.links_file, 'r') as f:
+                        raw = json.load(f)
+                except (json.JSONDecodeError, IOError) as e:
+                    print(f"Error loading links from {self.links_file}: {e}")
+
+            links, attributes = {}, {}
+            for link_name, link in raw.items():
+                links[link_name], attributes[link_name] = link_attributes(link)
+
+            adjacency, edges = {}, {}
+            for link_name, nodes in links.items():
+                attrs = attributes[link_name]
+                for node in nodes:
+                    peers = adjacency.setdefault(node, {})
+                    node_edges = edges.setdefault(node, {})
+                    for peer in nodes:
+                        peers.setdefault(peer, link_name)
+                        if peer == node:
+                            continue
+                        edge = node_edges.get(peer)
+                        if edge is None:
+                            node_edges[peer] = dict(attrs)
+                        else:
+                            # Parallel links: the pair gets the best of each
+                            edge['cost'] = min(edge['cost'], attrs['cost'])
+                            edge['latency'] = min(edge['latency'], attrs['latency'])
+                            edge['bandwidth'] = max(edge['bandwidth'], attrs['bandwidth'])
+
+            self.links, self.attributes, self.stamp = links, attributes, stamp
+            self.adjacency, self.edges, self.routes = adjacency, edges, {}
+            return adjacency
+
+    def snapshot(self) -> dict:
+        """Current links, link name -> node list"""
+        self._refresh()
+        return {name: list(nodes) for name, nodes in self.links.items()}
+
+    def link_attributes(self, link_name) -> dict:
+        """cost, bandwidth and latency of a link, None if it doesn't exist"""
+        self._refresh()
+        attrs = self.attributes.get(link_name)
+        return dict(attrs) if attrs else None
+
+    def peers(self, node) -> set:
+        """Every node sharing a link with node"""
+        return set(self._refresh().get(node, ()))
+
+    def shared_link(self, node_a, node_b):
+        """Name of a link both nodes are on, None if they don't share one"""
+        return self._refresh().get(node_a, {}).get(node_b)
+
+    def in_same_link(self, node_a, node_b) -> bool:
+        return node_b in self._refresh().get(node_a, ())
+
+    def next_hop(self, node, target, metric=ROUTING_METRIC):
+        """Node a transfer from node to target should go to next, None if target is unreachable"""
+        if node == target:
+            return target
+        return self._routing_table(target, metric).get(node)
+
+    def path(self, node, target, metric=ROUTING_METRIC) -> list:
+        """Every node from node to target along the best route, empty if there is none"""
+        table = self._routing_table(target, metric)
+        if node != target and node not in table:
+            return []
+        path = [node]
+        while path[-1] != target:
+            path.append(table[path[-1]])
+        return path
+
+    def first_link(self, node, target, metric=ROUTING_METRIC):
+        """Link the first hop from node towards target crosses"""
+        hop = self.next_hop(node, target, metric)
+        return self.shared_link(node, hop) if hop and hop != node else None
+
+    def is_transfer_allowed(self, sender_node, target_node) -> bool:
+        # Exempt cloud nodes from link registration checks
+        if target_node in CLOUD_NODES:
+            return True
+        if self.in_same_link(sender_node, target_node):
+            return True
+        return MULTI_HOP_ROUTING and self.next_hop(sender_node, target_node) is not None
+
+    def _routing_table(self, target, metric):
+        """node -> next hop towards target, built once per reload.
+
+        Dijkstra runs outwards from the target, so the table is a tree and
+        following next hops from any node can never loop. Shortest paths
+        minimise total cost or latency, "bandwidth" picks the widest path
+        (largest bottleneck), both breaking ties on hop count.
+        """
+        if metric not in ROUTING_METRICS:
+            raise ValueError(f"Unknown routing metric {metric}")
+        self._refresh()
+        with self.lock:
+            table = self.routes.get((target, metric))
+            if table is not None:
+                return table
+            edges = self.edges
+
+        widest = metric == "bandwidth"
+        best = {target: (-math.inf if widest else 0, 0)}
+        table = {}
+        heap = [(best[target], target)]
+        while heap:
+            label, node = heapq.heappop(heap)
+            if label > best[node]:
+                continue
+            distance, hops = label
+            for peer, edge in edges.get(node, {}).items():
+                if widest:
+                    candidate = (max(distance, -edge['bandwidth']), hops + 1)
+                else:
+                    candidate = (distance + edge[metric], hops + 1)
+                if peer not in best or candidate < best[peer]:
+                    best[peer] = candidate
+                    table[peer] = node
+                    heapq.heappush(heap, (candidate, peer))
+
+        with self.lock:
+            if edges is self.edges:
+                self.routes[(target, metric)] = table
+        return table
+
+
+def link_attributes(link):
+    """Split a links.json entry into its node list and full attribute set"""
+    if isinstance(link, dict):
+        nodes = list(link.get("nodes", []))
+    else:
+        nodes, link = list(link), {}
+    return nodes, {
+        'cost': float(link.get("cost", DEFAULT_LINK_COST)),
+        'latency': float(link.get("latency", DEFAULT_LINK_LATENCY_MS)),
+        'bandwidth': float(link.get("bandwidth", LINK_BANDWIDTH_BYTES_PER_SEC)),
+    }
+
+
+_topology = LinkTopology()
+
+
+def topology() -> LinkTopology:
+    """The process-wide cached link topology"""
+    return _topology
+
 
 class LinksManager:
     def __init__(self):
-        self.links_file = os.path.join(SERVER_DISK_PATH, "links.json")
+        self.links_file = LINKS_FILE
         self.links = {}
         self._load_links()
         self.cloud_node_names = CLOUD_NODES # Use the imported CLOUD_NODES set
@@ -28,10 +227,12 @@ class LinksManager:
                 json.dump(self.links, f, indent=2)
         except IOError as e:
             print(f"Error saving links to {self.links_file}: {e}")
+        topology().invalidate()
 
         
 
-    def licreate(self, link_name, nodes):
+    def licreate(self, link_name, nodes, cost=None, bandwidth=None, latency=None):
+        """Create a link between nodes, with optional routing cost, bandwidth (bytes/s) and latency (ms)"""
         if len(nodes) < 2:
             return f"Error: Link {link_name} requires at least two nodes"
         if link_name in self.links:
@@ -43,7 +244,14 @@ class LinksManager:
             if not any(info["node_name"] == node for info in IP_MAP.values()):
                 return f"Error: Node {node} does not exist"
 
-        self.links[link_name] = nodes
+        attributes = {name: value for name, value in
+                      (("cost", cost), ("bandwidth", bandwidth), ("latency", latency)) if value is not None}
+        for name, value in attributes.items():
+            if value <= 0 and not (name == "latency" and value == 0):
+                return f"Error: Link {name} must be positive"
+
+        # Plain node lists stay readable by older versions
+        self.links[link_name] = dict(nodes=nodes, **attributes) if attributes else nodes
         self._save_links()
         return f"Created link {link_name} with nodes {', '.join(nodes)}"
 
@@ -61,20 +269,23 @@ class LinksManager:
 
     def is_transfer_allowed(self, sender_node, target_node):
         """Check if a transfer between sender_node and target_node is allowed."""
-        self._load_links()  # Reload links to ensure latest state
-        # Exempt cloud nodes from link registration checks
-        if target_node in self.cloud_node_names:
-            return True
-        for link_nodes in self.links.values():
-            if sender_node in link_nodes and target_node in link_nodes:
-                return True
-        return False
+        # The cached topology picks up edits made by other processes
+        return topology().is_transfer_allowed(sender_node, target_node)
+
+    def route(self, from_node, to_node):
+        """Describe the path transfers from from_node to to_node take"""
+        path = topology().path(from_node, to_node)
+        if not path:
+            return f"No route from {from_node} to {to_node}"
+        return f"Route ({ROUTING_METRIC}): {' -> '.join(path)}"
 
     def run_terminal(self):
         """Run an interactive terminal for managing links."""
         print("Links Manager Terminal. Available commands:")
         print("  licreate <link_name> <node1> <node2> [node3 ...]")
+        print("      [cost=<n>] [bandwidth=<bytes/s>] [latency=<ms>]")
         print("  del <link_name | all>")
+        print("  route <from_node> <to_node>")
         print("  exit (or quit)")
         print("Enter commands below:")
         
@@ -90,13 +301,21 @@ class LinksManager:
                     break
                 elif cmd == "licreate" and len(command) >= 3:
                     link_name = command[1]
-                    nodes = command[2:]
-                    print(self.licreate(link_name, nodes))
+                    nodes = [arg for arg in command[2:] if "=" not in arg]
+                    attributes = dict(arg.split("=", 1) for arg in command[2:] if "=" in arg)
+                    unknown = set(attributes) - {"cost", "bandwidth", "latency"}
+                    if unknown:
+                        print(f"Error: Unknown link attribute {', '.join(sorted(unknown))}")
+                        continue
+                    print(self.licreate(link_name, nodes, **{name: float(value) for name, value in attributes.items()}))
                 elif cmd == "del" and len(command) == 2:
                     link_name = command[1]
                     print(self.delete(link_name))
+                elif cmd == "route" and len(command) == 3:
+                    print(self.route(command[1], command[2]))
                 else:
-                    print("Invalid command. Use: licreate <link_name> <node1> <node2> [node3 ...], del <link_name | all>, exit")
+                    print("Invalid command. Use: licreate <link_name> <node1> <node2> [node3 ...] [cost=..] [bandwidth=..] [latency=..], "
+                          "del <link_name | all>, route <from_node> <to_node>, exit")
             except EOFError:
                 print("\nEOF detected. Exiting Links Manager Terminal.")
                 break
@@ -1,3 +1,4 @@
+import sys
 from virtual_node import VirtualNode
 
 if __name__ == "__main__":
@@ -6,4 +7,7 @@ if __name__ == "__main__":
         disk_path="./assets/node1/",
         ip_address="192.168.1.1"
     )
-    node.run_interactive()
\ No newline at end of file
+    if "--headless" in sys.argv[1:]:
+        node.run_headless()
+    else:
+        node.run_interactive()
\ No newline at end of file
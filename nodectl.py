@@ -0,0 +1,279 @@
+"""Start, stop and drive headless nodes from one command.
+
+    python nodectl.py start [-n N] [--no-router] [--aio] [--shards N] [--foreground]
+    python nodectl.py status
+    python nodectl.py stop
+    python nodectl.py bench [-c CONCURRENCY] [-s SIZE_MB] [--kind KIND]
+    python nodectl.py <node> <command> [args ...]     e.g. nodectl.py node1 touch a.bin 5
+
+start launches the router, every cloud and the first N regular nodes (all of
+them by default) as background processes, logging to assets/logs/, and returns
+once each one answers HealthCheck. Their pids are kept in assets/nodectl.json
+for status and stop. With --foreground it stays attached instead and stops
+them all on Ctrl+C / SIGTERM. --aio runs the router on the asyncio gRPC server,
+--shards N as N router processes behind a front (see router_shards.py).
+
+bench sends CONCURRENCY files to the running router at once from a single
+event loop (AsyncGRPCClient), each as its own simulated sender so the shaper
+doesn't serialize them, and reports how long they took. Run it against
+start and start --aio to compare the two servers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from config import BASE_DIR, IP_MAP, CLOUD_NODES, SERVER_GRPC_PORT, STARTUP_TIMEOUT, SHUTDOWN_GRACE, ROUTER_SHARDS
+from grpc_client import GRPCClient
+
+PID_FILE = os.path.join(BASE_DIR, "assets", "nodectl.json")
+LOG_DIR = os.path.join(BASE_DIR, "assets", "logs")
+
+
+def _node_info(name):
+    for ip, info in IP_MAP.items():
+        if info["node_name"] == name:
+            return ip, info
+    return None, None
+
+
+def _port(name):
+    if name == "router":
+        return SERVER_GRPC_PORT
+    return _node_info(name)[1]["grpc_port"]
+
+
+def _load_pids():
+    try:
+        with open(PID_FILE, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+
+def _save_pids(pids):
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+    with open(PID_FILE, 'w') as f:
+        json.dump(pids, f, indent=2)
+
+
+def _alive(pid):
+    try:
+        # Reap our own children, an exited child stays a zombie until waited on
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _spawn(name, aio=False, shards=ROUTER_SHARDS):
+    """Start one process in the background, its output going to assets/logs/<name>.log"""
+    if name == "router":
+        command = [sys.executable, os.path.join(BASE_DIR, "router.py"), "--shards", str(shards)]
+        if aio:
+            command.append("--aio")
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "serve", name]
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with open(os.path.join(LOG_DIR, f"{name}.log"), 'ab') as log:
+        # Own session, so the launcher's terminal closing doesn't take the nodes with it
+        return subprocess.Popen(command, cwd=BASE_DIR, stdin=subprocess.DEVNULL, stdout=log,
+                                stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def _wait_healthy(processes, timeout=STARTUP_TIMEOUT):
+    """Poll HealthCheck until every process answers, returns the names that never did"""
+    client = GRPCClient()
+    pending = dict(processes)
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for name, process in list(pending.items()):
+            if process.poll() is not None:
+                continue
+            if client.health_check(_port(name)):
+                print(f"✓ {name} ready (pid {process.pid})")
+                del pending[name]
+        if pending:
+            time.sleep(0.2)
+    return list(pending)
+
+
+def start(count=None, router=True, foreground=False, aio=False, shards=ROUTER_SHARDS):
+    running = {name: pid for name, pid in _load_pids().items() if _alive(pid)}
+    if running:
+        print(f"Error: already running: {', '.join(sorted(running))} (nodectl.py stop first)")
+        return 1
+
+    nodes = [info["node_name"] for info in IP_MAP.values() if info["node_name"] not in CLOUD_NODES]
+    names = sorted(CLOUD_NODES) + nodes[:count]
+    processes = {}
+
+    # Nodes register with the router as they start, so it has to be up first
+    if router:
+        processes["router"] = _spawn("router", aio, shards)
+        if _wait_healthy({"router": processes["router"]}):
+            print("✗ router failed to start, see assets/logs/router.log")
+            _stop({"router": processes["router"].pid})
+            return 1
+
+    started = {name: _spawn(name) for name in names}
+    processes.update(started)
+    pids = {name: process.pid for name, process in processes.items()}
+    _save_pids(pids)
+
+    failed = _wait_healthy(started)
+    if failed:
+        print(f"✗ not ready after {STARTUP_TIMEOUT}s: {', '.join(failed)}, see assets/logs/")
+        _stop(pids)
+        return 1
+    print(f"All {len(processes)} processes ready")
+
+    if foreground:
+        from lifecycle import shutdown_event
+        shutdown_event().wait()
+        _stop(pids)
+    return 0
+
+
+def _stop(pids):
+    """SIGTERM nodes first and the router last, waiting for each group to drain"""
+    groups = [[name for name in pids if name != "router"], [name for name in pids if name == "router"]]
+    for group in groups:
+        for name in group:
+            if _alive(pids[name]):
+                os.kill(pids[name], signal.SIGTERM)
+        deadline = time.monotonic() + SHUTDOWN_GRACE + 5
+        for name in group:
+            while _alive(pids[name]) and time.monotonic() < deadline:
+                time.sleep(0.1)
+            print(f"✓ {name} {'stopped' if not _alive(pids[name]) else 'still running'}")
+    try:
+        os.remove(PID_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def stop():
+    pids = _load_pids()
+    if not pids:
+        print("Nothing running")
+        return 0
+    _stop(pids)
+    return 0
+
+
+def status():
+    client = GRPCClient()
+    for name, pid in _load_pids().items():
+        state = "ready" if _alive(pid) and client.health_check(_port(name)) else \
+            "starting" if _alive(pid) else "dead"
+        print(f"{name:8} pid {pid:<8} {state}")
+    return 0
+
+
+def bench(concurrency=50, size_mb=4, kind="random"):
+    from aio_client import AsyncGRPCClient
+    from payload import write_payload
+
+    payload_path = os.path.join(BASE_DIR, "assets", "bench", "payload.bin")
+    os.makedirs(os.path.dirname(payload_path), exist_ok=True)
+    write_payload(payload_path, size_mb * 1024 * 1024, kind)
+
+    async def run_all():
+        client = AsyncGRPCClient()
+        try:
+            if not await client.health_check(SERVER_GRPC_PORT):
+                return None
+            started = time.monotonic()
+            results = await asyncio.gather(*(
+                client.send_file(payload_path, f"bench-{i}.bin", "", f"bench{i}", SERVER_GRPC_PORT)
+                for i in range(concurrency)
+            ))
+            return results, time.monotonic() - started
+        finally:
+            await client.close()
+
+    outcome = asyncio.run(run_all())
+    if outcome is None:
+        print("✗ router is not reachable")
+        return 1
+    results, elapsed = outcome
+    sent = sum(1 for result in results if result.startswith("✓"))
+    print(f"{sent}/{concurrency} transfers of {size_mb} MB in {elapsed:.2f}s "
+          f"({sent * size_mb / elapsed:.1f} MB/s)")
+    return 0 if sent == concurrency else 1
+
+
+def serve(name):
+    """Run one node headless, the process nodectl start spawns for each node"""
+    from virtual_node import VirtualNode
+    ip, info = _node_info(name)
+    if info is None:
+        print(f"Error: Node {name} does not exist")
+        return 1
+    node = VirtualNode(name=name, disk_path=info["disk_path"], ip_address=ip)
+    return 0 if node.run_headless() else 1
+
+
+def run(name, command, args):
+    if _node_info(name)[1] is None:
+        print(f"Error: Node {name} does not exist")
+        return 1
+    result = GRPCClient().run_command(command, args, _port(name))
+    if result is None:
+        print(f"✗ {name} is not reachable")
+        return 1
+    print(result['output'])
+    return 0 if result['success'] else 1
+
+
+def main(argv):
+    if argv and argv[0] not in ("start", "stop", "status", "bench", "serve", "-h", "--help"):
+        if len(argv) < 2:
+            print("Usage: nodectl.py <node> <command> [args ...]")
+            return 2
+        return run(argv[0], argv[1], argv[2:])
+
+    parser = argparse.ArgumentParser(description="Start, stop and drive headless nodes")
+    sub = parser.add_subparsers(dest="action", required=True)
+    start_parser = sub.add_parser("start", help="launch the router and nodes in the background")
+    start_parser.add_argument("-n", "--nodes", type=int, default=None, help="number of regular nodes (default: all)")
+    start_parser.add_argument("--no-router", action="store_true", help="don't start the router")
+    start_parser.add_argument("--foreground", action="store_true", help="stay attached, stop everything on Ctrl+C")
+    start_parser.add_argument("--aio", action="store_true", help="run the router on the asyncio gRPC server")
+    start_parser.add_argument("--shards", type=int, default=ROUTER_SHARDS,
+                              help=f"router processes behind a front (default: {ROUTER_SHARDS})")
+    sub.add_parser("stop", help="gracefully stop everything nodectl started")
+    sub.add_parser("status", help="show what is running")
+    bench_parser = sub.add_parser("bench", help="send many files to the router at once and time them")
+    bench_parser.add_argument("-c", "--concurrency", type=int, default=50, help="transfers at once (default: 50)")
+    bench_parser.add_argument("-s", "--size", type=int, default=4, help="file size in MB (default: 4)")
+    bench_parser.add_argument("--kind", default="random", help="payload kind (default: random)")
+    serve_parser = sub.add_parser("serve", help="run one node headless in this process")
+    serve_parser.add_argument("name")
+    args = parser.parse_args(argv)
+
+    if args.action == "start":
+        return start(args.nodes, router=not args.no_router, foreground=args.foreground, aio=args.aio,
+                     shards=args.shards)
+    if args.action == "stop":
+        return stop()
+    if args.action == "status":
+        return status()
+    if args.action == "bench":
+        return bench(args.concurrency, args.size, args.kind)
+    return serve(args.name)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+import os
+import random
+import uuid
+
+from config import PAYLOAD_BUFFER_SIZE
+
+# sparse: a hole read back as zeros, nothing written
+# alloc: zeros with the blocks reserved up front (posix_fallocate), zero where unsupported
+# zero / pattern / random: real data, written one buffer at a time
+PAYLOAD_KINDS = ("sparse", "alloc", "zero", "pattern", "random")
+
+
+def write_payload(path, size, kind="sparse", buffer_size=PAYLOAD_BUFFER_SIZE, seed=None):
+    """Create (or overwrite) path with size bytes of synthetic content, in constant memory.
+
+    Every kind but pattern and random reads back as all zeros. random is
+    reproducible when a seed is given.
+    """
+    if kind not in PAYLOAD_KINDS:
+        raise ValueError(f"Unknown payload kind {kind}, use one of {', '.join(PAYLOAD_KINDS)}")
+
+    # Built beside the target and swapped in, so a send still reading the old
+    # file (memory-mapped, see ChunkReader) never sees it shrink
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            _fill(f, size, kind, buffer_size, seed)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _fill(f, size, kind, buffer_size, seed):
+    if kind == "sparse" or size == 0:
+        f.truncate(size)
+        return
+
+    if kind == "alloc":
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass  # filesystem without fallocate support
+        kind = "zero"
+
+    for block in _blocks(kind, size, buffer_size, seed):
+        f.write(block)
+
+
+def _blocks(kind, size, buffer_size, seed):
+    """Yield buffers adding up to size bytes, reusing one buffer where the content allows"""
+    if kind == "random":
+        rng = random.Random(seed)
+        remaining = size
+        while remaining > 0:
+            n = min(buffer_size, remaining)
+            yield rng.randbytes(n)
+            remaining -= n
+        return
+
+    if kind == "pattern":
+        # A whole number of 0..255 runs, so the pattern carries on across buffers
+        buffer = bytes(range(256)) * max(1, buffer_size // 256)
+    else:
+        buffer = bytes(buffer_size)
+    view = memoryview(buffer)
+    remaining = size
+    while remaining > 0:
+        n = min(len(buffer), remaining)
+        yield view[:n]
+        remaining -= n
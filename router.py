@@ -1,16 +1,37 @@
+import argparse
 import os
+import sys
 from router_manager import RouterManager
-from config import SERVER_DISK_PATH
+from config import SERVER_DISK_PATH, STARTUP_TIMEOUT, GRPC_SERVER_MODE, ROUTER_SHARDS
+from lifecycle import shutdown_event
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the router")
+    # --aio / --threaded pick the gRPC server implementation, GRPC_SERVER_MODE otherwise
+    parser.add_argument("--aio", dest="server_mode", action="store_const", const="aio", default=GRPC_SERVER_MODE)
+    parser.add_argument("--threaded", dest="server_mode", action="store_const", const="threaded")
+    parser.add_argument("--shards", type=int, default=ROUTER_SHARDS,
+                        help="router processes behind a front on the router port (default: ROUTER_SHARDS)")
+    parser.add_argument("--shard", type=int, default=None, help=argparse.SUPPRESS)  # run as one shard
+    args = parser.parse_args()
+
     server_disk_path = SERVER_DISK_PATH
     os.makedirs(server_disk_path, exist_ok=True)
-    server = RouterManager()
+    shutdown = shutdown_event()
+    if args.shard is None and args.shards > 1:
+        from router_shards import ShardedRouter
+        server = ShardedRouter(args.shards, args.server_mode)
+    else:
+        server = RouterManager(args.server_mode, args.shard)
     server.start()
-    print("Server running. Press Ctrl+C to stop.")
-    try:
-        while True:
-            pass  # Keep server running
-    except KeyboardInterrupt:
+    if not server.ready.wait(STARTUP_TIMEOUT):
+        print("Server failed to start.")
         server.stop()
-        print("Server stopped.")
\ No newline at end of file
+        sys.exit(1)
+
+    print("Server running. Press Ctrl+C to stop.")
+    # Sleeps until SIGINT/SIGTERM instead of spinning a core
+    shutdown.wait()
+    print("Shutting down, letting in-flight transfers finish...")
+    server.stop(drain=True)
+    print("Server stopped.")
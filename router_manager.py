@@ -1,26 +1,58 @@
+import os
 import threading
 import socket
 import logging
 import json
+import queue
+import time
+from collections import deque
 from virtual_network import VirtualNetwork
-from config import SERVER_IP, SERVER_SOCKET_PORT, SERVER_DISK_PATH, SERVER_GRPC_PORT
+from config import (SERVER_IP, SERVER_SOCKET_PORT, SERVER_DISK_PATH, SERVER_GRPC_PORT, IP_MAP,
+                    FORWARD_WORKERS, FORWARD_QUEUE_SIZE, FORWARD_PER_TARGET_LIMIT, FORWARD_ENQUEUE_TIMEOUT,
+                    CUT_THROUGH_ENABLED, CLOUD_NODES, UPLOAD_WRITE_QUORUM, REPLICATION_ACK_TIMEOUT, MULTI_HOP_ROUTING,
+                    SHUTDOWN_GRACE, GRPC_SERVER_MODE, ROUTER_SHARD_BASE_PORT, REPLICATION_WAITERS)
+from links_manager import topology
+from bandwidth_shaper import shaper, ROUTER_NODE
 from grpc_server import GRPCServer
+from grpc_client import GRPCClient, ChunkRelay
 
 class RouterManager:
-    def __init__(self):
+    def __init__(self, server_mode=GRPC_SERVER_MODE, shard=None):
         self.ip_address = SERVER_IP
-        self.grpc_port = SERVER_GRPC_PORT
+        # Shards of a sharded router (see router_shards.py) sit behind the front on SERVER_GRPC_PORT
+        self.shard = shard
+        self.grpc_port = SERVER_GRPC_PORT if shard is None else ROUTER_SHARD_BASE_PORT + shard
         self.disk_path = SERVER_DISK_PATH
         self.network = VirtualNetwork(self)
-        self.pending_files = {}
+        self.pending_files = {}  # offline node -> {(filename, target node): sender} forwarded once it starts
         self.pending_files_lock = threading.Lock()
         self.grpc_server = None
+        self.server_mode = server_mode  # "threaded" or "aio", see GRPC_SERVER_MODE
         self.socket_server = None
         self.socket_port = SERVER_SOCKET_PORT
+        # Only one process can hold the socket port, the first shard takes it
+        self.socket_enabled = not shard
         self.active_nodes = set()
         self.active_nodes_lock = threading.Lock()
         self.logger = None
         self._setup_logging()
+        self.ready = threading.Event()  # set once the gRPC and socket servers accept connections
+
+        # Forwarding pipeline: completed files are queued and sent on by worker threads
+        self.forward_workers_count = FORWARD_WORKERS
+        self.forward_per_target_limit = FORWARD_PER_TARGET_LIMIT
+        self.forward_queue = queue.Queue(maxsize=FORWARD_QUEUE_SIZE)
+        self.forward_workers = []
+        self.forward_lock = threading.Lock()
+        self.forward_in_flight = {}   # target node -> forwards currently running
+        self.forward_deferred = {}    # target node -> jobs waiting for a free slot
+        self.forward_stats = {'enqueued': 0, 'forwarded': 0, 'failed': 0, 'rejected': 0, 'max_queue_depth': 0,
+                              'cut_through': 0}
+        self.open_relays = 0  # cut-through relays still streaming, a draining stop waits for them
+        self.relays_closed = threading.Condition(self.forward_lock)
+        # Server threads an upload may hold waiting for its replica quorum, so uploads can't take them all
+        self.replication_waiters = threading.BoundedSemaphore(REPLICATION_WAITERS)
+        self.cut_through_enabled = CUT_THROUGH_ENABLED
 
     def _setup_logging(self):
         """Sets up centralized logging for the router."""
@@ -31,17 +63,25 @@ class RouterManager:
                 logging.FileHandler("router.log"),
                 logging.StreamHandler()
             ])
-        self.logger = logging.getLogger("RouterManager")
+        self.logger = logging.getLogger("RouterManager" if self.shard is None else f"RouterManager.shard{self.shard}")
 
     def start(self):
         """Start the gRPC server and socket server."""
         # Start gRPC server
-        self.grpc_server = GRPCServer("router", self.disk_path, self.grpc_port, is_router=True, router_manager=self)
+        if self.server_mode == "aio":
+            from aio_server import AsyncGRPCServer
+            server_class = AsyncGRPCServer
+        else:
+            server_class = GRPCServer
+        self.grpc_server = server_class("router", self.disk_path, self.grpc_port, is_router=True, router_manager=self)
+
+        grpc_started = threading.Event()
 
         def start_grpc():
             result = self.grpc_server.start()
             if result is not None:
-                self.logger.info(f"gRPC server successfully started on {self.ip_address}:{self.grpc_port}")
+                grpc_started.set()
+                self.logger.info(f"gRPC server ({self.server_mode}) successfully started on {self.ip_address}:{self.grpc_port}")
                 print(f"✓ Router gRPC server started on port {self.grpc_port}")
             else:
                 self.logger.error(f"gRPC server failed to start on {self.ip_address}:{self.grpc_port}")
@@ -50,24 +90,312 @@ class RouterManager:
         grpc_thread = threading.Thread(target=start_grpc, daemon=True)
         grpc_thread.start()
 
+        # Start forwarder workers
+        for i in range(self.forward_workers_count):
+            worker = threading.Thread(target=self._forward_worker, name=f"forwarder-{i + 1}", daemon=True)
+            worker.start()
+            self.forward_workers.append(worker)
+        self.logger.info(f"Started {self.forward_workers_count} forwarder workers")
+
         # Start socket server (for legacy compatibility)
-        self.socket_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket_server.bind(("0.0.0.0", self.socket_port))
-        self.socket_server.listen(10)
-        socket_thread = threading.Thread(target=self._handle_socket_connections, daemon=True)
-        socket_thread.start()
-        self.logger.info(f"Socket server started on {self.ip_address}:{self.socket_port}")
-        print(f"✓ Router socket server started on port {self.socket_port}")
-
-    def stop(self):
-        """Stop the gRPC server and socket server."""
-        if self.grpc_server:
-            self.grpc_server.stop()
-            self.logger.info(f"gRPC server stopped for {self.ip_address}")
+        if self.socket_enabled:
+            self.socket_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket_server.bind(("0.0.0.0", self.socket_port))
+            self.socket_server.listen(10)
+            socket_thread = threading.Thread(target=self._handle_socket_connections, daemon=True)
+            socket_thread.start()
+            self.logger.info(f"Socket server started on {self.ip_address}:{self.socket_port}")
+            print(f"✓ Router socket server started on port {self.socket_port}")
+
+        grpc_thread.join()
+        if grpc_started.is_set():
+            self.ready.set()
+            self.logger.info("Router ready")
+
+    def stop(self, drain=False, grace=SHUTDOWN_GRACE):
+        """Stop the gRPC server and socket server.
+
+        With drain, in-flight transfers get up to grace seconds to finish, then
+        open cut-through relays and the forward queue (which takes the
+        fallbacks of failed relays) get what is left of the same budget
+        before the forwarders exit.
+        """
+        self.ready.clear()
+        deadline = time.monotonic() + grace
         if self.socket_server:
             self.socket_server.close()
             self.logger.info(f"Socket server stopped for {self.ip_address}")
+        if self.grpc_server:
+            self.grpc_server.stop(grace=grace if drain else 5)
+            self.logger.info(f"gRPC server stopped for {self.ip_address}")
+
+        if drain and not self._drain_relays(deadline - time.monotonic()):
+            self.logger.warning(f"Shutting down with {self.open_relays} cut-through relays unfinished")
+        if drain and not self._drain_forwards(deadline - time.monotonic()):
+            self.logger.warning(f"Shutting down with {self.forward_queue.unfinished_tasks} forwards unfinished")
+        for _ in self.forward_workers:
+            self.forward_queue.put(None)
+        self.forward_workers = []
+
+    def enqueue_forward(self, filename, target_node, sender_node, on_result=None):
+        """Queue a received file for forwarding, returns False if the queue stays full.
+
+        on_result, if given, is called with the forward's success once it has run.
+        """
+        job = {'filename': filename, 'target_node': target_node, 'sender_node': sender_node,
+               'on_result': on_result}
+        try:
+            self.forward_queue.put(job, timeout=FORWARD_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            with self.forward_lock:
+                self.forward_stats['rejected'] += 1
+            self.logger.error(f"Forward queue full, dropping {filename} for {target_node}")
+            return False
+
+        with self.forward_lock:
+            self.forward_stats['enqueued'] += 1
+            depth = self.forward_queue.qsize()
+            if depth > self.forward_stats['max_queue_depth']:
+                self.forward_stats['max_queue_depth'] = depth
+        return True
+
+    def _drain_relays(self, timeout):
+        """Wait for every open cut-through relay to finish, returns False on timeout"""
+        with self.relays_closed:
+            return self.relays_closed.wait_for(lambda: not self.open_relays, timeout=max(timeout, 0))
+
+    def _relay_closed(self):
+        with self.relays_closed:
+            self.open_relays -= 1
+            self.relays_closed.notify_all()
+
+    def _drain_forwards(self, timeout):
+        """Wait for every queued and parked forward to run, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self.forward_queue.all_tasks_done:
+            while self.forward_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.forward_queue.all_tasks_done.wait(remaining)
+        return True
+
+    def get_forward_metrics(self):
+        """Snapshot of the forwarding queue depth and counters"""
+        with self.forward_lock:
+            metrics = dict(self.forward_stats)
+            metrics['queue_depth'] = self.forward_queue.qsize()
+            metrics['deferred'] = sum(len(jobs) for jobs in self.forward_deferred.values())
+            metrics['in_flight'] = {node: n for node, n in self.forward_in_flight.items() if n}
+            metrics['open_relays'] = self.open_relays
+        return metrics
+
+    def _forward_worker(self):
+        """Drain the forward queue, respecting the per-target concurrency limit"""
+        while True:
+            job = self.forward_queue.get()
+            try:
+                if job is None:
+                    return
+
+                target_node = job['target_node']
+                with self.forward_lock:
+                    if self.forward_in_flight.get(target_node, 0) >= self.forward_per_target_limit:
+                        # Target is saturated, park the job until one of its forwards finishes
+                        self.forward_deferred.setdefault(target_node, deque()).append(job)
+                        continue
+                    self.forward_in_flight[target_node] = self.forward_in_flight.get(target_node, 0) + 1
+
+                while job is not None:
+                    success = self._forward_file(job['filename'], target_node, job['sender_node'])
+                    if job['on_result']:
+                        job['on_result'](success)
+                    with self.forward_lock:
+                        self.forward_stats['forwarded' if success else 'failed'] += 1
+                        deferred = self.forward_deferred.get(target_node)
+                        if deferred:
+                            # Hand our slot straight to the next parked job for this target
+                            job = deferred.popleft()
+                        else:
+                            job = None
+                            self.forward_in_flight[target_node] -= 1
+            except Exception as e:
+                self.logger.error(f"Forwarder error: {e}", exc_info=True)
+            finally:
+                self.forward_queue.task_done()
+
+    def open_relay(self, filename, target_node, sender_node):
+        """Start relaying a transfer to its target while it arrives, None means store-and-forward"""
+        if not self.cut_through_enabled:
+            return None
+
+        hop = self.route_hop(target_node, sender_node)
+        target_port = self._target_port(hop)
+        if not target_port:
+            return None
+
+        # Offline or saturated targets go through the forward queue instead
+        with self.active_nodes_lock:
+            if hop not in self.active_nodes:
+                return None
+        with self.forward_lock:
+            if self.forward_in_flight.get(target_node, 0) >= self.forward_per_target_limit:
+                return None
+
+        # The relayed copy goes out on the router's uplink, the sender paid for its own hop
+        relay = ChunkRelay(target_port, buckets=shaper.buckets_for(ROUTER_NODE, hop), on_close=self._relay_closed)
+        if not relay.start():
+            return None
+
+        with self.forward_lock:
+            self.forward_stats['cut_through'] += 1
+            self.open_relays += 1
+        print(f"{filename}: cutting through to {target_node}" + (f" via {hop}" if hop != target_node else ""))
+        return relay
+
+    def finish_relay(self, relay, filename, target_node, sender_node, on_result=None):
+        """Close a cut-through relay, falling back to the forward queue if it broke"""
+        def on_done(success):
+            if success:
+                with self.forward_lock:
+                    self.forward_stats['forwarded'] += 1
+                self.logger.info(f"Cut-through of {filename} to {target_node} complete")
+                if on_result:
+                    on_result(True)
+            else:
+                self.logger.warning(f"Cut-through of {filename} to {target_node} failed, falling back to store-and-forward")
+                # The fallback forward reports the result instead
+                if not self.enqueue_forward(filename, target_node, sender_node, on_result) and on_result:
+                    on_result(False)
+
+        relay.finish(on_done)
+
+    def replica_targets(self, replication_factor, filename=""):
+        """Pick the online cloud nodes a replicated upload goes to, warning up front if there are too few"""
+        with self.active_nodes_lock:
+            online = sorted(CLOUD_NODES & self.active_nodes)
+        if len(online) < replication_factor:
+            self.logger.warning(f"Only {len(online)} of {replication_factor} replicas of {filename} possible, "
+                                f"{', '.join(sorted(CLOUD_NODES - set(online))) or 'not enough clouds'} offline")
+        return online[:replication_factor]
+
+    def replicate(self, filename, sender_node, relays, replication_factor=0, quorum=UPLOAD_WRITE_QUORUM):
+        """Fan a file on the router disk out to its replicas and report per-replica status.
+
+        relays maps each replica node to its cut-through relay, or None when the
+        replica has to be sent from the router's local copy through the forward
+        queue. Returns once `quorum` replicas have acked (or every replica has
+        answered, or REPLICATION_ACK_TIMEOUT passes); replicas still running
+        are reported as in progress. Only REPLICATION_WAITERS uploads wait at
+        a time, the others report their replicas in progress straight away.
+        Clouds short of replication_factor that were offline when the upload
+        started are reported as failed.
+        """
+        results = {node: None for node in relays}
+        messages = {node: "in progress" for node in relays}
+        done = threading.Condition()
+
+        def record(node, success, message=None):
+            with done:
+                results[node] = success
+                messages[node] = message or ("stored" if success else "forward failed")
+                done.notify_all()
+
+        for node, relay in relays.items():
+            on_result = lambda success, node=node: record(node, success)
+            if relay:
+                self.finish_relay(relay, filename, node, sender_node, on_result=on_result)
+            elif not self.enqueue_forward(filename, node, sender_node, on_result=on_result):
+                record(node, False, "forward queue full")
+
+        needed = min(quorum, len(relays))
+        if self.replication_waiters.acquire(blocking=False):
+            try:
+                with done:
+                    done.wait_for(lambda: sum(1 for node in relays if results[node]) >= needed or
+                                  all(results[node] is not None for node in relays),
+                                  timeout=REPLICATION_ACK_TIMEOUT)
+            finally:
+                self.replication_waiters.release()
+        with done:
+            statuses = [{'node_name': node, 'success': bool(results[node]), 'message': messages[node],
+                         'pending': results[node] is None}
+                        for node in relays]
+
+        offline = sorted(CLOUD_NODES - set(relays))[:max(replication_factor - len(relays), 0)]
+        statuses += [{'node_name': node, 'success': False, 'message': "offline", 'pending': False}
+                     for node in offline]
+
+        stored = sum(1 for status in statuses if status['success'])
+        pending = sum(1 for status in statuses if status['pending'])
+        self.logger.info(f"Replicated {filename} from {sender_node}: {stored}/{len(statuses)} replicas stored" +
+                         (f", {pending} still in progress" if pending else ""))
+        return statuses
+
+    def route_hop(self, target_node, sender_node):
+        """Node a file from sender_node for target_node is delivered to next.
+
+        That is the target itself unless the two nodes only reach each other
+        through other nodes' links, in which case it's the next node on the
+        best route, which passes the file back here once it has it.
+        """
+        if not MULTI_HOP_ROUTING or not sender_node or target_node in CLOUD_NODES:
+            return target_node
+        links = topology()
+        if links.in_same_link(sender_node, target_node):
+            return target_node
+        return links.next_hop(sender_node, target_node) or target_node
+
+    def _target_port(self, target_node):
+        """Find a node's gRPC port in IP_MAP"""
+        for ip, info in IP_MAP.items():
+            if info["node_name"] == target_node:
+                return info["grpc_port"]
+        return None
+
+    def _forward_file(self, filename, target_node, sender_node):
+        """Forward a file from the router disk to target node, or the next node on its route, using gRPC"""
+        hop = self.route_hop(target_node, sender_node)
+        target_port = self._target_port(hop)
+        if not target_port:
+            print(f"Target node {hop} not found in IP_MAP")
+            return False
+
+        # Check if target node is active, the file waits for it otherwise
+        with self.active_nodes_lock:
+            if hop not in self.active_nodes:
+                self.logger.warning(f"Target node {hop} is not active, {filename} is forwarded once it starts")
+                with self.pending_files_lock:
+                    self.pending_files.setdefault(hop, {})[(filename, target_node)] = sender_node
+                return False
+
+        file_path = os.path.join(self.disk_path, filename)
+        print(f"{filename}: forwarding to {target_node}" + (f" via {hop}" if hop != target_node else ""))
+
+        client = GRPCClient()
+        # sender_node stays the file's origin for routing, the bytes go out on the router's uplink
+        client.uplink_node = ROUTER_NODE
+        try:
+            result = client.send_file(
+                file_path=file_path,
+                filename=filename,
+                target_node=target_node,
+                sender_node=sender_node,
+                port=target_port
+            )
+        except Exception as e:
+            self.logger.error(f"Error forwarding file {filename} to {target_node}: {e}")
+            return False
+
+        if not result.startswith("✓"):
+            self.logger.error(f"Forwarding {filename} to {target_node} failed: {result}")
+            return False
+
+        summary = client.transfer_stats.summary() if client.transfer_stats else None
+        self.logger.info(f"Forwarded {filename} to {target_node} (queue depth {self.forward_queue.qsize()})" +
+                         (f", {summary}" if summary else ""))
+        return True
 
     def _handle_socket_connections(self):
         """Handle incoming socket connections from nodes."""
@@ -89,30 +417,16 @@ class RouterManager:
                 self.logger.info(f"Node {node_name} started, checking for pending files")
                 with self.active_nodes_lock:
                     self.active_nodes.add(node_name)
-                self.network.forward_file(None, node_name)
+                self.forward_pending(node_name)
             client_socket.close()
         except Exception as e:
             self.logger.error(f"Error processing socket message: {e}", exc_info=True)
             client_socket.close()
-    
-    def check_node_and_forward(self, folder_name, target_node, file_path, original_filename, sender_node):
-            """Forward the file to the requested node *and* replicate to every cloud node."""
-            from virtual_network import VirtualNetwork  # local import to avoid circularity
-    
-            # 1) Forward to the originally requested node (if on-line)
-            with self.active_nodes_lock:
-                if target_node in self.active_nodes:
-                    self.logger.info(f"Target node {target_node} is active, forwarding {original_filename}")
-                    self.network.forward_file(folder_name, target_node)
-                else:
-                    self.logger.warning(f"Target node {target_node} not active, transfer failed for {original_filename}")
-    
-            # 2) replicate to every cloud node
-            for ip, info in self.network.ip_map.items():
-                if info["node_name"].startswith("cloud") and info["node_name"] != target_node:
-                    filename_to_send = original_filename   # keep original name
-                    self.logger.info(f"Replicating {filename_to_send} to {info['node_name']}")
-                    self.network.forward_file(folder_name,
-                                            info["node_name"],
-                                            is_replication=True,
-                                            original_filename=filename_to_send)
\ No newline at end of file
+
+    def forward_pending(self, node_name):
+        """Queue the files whose forward found node_name offline, now that it is back"""
+        with self.pending_files_lock:
+            pending = self.pending_files.pop(node_name, {})
+        for (filename, target_node), sender_node in pending.items():
+            self.logger.info(f"Forwarding {filename} to {target_node}, held while {node_name} was offline")
+            self.enqueue_forward(filename, target_node, sender_node)
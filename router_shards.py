@@ -0,0 +1,313 @@
+"""Sharded router: a dispatcher on SERVER_GRPC_PORT in front of several router processes.
+
+Each shard is a full RouterManager (router.py --shard i) on ROUTER_SHARD_BASE_PORT + i,
+with its own interpreter, forward queue and workers, all on the shared router disk.
+The front's HealthResponse lists the shard ports, and GRPCClient / AsyncGRPCClient
+send file data straight to the shard shard_for(target node or file name) picks,
+so the bytes of a transfer never cross the front. The front still routes every
+call it gets, for senders that don't know about shards. Their chunk data passes
+through as raw bytes, only the routing key is read from it.
+
+A call goes to:
+- the shard hashed from its transfer_id for resumable sessions, so every call of
+  a session lands on the same shard, even after a restart
+- the shard hashed from the target node for other transfers (the file name for
+  replicated uploads). All forwards to one node then come from one shard, so
+  FORWARD_PER_TARGET_LIMIT still holds per node
+- the shard that opened it, for StartTransfer sessions without an id, remembered
+  until CompleteTransfer
+- any shard, round robin, for file info, listings and health checks
+
+Node registrations go to every shard, so each one holds the full active-node set.
+
+This is a dispatcher rather than SO_REUSEPORT. The kernel balances connections, and
+a node sends everything over one pooled channel, so each node would be pinned to
+one shard.
+"""
+import collections
+import itertools
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import grpc
+
+import file_transfer_pb2
+from config import (BASE_DIR, SERVER_GRPC_PORT, SERVER_DISK_PATH, ROUTER_SHARDS, ROUTER_SHARD_BASE_PORT,
+                    GRPC_SERVER_MODE, STARTUP_TIMEOUT, SHUTDOWN_GRACE, ROUTER_FRONT_SESSION_TTL,
+                    ROUTER_FRONT_MAX_SESSIONS)
+from aio_server import AsyncGRPCServer
+from channel_pool import CHANNEL_OPTIONS
+from grpc_client import GRPCClient, shard_for
+from grpc_server import SERVER_OPTIONS, bind_port
+
+FILE_TRANSFER_SERVICE = "file_transfer.FileTransferService"
+NODE_MANAGEMENT_SERVICE = "file_transfer.NodeManagementService"
+
+# FileChunk field numbers of the routing keys
+TRANSFER_ID_FIELD = 1
+FILENAME_FIELD = 5
+TARGET_NODE_FIELD = 6
+
+
+def _varint(message, position):
+    """Decode the varint at position, returning it and the position after it"""
+    value = shift = 0
+    while True:
+        byte = message[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def string_field(message, field_number):
+    """A string field of a serialized message, found by walking its tags without parsing the rest.
+
+    Other fields are skipped by their length, so chunk data is never copied or
+    decoded. Fields are serialized in number order, so transfer_id is the first
+    thing in a FileChunk.
+    """
+    position = 0
+    try:
+        while position < len(message):
+            key, position = _varint(message, position)
+            wire_type = key & 7
+            if wire_type == 0:
+                _, position = _varint(message, position)
+            elif wire_type == 1:
+                position += 8
+            elif wire_type == 5:
+                position += 4
+            elif wire_type == 2:
+                length, position = _varint(message, position)
+                if key >> 3 == field_number:
+                    return message[position:position + length].decode()
+                position += length
+            else:
+                break  # groups, which file_transfer.proto doesn't use
+    except (IndexError, UnicodeDecodeError):
+        pass  # a malformed message, the shard rejects it
+    return ""
+
+
+class RouterFront(AsyncGRPCServer):
+    """grpc.aio server on SERVER_GRPC_PORT passing every call on to one of the shards"""
+
+    def __init__(self, shard_ports):
+        super().__init__("router", SERVER_DISK_PATH, SERVER_GRPC_PORT, is_router=True)
+        self.shard_ports = shard_ports
+        self.channels = []
+        # transfer_id -> (shard, last call), for sessions StartTransfer opened without an id, oldest first
+        self.sessions = collections.OrderedDict()
+        self.rotation = itertools.cycle(range(len(shard_ports)))
+
+    async def _start(self):
+        self.channels = [grpc.aio.insecure_channel(f"localhost:{port}", options=CHANNEL_OPTIONS)
+                         for port in self.shard_ports]
+        server = grpc.aio.server(options=SERVER_OPTIONS)
+        # No (de)serializers: requests and responses stay as bytes, only routing keys get parsed
+        server.add_generic_rpc_handlers((
+            grpc.method_handlers_generic_handler(FILE_TRANSFER_SERVICE, {
+                'StartTransfer': grpc.unary_unary_rpc_method_handler(self.StartTransfer),
+                'TransferChunk': grpc.unary_unary_rpc_method_handler(self.TransferChunk),
+                'CompleteTransfer': grpc.unary_unary_rpc_method_handler(self.CompleteTransfer),
+                'StreamFile': grpc.stream_unary_rpc_method_handler(self.StreamFile),
+                'QueryTransfer': grpc.unary_unary_rpc_method_handler(self.QueryTransfer),
+                'GetFileInfo': grpc.unary_unary_rpc_method_handler(self.GetFileInfo),
+                'ListFiles': grpc.unary_unary_rpc_method_handler(self.ListFiles),
+            }),
+            grpc.method_handlers_generic_handler(NODE_MANAGEMENT_SERVICE, {
+                'RegisterNode': grpc.unary_unary_rpc_method_handler(self.RegisterNode),
+                'UnregisterNode': grpc.unary_unary_rpc_method_handler(self.UnregisterNode),
+                'GetActiveNodes': grpc.unary_unary_rpc_method_handler(self.GetActiveNodes),
+                'HealthCheck': grpc.unary_unary_rpc_method_handler(self.HealthCheck),
+            }),
+        ))
+
+        if not bind_port(server, self.port):
+            return None
+        await server.start()
+        return server
+
+    async def _close_channels(self):
+        """Close the channels to the shards"""
+        channels, self.channels = self.channels, []
+        for channel in channels:
+            await channel.close()
+
+    async def _forward(self, shard, service, method, request, context, streaming=False):
+        """Make the same call on a shard, passing its status on if it fails"""
+        channel = self.channels[shard]
+        path = f"/{service}/{method}"
+        call = channel.stream_unary(path) if streaming else channel.unary_unary(path)
+        try:
+            return await call(request)
+        except grpc.aio.AioRpcError as e:
+            await context.abort(e.code(), e.details())
+
+    def _shard(self, key):
+        return shard_for(key, len(self.channels))
+
+    def _session_shard(self, transfer_id):
+        session = self.sessions.get(transfer_id)
+        if session is None:
+            return self._shard(transfer_id)
+        self._remember(transfer_id, session[0])
+        return session[0]
+
+    def _remember(self, transfer_id, shard):
+        """Note a session's shard, forgetting sessions idle for ROUTER_FRONT_SESSION_TTL.
+
+        Senders that give up without CompleteTransfer would otherwise leave
+        their entries behind, so there are never more than ROUTER_FRONT_MAX_SESSIONS.
+        """
+        now = time.monotonic()
+        self.sessions[transfer_id] = (shard, now)
+        self.sessions.move_to_end(transfer_id)
+        while self.sessions:
+            _, (_, last_call) = next(iter(self.sessions.items()))
+            if now - last_call < ROUTER_FRONT_SESSION_TTL and len(self.sessions) <= ROUTER_FRONT_MAX_SESSIONS:
+                break
+            self.sessions.popitem(last=False)
+
+    async def StartTransfer(self, request, context):
+        start = file_transfer_pb2.TransferRequest.FromString(request)
+        shard = self._shard(start.transfer_id or start.target_node or start.filename)
+        response = await self._forward(shard, FILE_TRANSFER_SERVICE, 'StartTransfer', request, context)
+        if not start.transfer_id:
+            # The shard picked the session id, later calls only carry that
+            started = file_transfer_pb2.TransferResponse.FromString(response)
+            if started.success:
+                self._remember(started.transfer_id, shard)
+        return response
+
+    async def TransferChunk(self, request, context):
+        transfer_id = string_field(request, TRANSFER_ID_FIELD)
+        return await self._forward(self._session_shard(transfer_id), FILE_TRANSFER_SERVICE, 'TransferChunk',
+                                   request, context)
+
+    async def CompleteTransfer(self, request, context):
+        transfer_id = file_transfer_pb2.CompleteTransferRequest.FromString(request).transfer_id
+        response = await self._forward(self._session_shard(transfer_id), FILE_TRANSFER_SERVICE,
+                                       'CompleteTransfer', request, context)
+        self.sessions.pop(transfer_id, None)
+        return response
+
+    async def QueryTransfer(self, request, context):
+        transfer_id = file_transfer_pb2.QueryTransferRequest.FromString(request).transfer_id
+        return await self._forward(self._session_shard(transfer_id), FILE_TRANSFER_SERVICE, 'QueryTransfer',
+                                   request, context)
+
+    async def StreamFile(self, request_iterator, context):
+        chunks = request_iterator.__aiter__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            return file_transfer_pb2.TransferResponse(success=False, message="Empty transfer stream") \
+                .SerializeToString()
+
+        # The first chunk carries the transfer metadata
+        shard = self._shard(string_field(first, TRANSFER_ID_FIELD) or string_field(first, TARGET_NODE_FIELD)
+                            or string_field(first, FILENAME_FIELD))
+
+        async def stream():
+            yield first
+            async for chunk in chunks:
+                yield chunk
+
+        return await self._forward(shard, FILE_TRANSFER_SERVICE, 'StreamFile', stream(), context,
+                                   streaming=True)
+
+    async def GetFileInfo(self, request, context):
+        # Every shard sees the same disk
+        return await self._forward(next(self.rotation), FILE_TRANSFER_SERVICE, 'GetFileInfo', request, context)
+
+    async def ListFiles(self, request, context):
+        return await self._forward(next(self.rotation), FILE_TRANSFER_SERVICE, 'ListFiles', request, context)
+
+    async def RegisterNode(self, request, context):
+        return await self._broadcast('RegisterNode', request, context)
+
+    async def UnregisterNode(self, request, context):
+        return await self._broadcast('UnregisterNode', request, context)
+
+    async def _broadcast(self, method, request, context):
+        """Apply a node registration change on every shard, answering with the first shard's response"""
+        responses = [await self._forward(shard, NODE_MANAGEMENT_SERVICE, method, request, context)
+                     for shard in range(len(self.channels))]
+        return responses[0]
+
+    async def GetActiveNodes(self, request, context):
+        return await self._forward(next(self.rotation), NODE_MANAGEMENT_SERVICE, 'GetActiveNodes', request, context)
+
+    async def HealthCheck(self, request, context):
+        response = await self._forward(next(self.rotation), NODE_MANAGEMENT_SERVICE, 'HealthCheck', request,
+                                       context)
+        # Senders that read the shard ports take their transfers there directly
+        health = file_transfer_pb2.HealthResponse.FromString(response)
+        health.shard_ports.extend(self.shard_ports)
+        return health.SerializeToString()
+
+
+class ShardedRouter:
+    """RouterManager's start/stop/ready interface over the front and its shard processes"""
+
+    def __init__(self, shards=ROUTER_SHARDS, server_mode=GRPC_SERVER_MODE):
+        self.shards = shards
+        self.server_mode = server_mode
+        self.shard_ports = [ROUTER_SHARD_BASE_PORT + shard for shard in range(shards)]
+        self.processes = []
+        self.front = None
+        self.ready = threading.Event()  # set once every shard and the front accept connections
+        self.logger = logging.getLogger("RouterFront")
+
+    def start(self):
+        """Start the shard processes, then the front once they all answer HealthCheck"""
+        for shard in range(self.shards):
+            command = [sys.executable, os.path.join(BASE_DIR, "router.py"), "--shard", str(shard),
+                       f"--{self.server_mode}"]
+            self.processes.append(subprocess.Popen(command, cwd=BASE_DIR))
+
+        client = GRPCClient()
+        pending = dict(zip(self.shard_ports, self.processes))
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while pending and time.monotonic() < deadline:
+            for port, process in list(pending.items()):
+                if process.poll() is None and client.health_check(port):
+                    del pending[port]
+            if pending:
+                time.sleep(0.2)
+        if pending:
+            print(f"✗ Router shards on ports {', '.join(map(str, pending))} failed to start")
+            return
+
+        self.front = RouterFront(self.shard_ports)
+        if self.front.start() is None:
+            print("✗ Router front failed to start")
+            return
+        print(f"✓ Router front started on port {SERVER_GRPC_PORT} with {self.shards} shards")
+        self.ready.set()
+
+    def stop(self, drain=False, grace=SHUTDOWN_GRACE):
+        """Stop the front, then the shards, which drain their own transfers and forward queues"""
+        self.ready.clear()
+        if self.front:
+            self.front.stop(grace=grace if drain else 5)
+            self.front = None
+
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout=grace + 5)
+            except subprocess.TimeoutExpired:
+                self.logger.warning(f"Router shard {process.pid} did not stop, killing it")
+                process.kill()
+        self.processes = []
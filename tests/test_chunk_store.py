@@ -0,0 +1,121 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+import checksums
+import file_transfer_pb2
+from chunk_store import ChunkStore
+from grpc_server import FileTransferServicer
+
+BLOCK_SIZE = 1024
+
+
+def _blocks(*fills):
+    """A file made of one BLOCK_SIZE block per fill byte"""
+    return b"".join(bytes([fill]) * BLOCK_SIZE for fill in fills)
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.store = ChunkStore(self.temp.name, block_size=BLOCK_SIZE)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def _ingest(self, filename, data):
+        source_path = os.path.join(self.temp.name, f".{filename}.part")
+        with open(source_path, 'wb') as f:
+            f.write(data)
+        self.store.ingest(source_path, filename)
+
+    def test_blocks_go_with_the_last_file_referencing_them(self):
+        shared, first_only, second_only = (self.store.digest(_blocks(fill)) for fill in (1, 2, 3))
+        self._ingest("a.bin", _blocks(1, 2))
+        self._ingest("b.bin", _blocks(1, 3, 3))
+
+        self.store.remove("a.bin")
+        self.assertTrue(self.store.has(shared))
+        self.assertFalse(self.store.has(first_only))
+
+        # Overwriting drops the previous version's blocks, a block listed twice is counted twice
+        self._ingest("b.bin", _blocks(3))
+        self.assertFalse(self.store.has(shared))
+        self.assertTrue(self.store.has(second_only))
+        self.store.remove("b.bin")
+        self.assertFalse(self.store.has(second_only))
+
+    def test_stored_file_is_read_from_its_blocks(self):
+        data = os.urandom(3 * BLOCK_SIZE + 100)
+        self._ingest("r.bin", data)
+
+        stored = self.store.open("r.bin")
+        self.assertEqual(stored.stat().st_size, len(data))
+        with stored.open() as reader:
+            self.assertEqual(bytes(reader.read(0, BLOCK_SIZE)), data[:BLOCK_SIZE])
+            self.assertEqual(bytes(reader.read(BLOCK_SIZE - 10, 1500)), data[BLOCK_SIZE - 10:BLOCK_SIZE + 1490])
+            self.assertEqual(bytes(reader.read(3 * BLOCK_SIZE, BLOCK_SIZE)), data[3 * BLOCK_SIZE:])
+            self.assertEqual(bytes(reader.read(len(data), BLOCK_SIZE)), b"")
+        self.assertIsNone(self.store.open("missing.bin"))
+
+
+class HeldBlockCollectedTest(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.servicer = FileTransferServicer("cloud1", os.path.join(self.temp.name, "cloud1"))
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def _chunk(self, transfer_id, data, chunk_number, total_chunks, chunk_size):
+        return file_transfer_pb2.FileChunk(
+            transfer_id=transfer_id,
+            chunk_number=chunk_number,
+            total_chunks=total_chunks,
+            offset=(chunk_number - 1) * chunk_size,
+            data=data,
+            checksum=checksums.checksum(data, checksums.CHECKSUM_CRC32),
+            checksum_type=checksums.CHECKSUM_CRC32
+        )
+
+    def test_chunks_whose_blocks_were_collected_are_asked_again(self):
+        store = self.servicer.chunk_store
+        block_size = store.block_size
+        old = os.urandom(2 * block_size)
+        new = old + os.urandom(block_size)
+        source_path = os.path.join(self.temp.name, "old.part")
+        with open(source_path, 'wb') as f:
+            f.write(old)
+        store.ingest(source_path, "old.bin")
+
+        transfer_id = "held-block-test"
+        started = self.servicer.StartTransfer(file_transfer_pb2.TransferRequest(
+            filename="new.bin",
+            file_size=len(new),
+            target_node="cloud1",
+            sender_node="node1",
+            transfer_id=transfer_id,
+            chunk_size=block_size,
+            chunk_hashes=[store.digest(new[i:i + block_size]) for i in range(0, len(new), block_size)],
+            file_digest=hashlib.sha256(new).hexdigest()
+        ), None)
+        self.assertTrue(started.success, started.message)
+
+        # The blocks held at StartTransfer are collected before the last chunk commits the file
+        store.remove("old.bin")
+        response = self.servicer.TransferChunk(self._chunk(transfer_id, new[2 * block_size:], 3, 3, block_size), None)
+        self.assertFalse(response.success)
+
+        query = self.servicer.QueryTransfer(file_transfer_pb2.QueryTransferRequest(transfer_id=transfer_id), None)
+        self.assertEqual([(r.start, r.end) for r in query.missing], [(1, 2)])
+
+        for chunk_number in (1, 2):
+            data = new[(chunk_number - 1) * block_size:chunk_number * block_size]
+            response = self.servicer.TransferChunk(self._chunk(transfer_id, data, chunk_number, 3, block_size), None)
+        self.assertTrue(response.success, response.message)
+        self.assertEqual(b"".join(store.read_file("new.bin")), new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,18 @@
-import os
 import threading
-import math
-import time
 from config import IP_MAP, SERVER_IP, SERVER_GRPC_PORT
 from grpc_client import GRPCClient
+from chunk_store import local_file
 
 class VirtualNetwork:
     def __init__(self, manager=None):
         self.manager = manager
         self.ip_map = IP_MAP
         self.grpc_client = GRPCClient()
-        self.bandwidth_bytes_per_sec = 125_000_000
         self.server_ip = SERVER_IP
         self.server_grpc_port = SERVER_GRPC_PORT
         self.server_disk_path = "./assets/server/"
         self.transfer_semaphore = threading.Semaphore(10)
-        self.target_chunk_time = 0.1
-        self.min_chunk_size = 1024 * 64
-        self.max_chunk_size = 5 * 1024 * 1024
+        # Chunk sizing lives in GRPCClient (see chunk_sizer.py)
 
     # All FTP methods removed - using gRPC only
 
@@ -29,11 +24,12 @@ class VirtualNetwork:
             return f"Error: File {filename} not found on {source_ip}"
 
         source_node_name = self.ip_map[source_ip]["node_name"]
-        source_path = os.path.join(self.ip_map[source_ip]["disk_path"], filename)
 
+        # Cloud files may only exist as chunk-store manifests, those are sent from their blocks
+        source = local_file(self.ip_map[source_ip]["disk_path"], filename)
         # Use gRPC client to send file to router
         result = self.grpc_client.send_file(
-            file_path=source_path,
+            file_path=source,
             filename=filename,
             target_node=target_node_name,
             sender_node=source_node_name,
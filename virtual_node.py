@@ -1,10 +1,19 @@
 import os
-import json
 import threading
 from virtual_network import VirtualNetwork
-from config import IP_MAP, SERVER_GRPC_PORT
+from config import (IP_MAP, SERVER_GRPC_PORT, UPLOAD_WRITE_QUORUM, ROUTER_SIDE_REPLICATION, CLOUD_NODES,
+                    CHUNK_STORE_ENABLED, STARTUP_TIMEOUT, SHUTDOWN_GRACE, DOWNLOAD_TIMEOUT, PAYLOAD_DEFAULT_KIND)
 from grpc_server import GRPCServer
 from grpc_client import GRPCClient
+from chunk_store import ChunkStore, local_file
+from disk_metadata import metadata_store
+from disk_index import disk_index
+from lifecycle import shutdown_event
+from payload import write_payload, PAYLOAD_KINDS
+
+INVALID_COMMAND = ("Invalid command. Use: Valid commands: ls, touch <file> [size] [content], trunc <file> [size] [content], send <file> <node>, "
+                   "upload <file>, download <file> [timeout], del <file|all>, diskprop, stop")
+
 
 class VirtualNode:
     def __init__(self, name, disk_path, ip_address):
@@ -18,7 +27,10 @@ class VirtualNode:
         self.ip_map = IP_MAP
         self.network = VirtualNetwork()
         self.grpc_server = None
+        self.ready = threading.Event()  # set once this node's gRPC server is serving
         self.grpc_client = GRPCClient()
+        # Cloud nodes keep received files in a deduplicating chunk store
+        self.chunk_store = ChunkStore(disk_path) if CHUNK_STORE_ENABLED and name in CLOUD_NODES else None
         self._initialize_disk()
         # Start gRPC server only
         self._start_grpc_server()
@@ -26,39 +38,14 @@ class VirtualNode:
 
     def _initialize_disk(self):
         os.makedirs(self.disk_path, exist_ok=True)
-        metadata_path = os.path.join(self.disk_path, "disk_metadata.json")
-        if os.path.exists(metadata_path):
-            try:
-                with open(metadata_path, 'r') as f:
-                    self.virtual_disk = json.load(f)
-                    self.virtual_disk = {k: int(v) for k, v in self.virtual_disk.items()}
-            except (json.JSONDecodeError, IOError):
-                print(f"Warning: Could not load metadata from {metadata_path}. Starting with empty disk.")
-                self.virtual_disk = {}
-        else:
-            self.virtual_disk = {}
-            self._save_disk()
-        for filename in os.listdir(self.disk_path):
-            if filename != "disk_metadata.json":
-                file_path = os.path.join(self.disk_path, filename)
-                if os.path.isfile(file_path):
-                    size = os.path.getsize(file_path)
-                    self.virtual_disk[filename] = size
-        self._save_disk()
-
-    def _save_disk(self):
-        metadata_path = os.path.join(self.disk_path, "disk_metadata.json")
-        try:
-            with open(metadata_path, 'w') as f:
-                json.dump(self.virtual_disk, f)
-        except IOError as e:
-            print(f"Error saving metadata to {metadata_path}: {e}")
+        # In-memory index shared with this node's gRPC servicer, persisted as it changes
+        self.virtual_disk = disk_index(self.disk_path, self.chunk_store)
 
     def _start_grpc_server(self):
         """Start the gRPC server for this node"""
         try:
             # Nodes are not routers, so is_router=False (default)
-            self.grpc_server = GRPCServer(self.name, self.disk_path, self.grpc_port, is_router=False)
+            self.grpc_server = GRPCServer(self.name, self.disk_path, self.grpc_port, is_router=False, node=self)
 
             # Start server in a separate thread
             def start_server():
@@ -68,6 +55,7 @@ class VirtualNode:
                     self.grpc_server = None
                 else:
                     print(f"gRPC server successfully started for {self.name}")
+                    self.ready.set()
 
             server_thread = threading.Thread(target=start_server, daemon=True)
             server_thread.start()
@@ -87,18 +75,15 @@ class VirtualNode:
             return f"Error: File {filename} not found locally"
 
         # Check if transfer is allowed based on links
-        from links_manager import LinksManager
-        lm = LinksManager()
+        from links_manager import topology
 
-        if not lm.is_transfer_allowed(self.name, target_node_name):
-            return f"Error: Transfer denied. Nodes {self.name} and {target_node_name} are not in the same link."
+        if not topology().is_transfer_allowed(self.name, target_node_name):
+            return f"Error: Transfer denied. No link route between {self.name} and {target_node_name}."
 
         # Use gRPC to send file via router
-        file_path = os.path.join(self.disk_path, filename)
-
         try:
             result = self.grpc_client.send_file(
-                file_path=file_path,
+                file_path=local_file(self.disk_path, filename),
                 filename=filename,
                 target_node=target_node_name,
                 sender_node=self.name,
@@ -118,42 +103,48 @@ class VirtualNode:
         cloud_nodes = ["cloud1", "cloud2", "cloud3"]
         file_path = os.path.join(self.disk_path, filename)
 
-        # Upload to ALL cloud nodes for redundancy
-        successful_uploads = []
-        failed_uploads = []
-
-        for target_cloud in cloud_nodes:
-            try:
-                # Use gRPC to upload to cloud node via router
-                result = self.grpc_client.send_file(
+        # Upload to ALL cloud nodes, returning once the write quorum has acked
+        try:
+            if ROUTER_SIDE_REPLICATION:
+                # Send the bytes once, the router replicates them to the clouds
+                results = self.grpc_client.replicate_file(
                     file_path=file_path,
                     filename=filename,
-                    target_node=target_cloud,
                     sender_node=self.name,
-                    port=SERVER_GRPC_PORT
+                    port=SERVER_GRPC_PORT,
+                    replication_factor=len(cloud_nodes)
                 )
+            else:
+                results = self.grpc_client.fan_out_file(
+                    file_path=file_path,
+                    filename=filename,
+                    target_nodes=cloud_nodes,
+                    sender_node=self.name,
+                    port=SERVER_GRPC_PORT,
+                    quorum=UPLOAD_WRITE_QUORUM
+                )
+        except Exception:
+            return "✗ Upload failed"
 
-                if "Error" not in result:
-                    successful_uploads.append(target_cloud)
-                else:
-                    failed_uploads.append(target_cloud)
-
-            except Exception:
-                failed_uploads.append(target_cloud)
+        successful_uploads = [cloud for cloud, ok in results.items() if ok]
+        pending_uploads = [cloud for cloud, ok in results.items() if ok is None]
 
         if successful_uploads:
-            return f"✓ Uploaded to {len(successful_uploads)}/3 clouds"
+            result = f"✓ Uploaded to {len(successful_uploads)}/3 clouds"
+            if pending_uploads:
+                result += f" ({len(pending_uploads)} finishing in background)"
+            return result
+        elif pending_uploads:
+            # No cloud acked in time, but the replicas are still on their way
+            return f"⏳ Upload in progress to {len(pending_uploads)}/3 clouds, acknowledged later"
         else:
             return "✗ Upload failed"
 
     # ----------  DOWNLOAD ----------
-    def download(self, filename):
+    def download(self, filename, timeout=DOWNLOAD_TIMEOUT):
         if not self.is_running:
             return f"Error: VM {self.name} is not running"
 
-        from links_manager import LinksManager   # local import to avoid circular
-        lm = LinksManager()
-
         # discover which cloud node owns the file
         owner = None
         for cloud in ["cloud1", "cloud2", "cloud3"]:
@@ -165,7 +156,7 @@ class VirtualNode:
 
         # link check
         # Cloud nodes bypass link checks for downloads
-        # if not any({self.name, owner} <= set(nodes) for nodes in lm.links.values()):
+        # if not topology().in_same_link(self.name, owner):
         #     return f"Error: {self.name} and {owner} are not in the same link – download denied"
 
         # Download the file from the cloud node via router
@@ -181,24 +172,16 @@ class VirtualNode:
             # Use the existing send mechanism but from cloud to this node
             owner_ip = next(ip for ip, info in IP_MAP.items() if info["node_name"] == owner)
 
+            # This node's servicer records the file in the disk index once it's committed
+            version = self.virtual_disk.version(filename)
+
             # Request router to coordinate transfer from cloud to this node via gRPC
             result = self.network.send_file_grpc(filename, owner_ip, VirtualNode._peek_virtual_disk(owner), self.name)
 
             if "Error" not in result:
-                # Wait a moment for file transfer to complete
-                import time
-                time.sleep(2)
-
-                # Refresh disk and check if file was received
-                self._refresh_disk()
-                local_file_path = os.path.join(self.disk_path, filename)
-                if os.path.exists(local_file_path):
-                    file_size = os.path.getsize(local_file_path)
-                    self.virtual_disk[filename] = file_size
-                    self._save_disk()
+                if self.virtual_disk.wait_for_update(filename, version, timeout):
                     return f"✓ Downloaded {filename}"
-                else:
-                    return f"⏳ Transfer in progress"
+                return f"⏳ Transfer in progress"
             else:
                 return f"✗ Download failed"
 
@@ -208,16 +191,9 @@ class VirtualNode:
     # ----------  helper ----------
     @staticmethod
     def _peek_virtual_disk(node_name):
-        """return the virtual_disk dict of a cloud node without instantiating it"""
+        """return the virtual_disk table of a cloud node without instantiating it"""
         disk_path = next(info["disk_path"] for info in IP_MAP.values() if info["node_name"] == node_name)
-        meta = os.path.join(disk_path, "disk_metadata.json")
-        if not os.path.exists(meta):
-            return {}
-        try:
-            with open(meta) as f:
-                return {k: int(v) for k, v in json.load(f).items() if not k.endswith(".metadata")}
-        except Exception:
-            return {}
+        return metadata_store(disk_path)
 
     def start(self):
         if self.is_running:
@@ -237,10 +213,11 @@ class VirtualNode:
 
         return f"✓ {self.name} started"
 
-    def stop(self):
+    def stop(self, grace=5):
         if not self.is_running:
             return f"{self.name} already stopped"
         self.is_running = False
+        self.ready.clear()
 
         # Unregister from router via gRPC (silently)
         try:
@@ -253,22 +230,15 @@ class VirtualNode:
         except Exception:
             pass  # Silent unregistration
 
-        # Stop gRPC server
+        # Stop gRPC server, letting transfers already under way finish
         if self.grpc_server:
-            self.grpc_server.stop()
+            self.grpc_server.stop(grace=grace)
 
         return f"✓ {self.name} stopped"
 
     def _refresh_disk(self):
-        # Clear existing virtual disk entries, but keep metadata if it exists
-        self.virtual_disk = {k: v for k, v in self.virtual_disk.items() if k == "disk_metadata.json"}
-        for filename in os.listdir(self.disk_path):
-            if filename != "disk_metadata.json":
-                file_path = os.path.join(self.disk_path, filename)
-                if os.path.isfile(file_path):
-                    size = os.path.getsize(file_path)
-                    self.virtual_disk[filename] = size
-        self._save_disk()
+        # Only rescans if something outside this node changed the disk
+        self.virtual_disk.refresh()
 
     def ls(self):
         self._refresh_disk()
@@ -277,33 +247,32 @@ class VirtualNode:
             return "No files found"
         return "\n".join(files)
 
-    def touch(self, filename, size=0):
+    def touch(self, filename, size=0, kind=PAYLOAD_DEFAULT_KIND):
         if filename in self.virtual_disk:
             return f"Error: File {filename} already exists"
+        if kind not in PAYLOAD_KINDS:
+            return f"Error: Unknown content {kind}, use one of {', '.join(PAYLOAD_KINDS)}"
         file_path = os.path.join(self.disk_path, filename)
         try:
             # Convert MB to bytes (1 MB = 1,048,576 bytes)
             size_bytes = size * 1024 * 1024
-            with open(file_path, 'wb') as f:
-                if size_bytes > 0:
-                    f.write(b'\0' * size_bytes)
+            write_payload(file_path, size_bytes, kind)
             self.virtual_disk[filename] = size_bytes
-            self._save_disk()
             return f"Created {filename} with size {size} MB"
         except Exception as e:
             return f"Error creating file {filename}: {e}"
 
-    def trunc(self, filename, size):
+    def trunc(self, filename, size, kind=PAYLOAD_DEFAULT_KIND):
         if filename not in self.virtual_disk:
             return f"Error: File {filename} not found"
+        if kind not in PAYLOAD_KINDS:
+            return f"Error: Unknown content {kind}, use one of {', '.join(PAYLOAD_KINDS)}"
         file_path = os.path.join(self.disk_path, filename)
         try:
             # Convert MB to bytes (1 MB = 1,048,576 bytes)
             size_bytes = size * 1024 * 1024
-            with open(file_path, 'wb') as f:
-                f.write(b'\0' * size_bytes)
+            write_payload(file_path, size_bytes, kind)
             self.virtual_disk[filename] = size_bytes
-            self._save_disk()
             return f"Truncated {filename} to {size} MB"
         except Exception as e:
             return f"Error truncating file {filename}: {e}"
@@ -313,24 +282,29 @@ class VirtualNode:
             for fname in list(self.virtual_disk.keys()):
                 if fname != "disk_metadata.json":
                     try:
-                        os.remove(os.path.join(self.disk_path, fname))
+                        self._remove_file(fname)
                         del self.virtual_disk[fname]
                     except Exception as e:
                         print(f"Error deleting {fname}: {e}")
-            self._save_disk()
             return "Deleted all files"
         if filename not in self.virtual_disk:
             return f"Error: File {filename} not found"
         try:
-            os.remove(os.path.join(self.disk_path, filename))
+            self._remove_file(filename)
             del self.virtual_disk[filename]
-            self._save_disk()
             return f"Deleted {filename}"
         except Exception as e:
             return f"Error deleting {filename}: {e}"
 
+    def _remove_file(self, filename):
+        """Delete a file from the disk, or drop it from a cloud's chunk store"""
+        file_path = os.path.join(self.disk_path, filename)
+        if self.chunk_store and not os.path.exists(file_path) and self.chunk_store.remove(filename):
+            return
+        os.remove(file_path)
+
     def diskprop(self):
-        used = sum(self.virtual_disk.values())
+        used = self.virtual_disk.total_size()
         return f"Disk: {used} bytes used"
 
     def set_var(self, var_name, value):
@@ -350,12 +324,8 @@ class VirtualNode:
 
     def _in_same_link(self, target):
         """Check if `self.name` and `target` appear in the same link."""
-        import links_manager  # local import
-        lm = links_manager.LinksManager()
-        for members in lm.links.values():
-            if self.name in members and target in members:
-                return True
-        return False
+        from links_manager import topology  # local import
+        return topology().in_same_link(self.name, target)
 
     def get(self, filename, source_node_name):
         """
@@ -411,6 +381,57 @@ class VirtualNode:
         status = "running" if self.is_running else "stopped"
         return f"VirtualNode({self.name}, IP: {self.ip_address}, Status: {status}, Files: {len(self.virtual_disk)}, Memory: {len(self.memory)} variables)"
 
+    def run_command(self, command):
+        """Run one command given as its words (stop excluded), None if it isn't a valid command.
+
+        Shared by the interactive prompt and the NodeControlService of headless nodes.
+        """
+        cmd = command[0].lower()
+        if cmd == "ls":
+            return self.ls()
+        elif cmd == "touch" and len(command) > 1:
+            size = int(command[2]) if len(command) > 2 and command[2].isdigit() else 0
+            kind = command[3].lower() if len(command) > 3 else PAYLOAD_DEFAULT_KIND
+            return self.touch(command[1], size, kind)
+        elif cmd == "trunc" and len(command) > 1:
+            size = int(command[2]) if len(command) > 2 and command[2].isdigit() else 0
+            kind = command[3].lower() if len(command) > 3 else PAYLOAD_DEFAULT_KIND
+            return self.trunc(command[1], size, kind)
+        elif cmd == "send" and len(command) == 3:
+            return self.send(command[1], command[2])
+        elif cmd == "del" and len(command) == 2:
+            return self.del_file(command[1])
+        elif cmd == "diskprop" and len(command) == 1:
+            return self.diskprop()
+        elif cmd == "set" and len(command) == 3:
+            return self.set_var(command[1], command[2])
+        elif cmd == "get" and len(command) == 2:
+            return self.get_var(command[1])
+        elif cmd == "add" and len(command) == 3:
+            return self.execute_instruction(" ".join(command))
+        elif cmd == "get" and len(command) == 3:
+            return self.get(command[1], command[2])
+        elif cmd == "upload" and len(command) == 2:
+            return self.upload(command[1])
+        elif cmd == "download" and len(command) == 2:
+            return self.download(command[1])
+        elif cmd == "download" and len(command) == 3 and command[2].isdigit():
+            return self.download(command[1], timeout=int(command[2]))
+        return None
+
+    def run_headless(self, shutdown=None):
+        """Serve without a prompt until SIGINT/SIGTERM (or shutdown is set), then stop gracefully"""
+        shutdown = shutdown or shutdown_event()
+        if not self.ready.wait(STARTUP_TIMEOUT):
+            print(f"✗ {self.name} failed to start")
+            self.stop()
+            return False
+
+        print(f"✓ {self.name} ready on port {self.grpc_port}")
+        shutdown.wait()
+        print(self.stop(grace=SHUTDOWN_GRACE))
+        return True
+
     def run_interactive(self):
         print(self)
         while self.is_running:
@@ -418,38 +439,11 @@ class VirtualNode:
                 command = input(f"{self.name}>> ").strip().split()
                 if not command:
                     continue
-                cmd = command[0].lower()
-                if cmd == "ls":
-                    print(self.ls())
-                elif cmd == "touch" and len(command) > 1:
-                    size = int(command[2]) if len(command) > 2 and command[2].isdigit() else 0
-                    print(self.touch(command[1], size))
-                elif cmd == "trunc" and len(command) > 1:
-                    size = int(command[2]) if len(command) > 2 and command[2].isdigit() else 0
-                    print(self.trunc(command[1], size))
-                elif cmd == "send" and len(command) == 3:
-                    print(self.send(command[1], command[2]))
-                elif cmd == "del" and len(command) == 2:
-                    print(self.del_file(command[1]))
-                elif cmd == "diskprop" and len(command) == 1:
-                    print(self.diskprop())
-                elif cmd == "set" and len(command) == 3:
-                    print(self.set_var(command[1], command[2]))
-                elif cmd == "get" and len(command) == 2:
-                    print(self.get_var(command[1]))
-                elif cmd == "add" and len(command) == 3:
-                    print(self.execute_instruction(" ".join(command)))
-                elif cmd == "get" and len(command) == 3:
-                    print(self.get(command[1], command[2]))
-                elif cmd == "upload" and len(command) == 2:
-                    print(self.upload(command[1]))
-                elif cmd == "download" and len(command) == 2:
-                    print(self.download(command[1]))
-                elif cmd == "stop":
+                if command[0].lower() == "stop":
                     print(self.stop())
                     break
-                else:
-                    print("Invalid command. Use: Valid commands: ls, touch <file> [size], trunc <file> [size],send <file> <node>, upload <file>, download <file>, del <file|all>, diskprop, stop")
+                output = self.run_command(command)
+                print(output if output is not None else INVALID_COMMAND)
             except EOFError:
                 print("\nEOF detected. Stopping VM.")
                 print(self.stop())